@@ -1,7 +1,9 @@
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config
+from sqlalchemy import inspect
 from sqlalchemy import pool
 from alembic import context
+from alembic.script import ScriptDirectory
 import sys
 import os
 
@@ -10,7 +12,7 @@ sys.path.append(os.getcwd())
 
 # ИМПОРТИРУЕМ ВАШИ МОДЕЛИ
 from app.database import Base
-from app.models import UserWallet, Chat, Message, Payment, UserSession, EmailCode
+from app.models import UserWallet, Chat, Message, Payment, UserSession, EmailCode, GenerationJob, PaymentEvent
 
 config = context.config
 
@@ -59,6 +61,14 @@ def run_migrations_online() -> None:
             include_object=include_object # <--- Подключаем защиту
         )
 
+        if not inspect(connection).has_table("chats"):
+            # Пустая база: первая миграция рассчитана на уже созданные таблицы,
+            # поэтому схема создаётся по моделям и помечается как head
+            target_metadata.create_all(connection)
+            context.get_context().stamp(ScriptDirectory.from_config(config), "head")
+            connection.commit()
+            return
+
         with context.begin_transaction():
             context.run_migrations()
 
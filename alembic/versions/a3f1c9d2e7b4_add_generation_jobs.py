@@ -0,0 +1,55 @@
+"""add generation_jobs
+
+Revision ID: a3f1c9d2e7b4
+Revises: c8e0ecf74966
+Create Date: 2026-01-20 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f1c9d2e7b4'
+down_revision = 'c8e0ecf74966'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'generation_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_casdoor_id', sa.String(), nullable=True),
+        sa.Column('chat_id', sa.Integer(), nullable=True),
+        sa.Column('model', sa.String(), nullable=True),
+        sa.Column('prompt', sa.Text(), nullable=True),
+        sa.Column('attachment_url', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('fal_request_id', sa.String(), nullable=True),
+        sa.Column('progress', sa.Text(), nullable=True),
+        sa.Column('result_url', sa.String(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('cost', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_generation_jobs_id'), 'generation_jobs', ['id'], unique=False)
+    op.create_index(op.f('ix_generation_jobs_user_casdoor_id'), 'generation_jobs', ['user_casdoor_id'], unique=False)
+    op.create_index(op.f('ix_generation_jobs_chat_id'), 'generation_jobs', ['chat_id'], unique=False)
+    op.create_index(op.f('ix_generation_jobs_model'), 'generation_jobs', ['model'], unique=False)
+    op.create_index(op.f('ix_generation_jobs_status'), 'generation_jobs', ['status'], unique=False)
+    op.create_index(op.f('ix_generation_jobs_fal_request_id'), 'generation_jobs', ['fal_request_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_generation_jobs_fal_request_id'), table_name='generation_jobs')
+    op.drop_index(op.f('ix_generation_jobs_status'), table_name='generation_jobs')
+    op.drop_index(op.f('ix_generation_jobs_model'), table_name='generation_jobs')
+    op.drop_index(op.f('ix_generation_jobs_chat_id'), table_name='generation_jobs')
+    op.drop_index(op.f('ix_generation_jobs_user_casdoor_id'), table_name='generation_jobs')
+    op.drop_index(op.f('ix_generation_jobs_id'), table_name='generation_jobs')
+    op.drop_table('generation_jobs')
@@ -0,0 +1,26 @@
+"""add share snapshot versions to chats
+
+Revision ID: a8e4b2c6d913
+Revises: f3c9d1e8a240
+Create Date: 2026-03-03 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e4b2c6d913'
+down_revision = 'f3c9d1e8a240'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('chats', sa.Column('share_version', sa.Integer(), nullable=True))
+    op.add_column('chats', sa.Column('share_published_version', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('chats', 'share_published_version')
+    op.drop_column('chats', 'share_version')
@@ -0,0 +1,24 @@
+"""add result kind to generation jobs
+
+Revision ID: b5d1f7e3a942
+Revises: a8e4b2c6d913
+Create Date: 2026-03-04 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d1f7e3a942'
+down_revision = 'a8e4b2c6d913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('generation_jobs', sa.Column('result_kind', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('generation_jobs', 'result_kind')
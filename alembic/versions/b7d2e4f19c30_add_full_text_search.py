@@ -0,0 +1,58 @@
+"""add full-text search
+
+Revision ID: b7d2e4f19c30
+Revises: a3f1c9d2e7b4
+Create Date: 2026-01-27 12:00:00.000000
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4f19c30'
+down_revision = 'a3f1c9d2e7b4'
+branch_labels = None
+depends_on = None
+
+TS_CONFIG = os.getenv("SEARCH_TS_CONFIG", "russian")
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    vector_type = postgresql.TSVECTOR() if dialect == 'postgresql' else sa.Text()
+    op.add_column('chats', sa.Column('search_vector', vector_type, nullable=True))
+    op.add_column('messages', sa.Column('search_vector', vector_type, nullable=True))
+
+    if dialect == 'postgresql':
+        op.execute(sa.text("UPDATE chats SET search_vector = to_tsvector(CAST(:cfg AS regconfig), coalesce(title, ''))")
+                   .bindparams(cfg=TS_CONFIG))
+        op.execute(sa.text("UPDATE messages SET search_vector = to_tsvector(CAST(:cfg AS regconfig), coalesce(content, ''))")
+                   .bindparams(cfg=TS_CONFIG))
+        # CONCURRENTLY не работает внутри транзакции
+        with op.get_context().autocommit_block():
+            op.create_index('ix_chats_search_vector', 'chats', ['search_vector'],
+                            postgresql_using='gin', postgresql_concurrently=True)
+            op.create_index('ix_messages_search_vector', 'messages', ['search_vector'],
+                            postgresql_using='gin', postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(title, tokenize='unicode61')")
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, tokenize='unicode61')")
+        op.execute("INSERT INTO chats_fts (rowid, title) SELECT id, coalesce(title, '') FROM chats")
+        op.execute("INSERT INTO messages_fts (rowid, content) SELECT id, coalesce(content, '') FROM messages")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index('ix_messages_search_vector', table_name='messages', postgresql_concurrently=True)
+            op.drop_index('ix_chats_search_vector', table_name='chats', postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS messages_fts")
+        op.execute("DROP TABLE IF EXISTS chats_fts")
+    op.drop_column('messages', 'search_vector')
+    op.drop_column('chats', 'search_vector')
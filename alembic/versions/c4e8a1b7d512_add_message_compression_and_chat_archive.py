@@ -0,0 +1,30 @@
+"""add message compression and chat archive
+
+Revision ID: c4e8a1b7d512
+Revises: b7d2e4f19c30
+Create Date: 2026-02-03 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1b7d512'
+down_revision = 'b7d2e4f19c30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Уже лежащие сообщения досжимаются отдельно: python -m app.services.compression
+    op.add_column('messages', sa.Column('content_compressed', sa.LargeBinary(), nullable=True))
+    op.add_column('chats', sa.Column('archived_at', sa.DateTime(), nullable=True))
+    op.add_column('chats', sa.Column('archive_key', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    # Перед откатом архивные чаты нужно вернуть, а сжатые сообщения — разжать
+    op.drop_column('chats', 'archive_key')
+    op.drop_column('chats', 'archived_at')
+    op.drop_column('messages', 'content_compressed')
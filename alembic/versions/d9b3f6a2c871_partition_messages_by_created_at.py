@@ -0,0 +1,115 @@
+"""partition messages by created_at
+
+Revision ID: d9b3f6a2c871
+Revises: c4e8a1b7d512
+Create Date: 2026-02-10 12:00:00.000000
+
+Возвращает messages.created_at (удалён в 16d1a8046cc0). Для существующих строк время
+неизвестно — берётся время создания чата (инвариант messages.created_at >= chats.created_at).
+
+Postgres: messages пересоздаётся как RANGE-партиционированная по created_at таблица
+(месячные партиции messages_pYYYYMM + DEFAULT). Первичный ключ партиционированной таблицы
+обязан включать ключ партиционирования — (id, created_at); id по-прежнему уникален за счёт
+последовательности. Данные копируются одной транзакцией — на больших базах запускать в окно
+обслуживания. Дальнейшие партиции создаёт app/services/partitions.py.
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b3f6a2c871'
+down_revision = 'c4e8a1b7d512'
+branch_labels = None
+depends_on = None
+
+PARTITIONS_AHEAD = 3
+COLUMNS = "id, chat_id, role, content, content_compressed, image_url, attachment_url, search_vector"
+
+
+def month_start(value, shift=0):
+    index = value.year * 12 + value.month - 1 + shift
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        op.add_column('messages', sa.Column('created_at', sa.DateTime(), nullable=True))
+        op.execute("UPDATE messages SET created_at = coalesce("
+                   "(SELECT chats.created_at FROM chats WHERE chats.id = messages.chat_id), CURRENT_TIMESTAMP)")
+        op.create_index('ix_messages_chat_id_created_at', 'messages', ['chat_id', 'created_at'])
+        return
+
+    op.execute("""
+        CREATE TABLE messages_partitioned (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+            chat_id integer REFERENCES chats (id),
+            role varchar,
+            content text,
+            content_compressed bytea,
+            image_url varchar,
+            attachment_url varchar,
+            search_vector tsvector,
+            created_at timestamp without time zone NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM chats")).scalar()
+    now = datetime.utcnow()
+    start = month_start(oldest or now)
+    last = month_start(now, PARTITIONS_AHEAD)
+    while start <= last:
+        end = month_start(start, 1)
+        op.execute(f"CREATE TABLE messages_p{start:%Y%m} PARTITION OF messages_partitioned "
+                   f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')")
+        start = end
+    op.execute("CREATE TABLE messages_default PARTITION OF messages_partitioned DEFAULT")
+
+    op.execute(f"""
+        INSERT INTO messages_partitioned ({COLUMNS}, created_at)
+        SELECT {', '.join('m.' + c.strip() for c in COLUMNS.split(','))},
+               coalesce(c.created_at, now() AT TIME ZONE 'utc')
+        FROM messages m LEFT JOIN chats c ON c.id = m.chat_id
+    """)
+
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages_partitioned.id")
+    op.drop_table('messages')
+    op.execute("ALTER TABLE messages_partitioned RENAME TO messages")
+    op.execute("ALTER TABLE messages RENAME CONSTRAINT messages_partitioned_pkey TO messages_pkey")
+
+    # Индексы на партиционированной таблице создаются на каждой партиции
+    op.create_index('ix_messages_id', 'messages', ['id'])
+    op.create_index('ix_messages_chat_id_created_at', 'messages', ['chat_id', 'created_at'])
+    op.create_index('ix_messages_search_vector', 'messages', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        op.drop_index('ix_messages_chat_id_created_at', table_name='messages')
+        op.drop_column('messages', 'created_at')
+        return
+
+    op.execute("""
+        CREATE TABLE messages_plain (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq') PRIMARY KEY,
+            chat_id integer REFERENCES chats (id),
+            role varchar,
+            content text,
+            content_compressed bytea,
+            image_url varchar,
+            attachment_url varchar,
+            search_vector tsvector
+        )
+    """)
+    op.execute(f"INSERT INTO messages_plain ({COLUMNS}) SELECT {COLUMNS} FROM messages")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages_plain.id")
+    op.execute("DROP TABLE messages CASCADE")
+    op.execute("ALTER TABLE messages_plain RENAME TO messages")
+    op.execute("ALTER TABLE messages RENAME CONSTRAINT messages_plain_pkey TO messages_pkey")
+    op.create_index('ix_messages_id', 'messages', ['id'])
+    op.create_index('ix_messages_search_vector', 'messages', ['search_vector'], postgresql_using='gin')
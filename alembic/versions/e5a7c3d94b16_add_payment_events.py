@@ -0,0 +1,44 @@
+"""add payment_events
+
+Revision ID: e5a7c3d94b16
+Revises: d9b3f6a2c871
+Create Date: 2026-02-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c3d94b16'
+down_revision = 'd9b3f6a2c871'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'payment_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('event_key', sa.String(), nullable=False),
+        sa.Column('event_type', sa.String(), nullable=True),
+        sa.Column('payment_id', sa.String(), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=True),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('event_key')
+    )
+    op.create_index(op.f('ix_payment_events_id'), 'payment_events', ['id'], unique=False)
+    op.create_index(op.f('ix_payment_events_payment_id'), 'payment_events', ['payment_id'], unique=False)
+    op.create_index(op.f('ix_payment_events_status'), 'payment_events', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_payment_events_status'), table_name='payment_events')
+    op.drop_index(op.f('ix_payment_events_payment_id'), table_name='payment_events')
+    op.drop_index(op.f('ix_payment_events_id'), table_name='payment_events')
+    op.drop_table('payment_events')
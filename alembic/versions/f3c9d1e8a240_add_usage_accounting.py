@@ -0,0 +1,61 @@
+"""add usage_records and usage_daily
+
+Revision ID: f3c9d1e8a240
+Revises: e5a7c3d94b16
+Create Date: 2026-02-24 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9d1e8a240'
+down_revision = 'e5a7c3d94b16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'usage_records',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_casdoor_id', sa.String(), nullable=False),
+        sa.Column('chat_id', sa.Integer(), nullable=True),
+        sa.Column('model', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=True),
+        sa.Column('completion_tokens', sa.Integer(), nullable=True),
+        sa.Column('cached_tokens', sa.Integer(), nullable=True),
+        sa.Column('estimated', sa.Boolean(), nullable=True),
+        sa.Column('cost', sa.Float(), nullable=True),
+        sa.Column('duration_ms', sa.Integer(), nullable=True),
+        sa.Column('ttft_ms', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_usage_records_id'), 'usage_records', ['id'], unique=False)
+    op.create_index('ix_usage_records_user_created_at', 'usage_records', ['user_casdoor_id', 'created_at'], unique=False)
+
+    op.create_table(
+        'usage_daily',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_casdoor_id', sa.String(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('model', sa.String(), nullable=False),
+        sa.Column('requests', sa.Integer(), nullable=True),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=True),
+        sa.Column('completion_tokens', sa.Integer(), nullable=True),
+        sa.Column('cached_tokens', sa.Integer(), nullable=True),
+        sa.Column('cost', sa.Float(), nullable=True),
+        sa.Column('duration_ms', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_casdoor_id', 'day', 'model', name='uq_usage_daily_user_day_model')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('usage_daily')
+    op.drop_index('ix_usage_records_user_created_at', table_name='usage_records')
+    op.drop_index(op.f('ix_usage_records_id'), table_name='usage_records')
+    op.drop_table('usage_records')
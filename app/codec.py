@@ -0,0 +1,51 @@
+"""
+Кодек тел сообщений (zstd с байтом-маркером).
+
+Короткие сообщения хранятся как есть в messages.content. Тела длиннее MESSAGE_COMPRESS_THRESHOLD
+байт уходят в messages.content_compressed: первый байт — маркер кодека, дальше сжатые данные;
+content при этом NULL. ORM-свойство Message.content прозрачно сжимает/разжимает.
+Модуль без зависимостей от приложения: его импортируют и модели, и сервисы.
+"""
+import os
+
+import zstandard
+
+MESSAGE_COMPRESS_THRESHOLD = int(os.getenv("MESSAGE_COMPRESS_THRESHOLD", "2048"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+# Маркеры кодека (первый байт blob)
+CODEC_ZSTD = b"\x01"
+
+_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def compress(data: bytes) -> bytes:
+    return _compressor.compress(data)
+
+
+def decompress(data: bytes) -> bytes:
+    return _decompressor.decompress(data)
+
+
+def encode_content(text: str):
+    """text → (content, content_compressed); сжимаем, только если выигрыш реальный"""
+    if text is None:
+        return None, None
+    raw = text.encode("utf-8")
+    if len(raw) < MESSAGE_COMPRESS_THRESHOLD:
+        return text, None
+    packed = compress(raw)
+    if len(packed) + 1 >= len(raw):
+        return text, None
+    return None, CODEC_ZSTD + packed
+
+
+def decode_content(content: str, blob: bytes) -> str:
+    if blob is None:
+        return content
+    blob = bytes(blob)
+    codec, payload = blob[:1], blob[1:]
+    if codec == CODEC_ZSTD:
+        return decompress(payload).decode("utf-8")
+    raise ValueError(f"Unknown message codec: {codec!r}")
@@ -1,15 +1,63 @@
 import os
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
 
 # Берем URL базы из .env или используем локальный файл по умолчанию
 DB_URL = os.getenv("DB_URL", "sqlite:///./test.db")
+# Реплики только для чтения (через запятую); пусто — всё идёт в primary
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
 
-# Для SQLite нужна специальная настройка потоков
-connect_args = {"check_same_thread": False} if "sqlite" in DB_URL else {}
+# Пулы: на каждый воркер uvicorn свой пул, итог = воркеры × (pool_size + max_overflow)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_REPLICA_POOL_SIZE = int(os.getenv("DB_REPLICA_POOL_SIZE", str(DB_POOL_SIZE)))
+DB_REPLICA_MAX_OVERFLOW = int(os.getenv("DB_REPLICA_MAX_OVERFLOW", str(DB_MAX_OVERFLOW)))
 
-engine = create_engine(DB_URL, connect_args=connect_args)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def make_engine(url: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+    if "sqlite" in url:
+        # Для SQLite нужна специальная настройка потоков
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        # Реплику могут перезапустить/переключить — мёртвые соединения отсеиваются на выдаче
+        pool_pre_ping=True,
+    )
+
+
+engine = make_engine(DB_URL)
+replica_engines = [make_engine(url, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW) for url in DB_REPLICA_URLS]
+
+
+class RoutingSession(Session):
+    """
+    Сессия с маршрутизацией чтений: если в info["replica"] положен engine реплики
+    (см. app/services/replicas.py), SELECT идут в него. Запись, SELECT ... FOR UPDATE и сырой
+    SQL всегда идут в primary; после первой записи сессия до конца читает из primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is None:
+            return engine
+        is_plain_select = (
+            not self._flushing
+            and getattr(clause, "is_select", False)
+            and getattr(clause, "_for_update_arg", None) is None
+        )
+        if is_plain_select:
+            return replica
+        self.info["replica"] = None
+        return engine
+
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
@@ -18,4 +66,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
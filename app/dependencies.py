@@ -12,6 +12,10 @@ def get_current_user(request: Request, db: Session):
         return None
     
     sess = db.query(UserSession).filter_by(session_id=session_id).first()
+    if not sess and db.info.get("replica") is not None:
+        # Только что созданная сессия могла ещё не доехать до реплики — спрашиваем primary
+        db.info["replica"] = None
+        sess = db.query(UserSession).filter_by(session_id=session_id).first()
     if not sess:
         return None
         
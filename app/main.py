@@ -1,23 +1,28 @@
 import logging
 import sys
 import os
+import asyncio
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, Depends, HTTPException, UploadFile, File
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from jinja2 import FileSystemBytecodeCache
 from sqlalchemy.orm import Session
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
 # === ИМПОРТ РОУТЕРОВ ===
-from app.routers import chats, auth, payments
+from app.routers import chats, auth, payments, media, ws, usage
 
 # === ИМПОРТ ЗАВИСИМОСТЕЙ ===
 from app.dependencies import get_current_user
+from app.responses import FastJSONResponse
 from app.services.s3 import upload_file_to_s3
+from app.services import assets, http_compression, metrics, query_profiler, media_jobs, archive, partitions, lifecycle, replicas, payment_events, streams, share_snapshots
+from app.services.registry import services
 
 # === ИМПОРТЫ БАЗЫ ===
-from app.database import engine, get_db, Base
+from app.database import engine, replica_engines, get_db
 from app.models import UserWallet, UserSession, Chat
 
 # --- ЛОГИРОВАНИЕ ---
@@ -25,18 +30,67 @@ logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
 # --- ИНИЦИАЛИЗАЦИЯ ---
-Base.metadata.create_all(bind=engine)
-app = FastAPI()
+# Схему создаёт и обновляет только Alembic (alembic upgrade head; пустую базу он создаёт
+# по моделям), импорт приложения в базу не ходит.
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # SIGTERM снимает /readyz (healthcheck compose) и сразу останавливает uvicorn
+    lifecycle.install_signal_handlers()
+    # Фоновые воркеры живут вместе с процессом приложения
+    media_worker = asyncio.create_task(media_jobs.run_worker())
+    archiver = asyncio.create_task(archive.run_archiver())
+    partition_maintenance = asyncio.create_task(partitions.run_partition_maintenance())
+    payment_worker = asyncio.create_task(payment_events.run_worker())
+    payment_reconciler = asyncio.create_task(payment_events.run_reconciler())
+    share_worker = asyncio.create_task(share_snapshots.run_worker())
+    yield
+    media_worker.cancel()
+    archiver.cancel()
+    partition_maintenance.cancel()
+    payment_worker.cancel()
+    payment_reconciler.cancel()
+    share_worker.cancel()
+    # Генерации, клиенты которых отключились, дописываются или отменяются с сохранением
+    await streams.shutdown()
+    # Клиенты внешних сервисов создаются лениво при первом обращении
+    await services.aclose()
+    metrics.mark_process_dead()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+# Внутренний слой: латентность в MetricsMiddleware учитывает и время сжатия
+app.add_middleware(http_compression.CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+if query_profiler.SQL_PROFILE:
+    app.add_middleware(query_profiler.QueryProfilerMiddleware)
+if replicas.enabled():
+    app.add_middleware(replicas.ReadYourWritesMiddleware)
+metrics.db_pool_collector.add_engine("primary", engine)
+for i, replica in enumerate(replica_engines):
+    metrics.db_pool_collector.add_engine(f"replica{i}", replica)
 
 # --- ПУТИ ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+# Для локальной разработки: перечитывать изменённые шаблоны без перезапуска
+TEMPLATES_AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD", "false").lower() == "true"
 
+# Статика с хэшами в именах и предсжатыми .br/.gz (app/services/assets.py)
 if os.path.exists(STATIC_DIR):
-    app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+    assets.load()
+    app.mount("/static", assets.AssetFiles(directory=assets.STATIC_BUILD_DIR), name="static")
 
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
+templates.env.globals["static_url"] = assets.static_url
+# Шаблоны меняются только с деплоем: без stat() файла на каждый рендер,
+# а скомпилированный байткод переживает перезапуск воркера
+templates.env.auto_reload = TEMPLATES_AUTO_RELOAD
+templates.env.bytecode_cache = FileSystemBytecodeCache(os.getenv("JINJA_CACHE_DIR") or None)
+# Снимки расшаренных чатов рендерятся тем же окружением
+share_snapshots.init(templates.env)
 
 # === ОБРАБОТЧИК ОШИБОК 404 ===
 @app.exception_handler(StarletteHTTPException)
@@ -46,7 +100,7 @@ async def custom_http_exception_handler(request: Request, exc: StarletteHTTPExce
         if request.url.path.startswith("/api/") or request.url.path.startswith("/chats/"):
             return JSONResponse({"detail": "Not Found"}, status_code=404)
         # Иначе показываем HTML
-        return templates.TemplateResponse("404.html", {"request": request}, status_code=404)
+        return templates.TemplateResponse(request, "404.html", status_code=404)
     return JSONResponse({"detail": str(exc.detail)}, status_code=exc.status_code)
 
 @app.exception_handler(Exception)
@@ -58,6 +112,22 @@ async def global_exception_handler(request: Request, exc: Exception):
 app.include_router(chats.router, prefix="/chats") 
 app.include_router(auth.router)
 app.include_router(payments.router)
+app.include_router(media.router)
+app.include_router(ws.router)
+app.include_router(usage.router)
+
+# === МЕТРИКИ (Prometheus) ===
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    body, content_type = metrics.render_latest()
+    return Response(body, media_type=content_type)
+
+# === ГОТОВНОСТЬ (healthcheck compose, проверка нового контейнера при деплое) ===
+@app.get("/readyz", include_in_schema=False)
+def readiness():
+    if lifecycle.is_draining():
+        return JSONResponse({"status": "draining", "active_streams": lifecycle.active_streams()}, status_code=503)
+    return {"status": "ready", "active_streams": lifecycle.active_streams()}
 
 # ==================== МАРШРУТЫ СТРАНИЦ (UI) ====================
 
@@ -67,8 +137,7 @@ def home(request: Request, db: Session = Depends(get_db)):
     if not user:
         return RedirectResponse("/login")
     
-    return templates.TemplateResponse("chat.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "chat.html", {
         "name": user.name,
         "email": user.email,
         "balance": int(user.balance),
@@ -88,14 +157,13 @@ def chat_page(chat_id: int, request: Request, db: Session = Depends(get_db)):
 
 @app.get("/login")
 def login_page(request: Request):
-    return templates.TemplateResponse("signin.html", {"request": request})
+    return templates.TemplateResponse(request, "signin.html")
 
 @app.get("/profile")
 def profile(request: Request, db: Session = Depends(get_db)):
     user = get_current_user(request, db)
     if not user: return RedirectResponse("/login")
-    return templates.TemplateResponse("profile.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "profile.html", {
         "name": user.name, 
         "balance": int(user.balance), 
         "email": user.email,
@@ -103,28 +171,26 @@ def profile(request: Request, db: Session = Depends(get_db)):
     })
 
 @app.get("/share/{token}")
-def shared_chat_page(token: str, request: Request, db: Session = Depends(get_db)):
+def shared_chat_page(token: str, request: Request, db: Session = Depends(replicas.get_read_db)):
     chat = db.query(Chat).filter_by(share_token=token).first()
     
     if not chat:
         raise StarletteHTTPException(status_code=404, detail="Chat not found")
-        
-    messages = []
-    for m in chat.messages:
-        messages.append({
-            "role": m.role,
-            "content": m.content,
-            "image_url": m.image_url,
-            "attachment_url": m.attachment_url
-        })
-
-    return templates.TemplateResponse("shared_chat.html", {
-        "request": request,
-        "title": chat.title,
-        "date": chat.created_at.strftime("%d.%m.%Y"),
-        "messages": messages,
-        "model_name": chat.model
-    })
+
+    # Актуальный статический снимок в S3 — приложение отдаёт только редирект
+    if share_snapshots.enabled() and share_snapshots.is_fresh(chat):
+        metrics.SHARE_VIEWS.labels("snapshot").inc()
+        return RedirectResponse(share_snapshots.snapshot_url(token), status_code=302,
+                                headers={"Cache-Control": share_snapshots.SHARE_SNAPSHOT_CACHE_CONTROL})
+
+    # Снимка ещё нет или чат изменился — рендерим сами, снимок перепубликуется в фоне
+    share_snapshots.schedule(chat.id)
+    metrics.SHARE_VIEWS.labels("app").inc()
+    try:
+        messages = share_snapshots.load_messages(db, chat)
+    except share_snapshots.ArchiveUnavailable:
+        raise StarletteHTTPException(status_code=503, detail="Chat archive is temporarily unavailable")
+    return templates.TemplateResponse(request, "shared_chat.html", share_snapshots.page_context(chat, messages))
 
 @app.post("/api/upload")
 async def upload_file(request: Request, file: UploadFile = File(...), db: Session = Depends(get_db)):
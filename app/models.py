@@ -1,7 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import DDL, event, Column, Integer, String, Float, Text, DateTime, Date, ForeignKey, Boolean, Index, LargeBinary, UniqueConstraint
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from app.database import Base
+from app.codec import encode_content, decode_content
+
+# tsvector в Postgres; на SQLite колонка не используется — там поиск через FTS5 (app/services/search.py)
+SearchVector = Text().with_variant(TSVECTOR(), "postgresql")
 
 # === ПОЛЬЗОВАТЕЛИ ===
 class UserWallet(Base):
@@ -33,6 +39,22 @@ class Payment(Base):
     description = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class PaymentEvent(Base):
+    """Входящие уведомления YooKassa: вебхук только записывает, применяет воркер (app/services/payment_events.py)"""
+    __tablename__ = "payment_events"
+    id = Column(Integer, primary_key=True, index=True)
+    # "<event>:<id платежа>" — повторная доставка того же уведомления не создаёт вторую строку
+    event_key = Column(String, unique=True, nullable=False)
+    event_type = Column(String)
+    payment_id = Column(String, index=True)
+    payload = Column(Text)
+    # pending → processed / ignored / failed
+    status = Column(String, default="pending", index=True)
+    attempts = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    received_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+
 class EmailCode(Base):
     __tablename__ = "email_codes"
     id = Column(Integer, primary_key=True, index=True)
@@ -52,11 +74,22 @@ class Chat(Base):
     # === НОВЫЕ ПОЛЯ ===
     is_pinned = Column(Boolean, default=False)                # Закреплен ли чат
     share_token = Column(String, unique=True, nullable=True, index=True) # Ссылка для шеринга
+    # Статический снимок расшаренного чата в S3 (app/services/share_snapshots.py):
+    # версия растёт при каждом изменении, снимок актуален, пока опубликованная версия совпадает
+    share_version = Column(Integer, default=0)
+    share_published_version = Column(Integer, nullable=True)
     expires_at = Column(DateTime, nullable=True)              # Если заполнено — чат удалится после этой даты
     # ==================
 
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
+
+    # Полнотекстовый поиск (Postgres), заполняет app/services/search.py
+    search_vector = deferred(Column(SearchVector, nullable=True))
+
+    # Холодный архив: сообщения выгружены в S3 (app/services/archive.py), в messages их нет
+    archived_at = Column(DateTime, nullable=True)
+    archive_key = Column(String, nullable=True)
     
     user = relationship("UserWallet", back_populates="chats")
     # cascade="all, delete" означает: удалили чат -> удалились все сообщения
@@ -68,10 +101,118 @@ class Message(Base):
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"))
     role = Column(String) # 'user' или 'assistant'
-    content = Column(Text) # Текст сообщения
+    # Текст сообщения: короткий — в content, длинный — сжатым в content_compressed (app/codec.py)
+    _content = Column("content", Text)
+    content_compressed = Column(LargeBinary, nullable=True)
     
     # Ссылки на файлы/изображения
     image_url = Column(String, nullable=True)
     attachment_url = Column(String, nullable=True)
+
+    # Полнотекстовый поиск (Postgres), заполняет app/services/search.py
+    search_vector = deferred(Column(SearchVector, nullable=True))
+
+    # Ключ партиционирования messages в Postgres (app/services/partitions.py).
+    # Инвариант: не раньше chats.created_at — на нём строится отсечение партиций в запросах чата
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
-    chat = relationship("Chat", back_populates="messages")
\ No newline at end of file
+    chat = relationship("Chat", back_populates="messages")
+
+    @hybrid_property
+    def content(self):
+        return decode_content(self._content, self.content_compressed)
+
+    @content.inplace.setter
+    def _content_setter(self, value):
+        self._content, self.content_compressed = encode_content(value)
+
+    @content.inplace.expression
+    @classmethod
+    def _content_expression(cls):
+        # В SQL видна только несжатая колонка — фильтровать по тексту сообщений нельзя
+        return cls._content
+
+# GIN-индексы поиска — только для Postgres
+Index("ix_chats_search_vector", Chat.search_vector, postgresql_using="gin").ddl_if(dialect="postgresql")
+Index("ix_messages_search_vector", Message.search_vector, postgresql_using="gin").ddl_if(dialect="postgresql")
+# FTS5-таблицы поиска на SQLite — вместе с таблицами при любом create_all (и в миграции)
+event.listen(Message.__table__, "after_create", DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, tokenize='unicode61')"
+).execute_if(dialect="sqlite"))
+event.listen(Chat.__table__, "after_create", DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(title, tokenize='unicode61')"
+).execute_if(dialect="sqlite"))
+# История чата: chat_id + created_at (отсечение партиций по времени чата)
+Index("ix_messages_chat_id_created_at", Message.chat_id, Message.created_at)
+
+
+# === ГЕНЕРАЦИЯ МЕДИА (fal.ai) ===
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_casdoor_id = Column(String, index=True)
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=True, index=True)
+    model = Column(String, index=True)
+    prompt = Column(Text)
+    attachment_url = Column(String, nullable=True)
+
+    # queued → submitted → running → finalizing → completed / failed
+    status = Column(String, default="queued", index=True)
+    fal_request_id = Column(String, unique=True, nullable=True, index=True)
+    progress = Column(Text, nullable=True)    # Позиция в очереди / последние логи fal
+    result_url = Column(String, nullable=True)  # Итоговый файл в нашем S3
+    result_kind = Column(String, nullable=True)  # image / video / audio — из ответа fal
+    error = Column(Text, nullable=True)
+    cost = Column(Float, default=0.0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+# === УЧЁТ РАСХОДОВ (app/services/usage.py) ===
+class UsageRecord(Base):
+    """Одна генерация: модель, токены, стоимость, время. Пишется вместе с ответом и списанием"""
+    __tablename__ = "usage_records"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_casdoor_id = Column(String, nullable=False)
+    # Без внешнего ключа: удаление чата не стирает историю расходов
+    chat_id = Column(Integer, nullable=True)
+    model = Column(String, nullable=False)
+    status = Column(String)  # completed / cancelled / empty
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)
+    # Токены посчитаны по символам (провайдер не прислал usage)
+    estimated = Column(Boolean, default=False)
+    cost = Column(Float, default=0.0)
+    duration_ms = Column(Integer, default=0)
+    ttft_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_usage_records_user_created_at", "user_casdoor_id", "created_at"),
+    )
+
+
+class UsageDaily(Base):
+    """Сумма UsageRecord за день по пользователю и модели; обновляется инкрементально при записи"""
+    __tablename__ = "usage_daily"
+
+    id = Column(Integer, primary_key=True)
+    user_casdoor_id = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+    model = Column(String, nullable=False)
+    requests = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)
+    cost = Column(Float, default=0.0)
+    duration_ms = Column(Integer, default=0)
+
+    __table_args__ = (
+        # Ключ upsert'а; по нему же — выборка истории пользователя за период
+        UniqueConstraint("user_casdoor_id", "day", "model", name="uq_usage_daily_user_day_model"),
+    )
@@ -0,0 +1,15 @@
+"""
+JSON-ответы через orjson.
+
+FastJSONResponse — класс ответа по умолчанию для всего приложения (FastAPI(default_response_class)).
+Обработчики горячих списков (чаты, история) возвращают его сразу с готовыми dict/list из строк
+Core-запроса: так FastAPI пропускает jsonable_encoder, а orjson кодирует в разы быстрее
+stdlib json. datetime orjson пишет сам — в том же ISO-формате, что и .isoformat().
+"""
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
@@ -1,40 +1,103 @@
-from fastapi import APIRouter, Request, Depends, HTTPException, Body, BackgroundTasks
+from fastapi import APIRouter, Request, Depends, HTTPException, Body, BackgroundTasks, UploadFile, File
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, or_
+from sqlalchemy import desc, or_, select
 from datetime import datetime, timedelta
+import os
 import json
+import asyncio
 import logging
+from contextlib import aclosing
+import time
 import uuid
 
 from app.database import get_db, SessionLocal
 from app.models import UserWallet, Chat, Message
 from app.dependencies import get_current_user
-from app.services.ai_generation import generate_ai_response_stream, get_models_config
+from app.responses import FastJSONResponse
+from app.services.ai_generation import generate_ai_response_stream, get_models_config, model_label, estimate_cost, MODEL_PRICING
 from app.services.casdoor import update_casdoor_balance
+from app.services import metrics, media_jobs, search, export, importer, archive, lifecycle, streams, usage, share_snapshots
+from app.services.partitions import chat_messages_filter
+from app.codec import decode_content
+from app.services.replicas import get_read_db
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["chats"])
 
+# Сколько моделей можно сравнивать одним запросом (каждая — отдельная генерация и списание)
+COMPARE_MAX_MODELS = int(os.getenv("COMPARE_MAX_MODELS", "4"))
+
 
 # === ФОНОВАЯ ЗАДАЧА: Очистка просроченных чатов ===
 def cleanup_expired_chats(db: Session):
     try:
         now = datetime.utcnow()
-        expired_chats = db.query(Chat).filter(Chat.expires_at.isnot(None), Chat.expires_at <= now).all()
-        if expired_chats:
-            for chat in expired_chats:
-                db.delete(chat)
+        expired = db.query(Chat.id, Chat.created_at, Chat.share_token).filter(Chat.expires_at.isnot(None), Chat.expires_at <= now).all()
+        if expired:
+            chat_ids = [c.id for c in expired]
+            query = db.query(Message).filter(Message.chat_id.in_(chat_ids))
+            created = [c.created_at for c in expired]
+            if all(created):
+                # Временные чаты свежие — удаление сообщений затрагивает только последние партиции
+                query = query.filter(Message.created_at >= min(created))
+            query.delete(synchronize_session=False)
+            db.query(Chat).filter(Chat.id.in_(chat_ids)).delete(synchronize_session=False)
             db.commit()
+            share_snapshots.delete([c.share_token for c in expired])
     except Exception as e:
         logger.error(f"Cleanup error: {e}")
 
 
 # === ХЕЛПЕР ДЛЯ SSE ===
-async def sse_wrapper(chat_id: int, model_id: str, messages: list, user_balance: float, user_casdoor_id: str, attachment_url: str = None):
+def save_assistant_reply(chat_id: int, user_casdoor_id: str, content: str, cost: float, usage_entry: dict = None):
+    """Сохраняет ответ ассистента, списывает стоимость и пишет учёт расходов одной транзакцией"""
+    db = SessionLocal()
+    try:
+        # 1. Сохраняем сообщение ассистента
+        assistant_msg = Message(
+            chat_id=chat_id,
+            role="assistant",
+            content=content
+        )
+        db.add(assistant_msg)
+        search.index_message(db, assistant_msg)
+
+        # 2. Списываем баланс если есть стоимость
+        if cost > 0:
+            # FOR UPDATE: параллельное пополнение (payment_events) не затрётся списанием
+            wallet = db.query(UserWallet).filter(
+                UserWallet.casdoor_id == user_casdoor_id
+            ).with_for_update().first()
+            if wallet:
+                wallet.balance = max(0, wallet.balance - cost)
+                logger.info(f"Balance updated: user={user_casdoor_id}, -{cost:.4f}₽, new={wallet.balance:.2f}₽")
+
+        # 3. Учёт: запись генерации и дневная сумма
+        if usage_entry is not None:
+            usage.record(db, user_casdoor_id, chat_id, cost=cost, **usage_entry)
+
+        shared = share_snapshots.touch(db, chat_id)
+        db.commit()
+        logger.info(f"Saved assistant message to chat {chat_id}, length={len(content)}")
+        if shared:
+            share_snapshots.schedule(chat_id)
+
+    except Exception as e:
+        logger.error(f"Failed to save assistant message: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+async def stream_reply(chat_id: int, model_id: str, messages: list, user_balance: float, user_casdoor_id: str, attachment_url: str = None):
     """
-    Стримит ответ клиенту и сохраняет в БД после завершения.
+    Генерирует ответ ассистента кусками текста и сохраняет его в БД после завершения.
+    Общее ядро транспорта: SSE (sse_wrapper) и WebSocket (app/routers/ws.py).
+    Если стрим оборван (клиент ушёл или отменил, воркер остановлен по истечении
+    graceful-таймаута), сохраняется уже полученная часть ответа и списывается её
+    оценочная стоимость. Закрывать через aclose()/aclosing, чтобы сохранение не ждало GC.
     
     Args:
         chat_id: ID чата для сохранения сообщения
@@ -44,55 +107,234 @@ async def sse_wrapper(chat_id: int, model_id: str, messages: list, user_balance:
         user_casdoor_id: ID пользователя для списания баланса
         attachment_url: URL прикреплённого файла
     """
+    upstream_usage = {}  # Токены из usage провайдера, если он их прислал
     generator = generate_ai_response_stream(
         model_id=model_id,
         messages=messages,
         user_balance=float(user_balance),
         temperature=0.7,
         web_search=False,
-        attachment_url=attachment_url
+        attachment_url=attachment_url,
+        usage_out=upstream_usage
     )
     
     full_response = ""  # Накапливаем полный ответ
     total_cost = 0.0
-    
-    async for content, cost in generator:
-        if content:
-            full_response += content
-            data = json.dumps({"content": content}, ensure_ascii=False)
-            yield f"data: {data}\n\n"
-        if cost > 0:
-            total_cost = cost
-    
-    # === СОХРАНЯЕМ ОТВЕТ АССИСТЕНТА В БД ===
-    if full_response:
-        db = SessionLocal()
+
+    label = model_label(model_id)
+    started = time.perf_counter()
+    first_frame_at = None
+    status = "cancelled"  # Перезапишется, если стрим дойдёт до конца
+    metrics.STREAMS_ACTIVE.labels(label).inc()
+    lifecycle.stream_started()
+    try:
+        async for content, cost in generator:
+            if content:
+                if first_frame_at is None:
+                    first_frame_at = time.perf_counter()
+                    metrics.STREAM_TTFT.labels(label).observe(first_frame_at - started)
+                full_response += content
+                yield content
+            if cost > 0:
+                total_cost = cost
+        status = "completed" if full_response else "empty"
+    finally:
+        finished = time.perf_counter()
+        lifecycle.stream_finished()
+        metrics.STREAMS_ACTIVE.labels(label).dec()
+        metrics.STREAMS_TOTAL.labels(label, status).inc()
+        metrics.STREAM_DURATION.labels(label).observe(finished - started)
+        if first_frame_at is not None and finished > first_frame_at:
+            metrics.STREAM_TOKENS_PER_SECOND.labels(label).observe(len(full_response) / 4 / (finished - first_frame_at))
+        if lifecycle.is_draining():
+            metrics.STREAMS_DRAINED.labels("completed" if status != "cancelled" else "cut").inc()
+
+        # === СОХРАНЯЕМ ОТВЕТ АССИСТЕНТА В БД ===
+        # В finally: при отмене задачи (остановка воркера) ответ и списание не теряются
+        if full_response:
+            if status == "cancelled" and total_cost <= 0:
+                total_cost = estimate_cost(model_id, messages, full_response)
+            usage_entry = {
+                "model_id": model_id,
+                "status": status,
+                "prompt_tokens": upstream_usage.get("prompt_tokens", sum(usage.estimate_tokens(m["content"]) for m in messages)),
+                "completion_tokens": upstream_usage.get("completion_tokens", usage.estimate_tokens(full_response)),
+                "cached_tokens": upstream_usage.get("cached_tokens", 0),
+                "estimated": not upstream_usage,
+                "duration_ms": int((finished - started) * 1000),
+                "ttft_ms": int((first_frame_at - started) * 1000) if first_frame_at is not None else None,
+            }
+            save_assistant_reply(chat_id, user_casdoor_id, full_response, total_cost, usage_entry)
+
+
+def start_stream(chat_id: int, model_id: str, messages: list, user_balance: float, user_casdoor_id: str, attachment_url: str = None, resumable: bool = False) -> streams.StreamBuffer:
+    """
+    Генерация в фоне, клиент читает её буфер. Отключение клиента отменяет генерацию:
+    сразу или, если resumable (заголовок X-Stream-Resume), по истечении окна переподключения.
+    """
+    return streams.start(chat_id, user_casdoor_id,
+                         stream_reply(chat_id, model_id, messages, user_balance, user_casdoor_id, attachment_url),
+                         resumable=resumable)
+
+
+async def compare_reply(targets: list, user_balance: float, user_casdoor_id: str, attachment_url: str = None):
+    """
+    Режим сравнения: ответы нескольких моделей генерируются параллельно и идут одним
+    потоком событий {"model", "chat_id", "content"}; конец ответа модели — событие со "status".
+    targets — [(chat_id, model_id, messages)]. Сохранение и списание у каждой модели своё
+    (stream_reply), отмена потока прерывает все генерации с сохранением частичных ответов.
+    """
+    queue = asyncio.Queue()
+
+    async def run(chat_id: int, model_id: str, messages: list):
+        status = "failed"
         try:
-            # 1. Сохраняем сообщение ассистента
-            assistant_msg = Message(
-                chat_id=chat_id,
-                role="assistant",
-                content=full_response
-            )
-            db.add(assistant_msg)
-            
-            # 2. Списываем баланс если есть стоимость
-            if total_cost > 0:
-                wallet = db.query(UserWallet).filter(
-                    UserWallet.casdoor_id == user_casdoor_id
-                ).first()
-                if wallet:
-                    wallet.balance = max(0, wallet.balance - total_cost)
-                    logger.info(f"Balance updated: user={user_casdoor_id}, -{total_cost:.4f}₽, new={wallet.balance:.2f}₽")
-            
-            db.commit()
-            logger.info(f"Saved assistant message to chat {chat_id}, length={len(full_response)}")
-            
+            reply = stream_reply(chat_id, model_id, messages, user_balance, user_casdoor_id, attachment_url)
+            async with aclosing(reply) as chunks:
+                async for content in chunks:
+                    await queue.put({"model": model_id, "chat_id": chat_id, "content": content})
+            status = "completed"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
         except Exception as e:
-            logger.error(f"Failed to save assistant message: {e}")
-            db.rollback()
+            logger.error(f"Compare stream error (chat {chat_id}, {model_id}): {e}", exc_info=True)
         finally:
-            db.close()
+            queue.put_nowait({"model": model_id, "chat_id": chat_id, "status": status})
+
+    tasks = [asyncio.create_task(run(*target)) for target in targets]
+    try:
+        running = len(tasks)
+        while running:
+            event = await queue.get()
+            if "status" in event:
+                running -= 1
+            yield event
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def wants_resume(request: Request) -> bool:
+    return request.headers.get("x-stream-resume", "").lower() in ("1", "true", "yes")
+
+
+async def sse_wrapper(stream: streams.StreamBuffer, last_event_id: int = 0):
+    """
+    Стримит ответ клиенту в формате SSE; id событий — для Last-Event-ID при переподключении.
+    Starlette отменяет/закрывает этот генератор при отключении клиента — aclosing сразу
+    отписывает его от буфера, и генерация без подписчиков отменяется.
+    """
+    async with aclosing(stream.follow(last_event_id)) as events:
+        async for event_id, data in events:
+            if event_id is None:
+                # Пропущенное уже вытеснено из буфера — клиент перечитывает чат целиком
+                yield f"event: reset\ndata: {json.dumps({'reset': True})}\n\n"
+                continue
+            data = json.dumps(data, ensure_ascii=False)
+            yield f"id: {event_id}\ndata: {data}\n\n"
+
+
+def stream_response(stream: streams.StreamBuffer, headers: dict = None, last_event_id: int = 0) -> StreamingResponse:
+    return StreamingResponse(
+        sse_wrapper(stream, last_event_id),
+        media_type="text/event-stream",
+        headers={"X-Stream-Id": stream.id, **(headers or {})}
+    )
+
+
+# === ХЕЛПЕР: вернуть архивный чат из S3 ===
+def hydrate_chat(db: Session, chat: Chat):
+    if chat.archived_at and db.info.get("replica") is not None:
+        # Реплика могла отстать (чат уже возвращён, blob удалён) — статус перепроверяем в primary
+        db.info["replica"] = None
+        db.refresh(chat)
+    try:
+        archive.ensure_hydrated(db, chat)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to rehydrate chat {chat.id}: {e}")
+        raise HTTPException(503, "Chat archive is temporarily unavailable")
+
+
+# === ХЕЛПЕРЫ ОТПРАВКИ СООБЩЕНИЯ (общие для HTTP/SSE и WebSocket) ===
+def start_chat(db: Session, user: UserWallet, payload: dict) -> Chat:
+    """Создаёт чат с первым сообщением пользователя"""
+    user_msg = payload.get("message", "")
+    model_id = payload.get("model", "openai/gpt-4o")
+    attachment_url = payload.get("attachment_url")
+    is_temporary = payload.get("is_temporary", False)
+
+    expires_at = None
+    if is_temporary:
+        expires_at = datetime.utcnow() + timedelta(hours=24)
+
+    # Создаём чат
+    chat = Chat(
+        user_casdoor_id=user.casdoor_id,
+        title=user_msg[:40] if user_msg else "Новый чат",
+        model=model_id,
+        expires_at=expires_at
+    )
+    db.add(chat)
+    search.index_chat(db, chat)
+    db.commit()
+    db.refresh(chat)
+    
+    # Сохраняем сообщение пользователя
+    msg = Message(chat_id=chat.id, role="user", content=user_msg, image_url=attachment_url)
+    db.add(msg)
+    search.index_message(db, msg)
+    db.commit()
+    return chat
+
+
+def append_user_message(db: Session, user: UserWallet, chat_id: int, payload: dict) -> Chat:
+    """Добавляет сообщение пользователя в его чат (и меняет модель, если передана)"""
+    chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_casdoor_id == user.casdoor_id).first()
+    if not chat:
+        raise HTTPException(404, "Chat not found")
+    hydrate_chat(db, chat)
+    
+    # Сохраняем сообщение пользователя
+    msg = Message(chat_id=chat.id, role="user", content=payload.get("message", ""), image_url=payload.get("attachment_url"))
+    db.add(msg)
+    search.index_message(db, msg)
+    
+    # Обновляем модель если передана
+    if "model" in payload:
+        chat.model = payload["model"]
+    chat.updated_at = datetime.utcnow()
+    shared = share_snapshots.touch(db, chat.id)
+    db.commit()
+    if shared:
+        share_snapshots.schedule(chat.id)
+    return chat
+
+
+def message_rows(db: Session, chat: Chat, *columns) -> list:
+    """Только нужные колонки сообщений чата строками Core-запроса — без ORM-объектов и identity map"""
+    return db.execute(select(*columns).where(*chat_messages_filter(chat)).order_by(Message.id)).all()
+
+
+def chat_context(db: Session, chat: Chat) -> list:
+    """Вся история чата — контекст для AI"""
+    rows = message_rows(db, chat, Message.role, Message._content, Message.content_compressed)
+    return [{"role": r.role, "content": decode_content(r._content, r.content_compressed)} for r in rows]
+
+
+# === ХЕЛПЕР ДЛЯ МЕДИА-МОДЕЛЕЙ ===
+def media_job_response(db: Session, user: UserWallet, chat_id: int, model_id: str, prompt: str, attachment_url: str = None):
+    try:
+        job = media_jobs.create_job(db, user, model_id, prompt, chat_id=chat_id, attachment_url=attachment_url)
+    except ValueError as e:
+        raise HTTPException(402, str(e))
+    return StreamingResponse(
+        media_jobs.job_events(job.id),
+        media_type="text/event-stream",
+        headers={"X-Chat-Id": str(chat_id), "X-Job-Id": str(job.id)}
+    )
 
 
 # === 1. Список моделей ===
@@ -103,29 +345,90 @@ def get_available_models():
 
 # === 2. Список чатов ===
 @router.get("/")
-def get_chats(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def get_chats(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_read_db)):
     user = get_current_user(request, db)
     if not user:
         raise HTTPException(401)
     
     background_tasks.add_task(cleanup_expired_chats, db)
     
-    chats = db.query(Chat).filter(Chat.user_casdoor_id == user.casdoor_id)\
-        .order_by(Chat.is_pinned.desc(), Chat.updated_at.desc()).all()
+    rows = db.execute(
+        select(Chat.id, Chat.title, Chat.updated_at, Chat.model, Chat.is_pinned, Chat.expires_at)
+        .where(Chat.user_casdoor_id == user.casdoor_id)
+        .order_by(Chat.is_pinned.desc(), Chat.updated_at.desc())
+    ).all()
     
-    return [{
+    # datetime кодирует orjson (ISO, как .isoformat())
+    return FastJSONResponse([{
         "id": c.id, 
         "title": c.title, 
-        "date": c.updated_at.isoformat(), 
+        "date": c.updated_at, 
         "model": c.model, 
         "is_pinned": c.is_pinned,
-        "expires_at": c.expires_at.isoformat() if c.expires_at else None
-    } for c in chats]
+        "expires_at": c.expires_at
+    } for c in rows])
+
+
+# === 2.1 Поиск по чатам ===
+# Объявлен до /{chat_id}, иначе "search" попадёт в chat_id
+@router.get("/search")
+def search_chats(request: Request, q: str, limit: int = 20, offset: int = 0, db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(401)
+
+    q = q.strip()
+    if not q:
+        raise HTTPException(400, "Query is required")
+    limit = max(1, min(limit, search.MAX_PAGE_SIZE))
+    offset = max(0, offset)
+
+    return {
+        "results": search.search(db, user.casdoor_id, q, limit=limit, offset=offset),
+        "limit": limit,
+        "offset": offset,
+    }
+
+
+# === 2.2 Экспорт всех чатов ===
+@router.get("/export")
+def export_chats(request: Request, format: str = "ndjson", db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(401)
+    if format not in export.EXPORT_FORMATS:
+        raise HTTPException(400, f"Unknown format, expected one of: {', '.join(export.EXPORT_FORMATS)}")
+
+    # Генератор открывает свою сессию и читает БД пачками — в памяти только текущая пачка
+    stamp = datetime.utcnow().strftime("%Y%m%d")
+    if format == "zip":
+        body, media_type, filename = export.zip_stream(user.casdoor_id), "application/zip", f"chats-{stamp}.zip"
+    else:
+        body, media_type, filename = export.ndjson_stream(user.casdoor_id), "application/x-ndjson", f"chats-{stamp}.ndjson"
+
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+
+# === 2.3 Импорт архива ChatGPT/Claude ===
+@router.post("/import")
+def import_chats(request: Request, file: UploadFile = File(...), db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(401)
+
+    # Синхронный обработчик — разбор и запись идут в тредпуле, не блокируя event loop
+    try:
+        stats = importer.import_conversations(user.casdoor_id, file.file)
+    except importer.ImportFormatError as e:
+        raise HTTPException(400, str(e))
+    return {"status": "ok", **stats}
 
 
 # === 3. История чата ===
 @router.get("/{chat_id}")
-def get_chat_history(chat_id: int, request: Request, db: Session = Depends(get_db)):
+def get_chat_history(chat_id: int, request: Request, db: Session = Depends(get_read_db)):
     user = get_current_user(request, db)
     if not user:
         raise HTTPException(401)
@@ -133,17 +436,20 @@ def get_chat_history(chat_id: int, request: Request, db: Session = Depends(get_d
     chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_casdoor_id == user.casdoor_id).first()
     if not chat:
         raise HTTPException(404, "Chat not found")
+    hydrate_chat(db, chat)
     
-    return {
+    rows = message_rows(db, chat, Message.id, Message.role, Message._content, Message.content_compressed, Message.image_url)
+    return FastJSONResponse({
         "id": chat.id,
         "title": chat.title,
         "model": chat.model,
         "is_pinned": chat.is_pinned,
         "share_token": chat.share_token,
-        "expires_at": chat.expires_at.isoformat() if chat.expires_at else None,
+        "expires_at": chat.expires_at,
         # 👇 ИСПРАВЛЕНИЕ: Добавили id
-        "messages": [{"id": m.id, "role": m.role, "content": m.content, "image_url": m.image_url} for m in chat.messages]
-    }
+        "messages": [{"id": m.id, "role": m.role, "content": decode_content(m._content, m.content_compressed),
+                      "image_url": m.image_url} for m in rows]
+    })
 
 
 # === 4. Новый чат ===
@@ -153,39 +459,17 @@ async def create_new_chat(request: Request, payload: dict = Body(...), db: Sessi
     if not user:
         raise HTTPException(401)
     
+    chat = start_chat(db, user, payload)
     user_msg = payload.get("message", "")
-    model_id = payload.get("model", "openai/gpt-4o")
     attachment_url = payload.get("attachment_url")
-    is_temporary = payload.get("is_temporary", False)
-
-    expires_at = None
-    if is_temporary:
-        expires_at = datetime.utcnow() + timedelta(hours=24)
 
-    # Создаём чат
-    chat = Chat(
-        user_casdoor_id=user.casdoor_id,
-        title=user_msg[:40] if user_msg else "Новый чат",
-        model=model_id,
-        expires_at=expires_at
-    )
-    db.add(chat)
-    db.commit()
-    db.refresh(chat)
+    # Медиа-модели генерируются фоновой задачей, клиенту — стрим её статуса
+    if media_jobs.is_media_model(chat.model):
+        return media_job_response(db, user, chat.id, chat.model, user_msg, attachment_url)
     
-    # Сохраняем сообщение пользователя
-    msg = Message(chat_id=chat.id, role="user", content=user_msg, image_url=attachment_url)
-    db.add(msg)
-    db.commit()
-    
-    # Формируем историю для AI (пока только одно сообщение)
-    messages = [{"role": "user", "content": user_msg}]
-    
-    return StreamingResponse(
-        sse_wrapper(chat.id, model_id, messages, user.balance, user.casdoor_id, attachment_url),
-        media_type="text/event-stream",
-        headers={"X-Chat-Id": str(chat.id)}
-    )
+    stream = start_stream(chat.id, chat.model, chat_context(db, chat), user.balance, user.casdoor_id, attachment_url,
+                          resumable=wants_resume(request))
+    return stream_response(stream, headers={"X-Chat-Id": str(chat.id)})
 
 
 # === 5. Продолжить чат ===
@@ -195,30 +479,67 @@ async def continue_chat(chat_id: int, request: Request, payload: dict = Body(...
     if not user:
         raise HTTPException(401)
     
-    chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_casdoor_id == user.casdoor_id).first()
-    if not chat:
-        raise HTTPException(404, "Chat not found")
-    
+    chat = append_user_message(db, user, chat_id, payload)
     user_msg = payload.get("message", "")
     attachment_url = payload.get("attachment_url")
+
+    if media_jobs.is_media_model(chat.model):
+        return media_job_response(db, user, chat.id, chat.model, user_msg, attachment_url)
     
-    # Сохраняем сообщение пользователя
-    msg = Message(chat_id=chat.id, role="user", content=user_msg, image_url=attachment_url)
-    db.add(msg)
-    
-    # Обновляем модель если передана
-    if "model" in payload:
-        chat.model = payload["model"]
-    chat.updated_at = datetime.utcnow()
-    db.commit()
-    
-    # === КЛЮЧЕВОЕ ИСПРАВЛЕНИЕ: Собираем ВСЮ историю чата для контекста AI ===
-    messages = [{"role": m.role, "content": m.content} for m in chat.messages]
-    
-    return StreamingResponse(
-        sse_wrapper(chat.id, chat.model, messages, user.balance, user.casdoor_id, attachment_url),
-        media_type="text/event-stream"
+    stream = start_stream(chat.id, chat.model, chat_context(db, chat), user.balance, user.casdoor_id, attachment_url,
+                          resumable=wants_resume(request))
+    return stream_response(stream)
+
+
+# === 5.1 Сравнить ответы нескольких моделей ===
+@router.post("/compare")
+async def compare_models(request: Request, payload: dict = Body(...), db: Session = Depends(get_db)):
+    """
+    Один вопрос — сразу нескольким моделям: на каждую модель создаётся свой чат (его можно
+    продолжить с понравившейся), ответы стримятся параллельно в одном SSE с меткой модели.
+    """
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(401)
+
+    models = list(dict.fromkeys(payload.get("models") or []))
+    if not 2 <= len(models) <= COMPARE_MAX_MODELS:
+        raise HTTPException(400, f"Choose from 2 to {COMPARE_MAX_MODELS} models")
+    for model_id in models:
+        if model_id not in MODEL_PRICING or media_jobs.is_media_model(model_id):
+            raise HTTPException(400, f"Model {model_id} is not available for comparison")
+
+    chats = [start_chat(db, user, {**payload, "model": model_id}) for model_id in models]
+    targets = [(chat.id, chat.model, chat_context(db, chat)) for chat in chats]
+    stream = streams.start(
+        chats[0].id, user.casdoor_id,
+        compare_reply(targets, user.balance, user.casdoor_id, payload.get("attachment_url")),
+        resumable=wants_resume(request),
     )
+    return stream_response(stream, headers={"X-Chat-Ids": ",".join(str(chat.id) for chat in chats)})
+
+
+# === 5.2 Переподключиться к идущему ответу ===
+@router.get("/streams/{stream_id}")
+def resume_stream(stream_id: str, request: Request, last_event_id: int = None, db: Session = Depends(get_db)):
+    """
+    Досылает события после Last-Event-ID (заголовок или ?last_event_id=) и продолжает поток.
+    404 — буфер уже освобождён или живёт в другом воркере: ответ сохранится в истории чата.
+    """
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(401)
+
+    stream = streams.get(stream_id, user.casdoor_id)
+    if not stream:
+        raise HTTPException(404, "Stream not found")
+
+    if last_event_id is None:
+        try:
+            last_event_id = int(request.headers.get("last-event-id", 0))
+        except ValueError:
+            last_event_id = 0
+    return stream_response(stream, headers={"X-Chat-Id": str(stream.chat_id)}, last_event_id=last_event_id)
 
 
 # === 6. Удалить чат ===
@@ -232,8 +553,12 @@ def delete_chat(chat_id: int, request: Request, db: Session = Depends(get_db)):
     if not chat:
         raise HTTPException(404)
     
-    db.delete(chat)
+    archive_key, share_token = chat.archive_key, chat.share_token
+    db.query(Message).filter(*chat_messages_filter(chat)).delete(synchronize_session=False)
+    db.query(Chat).filter(Chat.id == chat.id).delete(synchronize_session=False)
     db.commit()
+    archive.delete_blobs([archive_key])
+    share_snapshots.delete([share_token])
     return {"status": "ok"}
 
 
@@ -246,21 +571,31 @@ def clear_history(range: str, request: Request, db: Session = Depends(get_db)):
     
     query = db.query(Chat).filter(Chat.user_casdoor_id == user.casdoor_id)
     now = datetime.utcnow()
+    since = None
     
     if range == 'last_hour':
-        query = query.filter(Chat.created_at >= now - timedelta(hours=1))
+        since = now - timedelta(hours=1)
     elif range == 'last_24h':
-        query = query.filter(Chat.created_at >= now - timedelta(hours=24))
+        since = now - timedelta(hours=24)
+    if since:
+        query = query.filter(Chat.created_at >= since)
     
     chats_to_delete = query.all()
     chat_ids = [chat.id for chat in chats_to_delete]
     
     if chat_ids:
-        # Сначала удаляем сообщения (зависимые данные)
-        db.query(Message).filter(Message.chat_id.in_(chat_ids)).delete(synchronize_session=False)
+        archive_keys = [chat.archive_key for chat in chats_to_delete if chat.archive_key]
+        share_tokens = [chat.share_token for chat in chats_to_delete if chat.share_token]
+        # Сначала удаляем сообщения (зависимые данные); сообщения не старше чата — отсекаем старые партиции
+        messages = db.query(Message).filter(Message.chat_id.in_(chat_ids))
+        if since:
+            messages = messages.filter(Message.created_at >= since)
+        messages.delete(synchronize_session=False)
         # Потом удаляем чаты
         db.query(Chat).filter(Chat.id.in_(chat_ids)).delete(synchronize_session=False)
         db.commit()
+        archive.delete_blobs(archive_keys)
+        share_snapshots.delete(share_tokens)
     
     return {"status": "cleared", "count": len(chat_ids)}
 
@@ -276,9 +611,14 @@ def rename_chat(chat_id: int, request: Request, payload: dict = Body(...), db: S
     if not chat:
         raise HTTPException(404)
     
+    shared = False
     if "title" in payload:
         chat.title = payload["title"]
+        search.index_chat(db, chat)
+        shared = share_snapshots.touch(db, chat.id)
     db.commit()
+    if shared:
+        share_snapshots.schedule(chat.id)
     return {"status": "ok"}
 
 
@@ -312,5 +652,7 @@ def share_chat(chat_id: int, request: Request, db: Session = Depends(get_db)):
     if not chat.share_token:
         chat.share_token = str(uuid.uuid4())
         db.commit()
+        # Статический снимок в S3; до его публикации /share/{token} рендерит страницу сам
+        share_snapshots.schedule(chat.id)
     
-    return {"link": f"https://lk.neirosetim.ru/share/{chat.share_token}"}
+    return {"link": share_snapshots.share_link(chat.share_token)}
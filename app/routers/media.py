@@ -0,0 +1,80 @@
+"""
+Роутер задач генерации медиа (fal.ai): постановка, статус, SSE-прогресс и вебхук fal
+"""
+import hmac
+import logging
+from fastapi import APIRouter, Request, Depends, HTTPException, Body, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.dependencies import get_current_user
+from app.models import Chat, GenerationJob
+from app.services.ai_generation import MODEL_PRICING
+from app.services import media_jobs
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["media"])
+
+
+def get_user_job(job_id: int, request: Request, db: Session) -> GenerationJob:
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(401)
+    job = db.query(GenerationJob).filter(
+        GenerationJob.id == job_id, GenerationJob.user_casdoor_id == user.casdoor_id
+    ).first()
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
+
+
+@router.post("/api/media/jobs")
+def create_media_job(request: Request, payload: dict = Body(...), db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(401)
+
+    model_id = payload.get("model")
+    prompt = (payload.get("prompt") or "").strip()
+    if not media_jobs.is_media_model(model_id) or model_id not in MODEL_PRICING:
+        raise HTTPException(400, "Unknown media model")
+    if not prompt:
+        raise HTTPException(400, "Prompt is required")
+
+    chat_id = payload.get("chat_id")
+    if chat_id is not None:
+        chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_casdoor_id == user.casdoor_id).first()
+        if not chat:
+            raise HTTPException(404, "Chat not found")
+
+    try:
+        job = media_jobs.create_job(db, user, model_id, prompt, chat_id=chat_id, attachment_url=payload.get("attachment_url"))
+    except ValueError as e:
+        raise HTTPException(402, str(e))
+    return media_jobs.job_to_dict(job)
+
+
+@router.get("/api/media/jobs/{job_id}")
+def get_media_job(job_id: int, request: Request, db: Session = Depends(get_db)):
+    return media_jobs.job_to_dict(get_user_job(job_id, request, db))
+
+
+@router.get("/api/media/jobs/{job_id}/events")
+def media_job_events(job_id: int, request: Request, db: Session = Depends(get_db)):
+    job = get_user_job(job_id, request, db)
+    return StreamingResponse(media_jobs.job_events(job.id), media_type="text/event-stream")
+
+
+@router.post("/api/media/webhook")
+async def media_webhook(request: Request, background_tasks: BackgroundTasks, token: str = ""):
+    """Вебхук fal: отвечаем сразу, результат обрабатываем после ответа"""
+    secret = media_jobs.MEDIA_WEBHOOK_SECRET
+    if not secret or not hmac.compare_digest(token, secret):
+        raise HTTPException(403)
+
+    payload = await request.json()
+    logger.info(f"fal webhook: request={payload.get('request_id')} status={payload.get('status')}")
+    background_tasks.add_task(media_jobs.handle_webhook, payload)
+    return {"status": "ok"}
@@ -0,0 +1,20 @@
+"""
+Роутер истории расходов: суммы по дням и моделям из usage_daily (app/services/usage.py)
+"""
+from fastapi import APIRouter, Request, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.dependencies import get_current_user
+from app.responses import FastJSONResponse
+from app.services import usage
+from app.services.replicas import get_read_db
+
+router = APIRouter(tags=["usage"])
+
+
+@router.get("/api/usage")
+def get_usage(request: Request, days: int = 30, db: Session = Depends(get_read_db)):
+    user = get_current_user(request, db)
+    if not user:
+        raise HTTPException(401)
+    return FastJSONResponse({"balance": user.balance, **usage.daily(db, user.casdoor_id, days)})
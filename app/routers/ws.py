@@ -0,0 +1,215 @@
+"""
+WebSocket-транспорт чата: одно соединение на вкладку вместо POST + SSE на каждое сообщение.
+
+Авторизация один раз при подключении (кука session_id), дальше по сокету идут JSON-кадры
+для нескольких чатов сразу.
+
+Клиент → сервер:
+    {"type": "send", "ref": "...", "chat_id": 42 | null, "message": "...", "model": "...",
+     "attachment_url": null, "is_temporary": false}      — без chat_id создаётся новый чат
+    {"type": "cancel", "chat_id": 42}
+    {"type": "ping"}
+
+Сервер → клиент:
+    {"type": "started", "ref": "...", "chat_id": 42}
+    {"type": "chunk", "chat_id": 42, "content": "..."}
+    {"type": "job", "chat_id": 42, "job": {...}}           — прогресс медиа-генерации
+    {"type": "done", "chat_id": 42, "status": "completed" | "cancelled" | "failed"}
+    {"type": "balance", "balance": 123.45}
+    {"type": "error", "ref": "...", "chat_id": 42, "code": 404, "message": "..."}
+    {"type": "pong"}
+
+Генерация и сохранение — те же, что у SSE (chats.stream_reply): отмена или разрыв
+соединения сохраняет уже полученную часть ответа.
+"""
+import os
+import json
+import asyncio
+import logging
+from contextlib import aclosing
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+
+from app.database import SessionLocal
+from app.dependencies import get_current_user
+from app.models import UserWallet
+from app.routers import chats
+from app.services import media_jobs, metrics
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["ws"])
+
+# Сколько генераций одновременно на одно соединение
+WS_MAX_STREAMS = int(os.getenv("WS_MAX_STREAMS", "4"))
+
+
+class ChatSocket:
+    """Состояние одного соединения: пользователь, активные генерации по chat_id"""
+
+    def __init__(self, websocket: WebSocket, user_casdoor_id: str):
+        self.websocket = websocket
+        self.user_casdoor_id = user_casdoor_id
+        self.streams = {}
+        # Кадры шлют несколько задач — запись в сокет по одной
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: dict):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(frame, ensure_ascii=False))
+
+    async def error(self, message: str, code: int = 400, ref=None, chat_id=None):
+        await self.send({"type": "error", "ref": ref, "chat_id": chat_id, "code": code, "message": message})
+
+    # === ВХОДЯЩИЕ КАДРЫ ===
+
+    async def handle(self, frame: dict):
+        kind = frame.get("type")
+        if kind == "send":
+            await self.start_stream(frame)
+        elif kind == "cancel":
+            task = self.streams.get(frame.get("chat_id"))
+            if task and not task.done():
+                metrics.STREAMS_CANCELLED.labels("client").inc()
+                task.cancel()
+        elif kind == "ping":
+            await self.send({"type": "pong"})
+        else:
+            await self.error(f"Unknown frame type: {kind}", ref=frame.get("ref"))
+
+    async def start_stream(self, frame: dict):
+        ref = frame.get("ref")
+        chat_id = frame.get("chat_id")
+        if chat_id in self.streams:
+            return await self.error("Chat is already generating", 409, ref, chat_id)
+        if len(self.streams) >= WS_MAX_STREAMS:
+            return await self.error(f"Too many parallel generations (max {WS_MAX_STREAMS})", 429, ref, chat_id)
+
+        try:
+            chat_id, context, start = await asyncio.to_thread(self.prepare, frame)
+        except HTTPException as e:
+            return await self.error(str(e.detail), e.status_code, ref, chat_id)
+        except ValueError as e:
+            return await self.error(str(e), 402, ref, chat_id)
+
+        await self.send({"type": "started", "ref": ref, "chat_id": chat_id})
+        task = asyncio.create_task(self.run_stream(chat_id, context, start))
+        self.streams[chat_id] = task
+        task.add_done_callback(lambda _: self.streams.pop(chat_id, None))
+
+    def prepare(self, frame: dict):
+        """Сохраняет сообщение пользователя (sync, в тредпуле); возвращает, что стримить"""
+        payload = {k: v for k, v in frame.items() if k in ("message", "model", "attachment_url", "is_temporary")}
+        db = SessionLocal()
+        try:
+            user = db.query(UserWallet).filter(UserWallet.casdoor_id == self.user_casdoor_id).first()
+            if not user:
+                raise HTTPException(401, "Unauthorized")
+            if frame.get("chat_id") is None:
+                chat = chats.start_chat(db, user, payload)
+            else:
+                chat = chats.append_user_message(db, user, frame["chat_id"], payload)
+
+            if media_jobs.is_media_model(chat.model):
+                job = media_jobs.create_job(db, user, chat.model, payload.get("message", ""),
+                                            chat_id=chat.id, attachment_url=payload.get("attachment_url"))
+                return chat.id, None, {"job_id": job.id}
+            start = {
+                "model_id": chat.model,
+                "user_balance": user.balance,
+                "attachment_url": payload.get("attachment_url"),
+            }
+            return chat.id, chats.chat_context(db, chat), start
+        finally:
+            db.close()
+
+    # === ИСХОДЯЩИЙ СТРИМ ===
+
+    async def run_stream(self, chat_id: int, context: list, start: dict):
+        status = "cancelled"
+        try:
+            if "job_id" in start:
+                await self.forward_job(chat_id, start["job_id"])
+            else:
+                stream = chats.stream_reply(chat_id, start["model_id"], context, start["user_balance"],
+                                            self.user_casdoor_id, start["attachment_url"])
+                async with aclosing(stream) as chunks:
+                    async for content in chunks:
+                        await self.send({"type": "chunk", "chat_id": chat_id, "content": content})
+            status = "completed"
+        except asyncio.CancelledError:
+            # Отмена клиентом — стрим закрыт, частичный ответ сохранён; соединение живо
+            pass
+        except Exception as e:
+            status = "failed"
+            logger.error(f"WS stream error (chat {chat_id}): {e}", exc_info=True)
+        try:
+            await self.send({"type": "done", "chat_id": chat_id, "status": status})
+            await self.send_balance()
+        except Exception:
+            # Соединение уже закрыто
+            pass
+
+    async def forward_job(self, chat_id: int, job_id: int):
+        """Кадры job_events (SSE-строки) как WS-кадры"""
+        async for event in media_jobs.job_events(job_id):
+            data = json.loads(event.removeprefix("data: ").strip())
+            if "job" in data:
+                await self.send({"type": "job", "chat_id": chat_id, "job": data["job"]})
+            else:
+                await self.send({"type": "chunk", "chat_id": chat_id, "content": data.get("content", "")})
+
+    async def send_balance(self):
+        def load():
+            db = SessionLocal()
+            try:
+                return db.query(UserWallet.balance).filter(UserWallet.casdoor_id == self.user_casdoor_id).scalar()
+            finally:
+                db.close()
+        balance = await asyncio.to_thread(load)
+        if balance is not None:
+            await self.send({"type": "balance", "balance": balance})
+
+    async def close(self):
+        tasks = [task for task in self.streams.values() if not task.done()]
+        for task in tasks:
+            metrics.STREAMS_CANCELLED.labels("disconnect").inc()
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    def authenticate():
+        db = SessionLocal()
+        try:
+            user = get_current_user(websocket, db)
+            return user.casdoor_id if user else None
+        finally:
+            db.close()
+
+    user_casdoor_id = await asyncio.to_thread(authenticate)
+    if not user_casdoor_id:
+        # 4401 — закрытие до accept: браузер увидит отказ рукопожатия
+        await websocket.close(code=4401)
+        return
+
+    await websocket.accept()
+    conn = ChatSocket(websocket, user_casdoor_id)
+    await conn.send_balance()
+    try:
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+            except ValueError:
+                await conn.error("Invalid JSON")
+                continue
+            if not isinstance(frame, dict):
+                await conn.error("Frame must be an object")
+                continue
+            await conn.handle(frame)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Разрыв соединения = отмена: частичные ответы сохраняются в stream_reply
+        await conn.close()
@@ -1,9 +1,11 @@
 import os
 import json
 import logging
+import time
 import httpx
-import asyncio
-from openai import AsyncOpenAI
+
+from app.services import metrics
+from app.services.registry import services
 
 logger = logging.getLogger(__name__)
 
@@ -11,23 +13,32 @@ logger = logging.getLogger(__name__)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 FAL_KEY = os.getenv("FAL_KEY")
 AI_PROXY_URL = os.getenv("AI_PROXY_URL")  # HTTP прокси для OpenRouter
+# Переопределяется для бенчмарков (bench/fake_openrouter.py)
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 
-# Создаём HTTP-клиент с таймаутами (по умолчанию используется прокси, если задан)
-http_client = None
 DEFAULT_AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "30"))
 timeout = httpx.Timeout(DEFAULT_AI_TIMEOUT, connect=10.0)
 
-if AI_PROXY_URL:
-    http_client = httpx.AsyncClient(proxy=AI_PROXY_URL, timeout=timeout)
-    logger.info(f"OpenRouter proxy: {AI_PROXY_URL.split('@')[-1] if '@' in AI_PROXY_URL else 'configured'}")
-else:
-    http_client = httpx.AsyncClient(timeout=timeout)
 
-client = AsyncOpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY,
-    http_client=http_client,
-)
+def create_openrouter_client():
+    """AsyncOpenAI поверх своего httpx-клиента с таймаутами (и прокси, если задан)"""
+    # openai импортируется ~0.5с — только при первом запросе к модели
+    from openai import AsyncOpenAI
+
+    if AI_PROXY_URL:
+        http_client = httpx.AsyncClient(proxy=AI_PROXY_URL, timeout=timeout)
+        logger.info(f"OpenRouter proxy: {AI_PROXY_URL.split('@')[-1] if '@' in AI_PROXY_URL else 'configured'}")
+    else:
+        http_client = httpx.AsyncClient(timeout=timeout)
+
+    return AsyncOpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=OPENROUTER_API_KEY,
+        http_client=http_client,
+    )
+
+
+services.register("openrouter", create_openrouter_client)
 
 if not OPENROUTER_API_KEY:
     logger.warning("OPENROUTER_API_KEY is not set!")
@@ -217,30 +228,84 @@ AI_MODELS_GROUPS = [
     }
 ]
 
+# === КЭШ ПРОМПТА ===
+# Провайдеры с явными точками кэша (cache_control) — без них длинная история чата
+# каждый ход обрабатывается заново. OpenAI/DeepSeek/Grok кэшируют префикс сами.
+CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+# Множители к цене входа: чтение из кэша / запись в кэш (по прайсу провайдеров в OpenRouter)
+CACHE_PRICE_MULTIPLIERS = {
+    "anthropic/": {"cache_read": 0.1, "cache_write": 1.25},
+    "google/": {"cache_read": 0.25, "cache_write": 1.0},
+    "openai/": {"cache_read": 0.5, "cache_write": 1.0},
+    "deepseek/": {"cache_read": 0.1, "cache_write": 1.0},
+    "x-ai/": {"cache_read": 0.25, "cache_write": 1.0},
+}
+# Меньше ≈1024 токенов провайдеры не кэшируют — точку не ставим
+PROMPT_CACHE_MIN_CHARS = int(os.getenv("PROMPT_CACHE_MIN_CHARS", "4096"))
+
 # Генерируем словарь цен для быстрого доступа по ID модели
 MODEL_PRICING = {}
 for group in AI_MODELS_GROUPS:
     for m in group['models']:
+        cache = next((v for k, v in CACHE_PRICE_MULTIPLIERS.items() if m['id'].startswith(k)),
+                     {"cache_read": 1.0, "cache_write": 1.0})
         MODEL_PRICING[m['id']] = {
             "input": m.get("cost_input", 0),
-            "output": m.get("cost_output", 0)
+            "output": m.get("cost_output", 0),
+            "cache_read": m.get("cost_cache_read", m.get("cost_input", 0) * cache["cache_read"]),
+            "cache_write": m.get("cost_cache_write", m.get("cost_input", 0) * cache["cache_write"]),
         }
 
 def get_models_config():
     """Возвращает полный конфиг моделей для API"""
     return AI_MODELS_GROUPS
 
-# ==============================================================================
+def estimate_cost(model_id: str, messages: list, output_text: str) -> float:
+    """Стоимость в рублях по приблизительному числу токенов (символы/4), цены — за 1000 токенов"""
+    pricing = MODEL_PRICING.get(model_id) or {"input": 0, "output": 0}
+    input_tokens_approx = sum(len(m['content']) for m in messages) / 4
+    output_tokens = len(output_text) / 4
+    return (input_tokens_approx / 1_000 * pricing['input']) + \
+           (output_tokens / 1_000 * pricing['output'])
 
-async def generate_ai_response_stream(model_id: str, messages: list, user_balance: float, temperature: float = 0.7, web_search: bool = False, attachment_url: str = None):
-    # Пытаемся найти модель в прайсинге
-    pricing = MODEL_PRICING.get(model_id)
-    if not pricing:
-        # Fallback
-        pricing = {"input": 0, "output": 0}
-        logger.warning(f"Model ID {model_id} not found in pricing config.")
-    
-    # Подготовка сообщений (Vision)
+def usage_cost(model_id: str, usage) -> float:
+    """
+    Стоимость в рублях по usage провайдера (реальные токены, с учётом кэша промпта).
+    prompt_tokens включает прочитанные из кэша и записанные в кэш токены.
+    """
+    pricing = MODEL_PRICING.get(model_id) or {"input": 0, "output": 0, "cache_read": 0, "cache_write": 0}
+    cached, written = cache_tokens(usage)
+    uncached = max((usage.prompt_tokens or 0) - cached - written, 0)
+    return (uncached * pricing['input'] + cached * pricing['cache_read'] + written * pricing['cache_write'] +
+            (usage.completion_tokens or 0) * pricing['output']) / 1_000
+
+def cache_tokens(usage) -> tuple:
+    """(прочитано из кэша, записано в кэш) из usage.prompt_tokens_details OpenRouter"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return 0, 0
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0, details.get("cache_write_tokens") or 0
+    extra = getattr(details, "model_extra", None) or {}
+    return getattr(details, "cached_tokens", 0) or 0, extra.get("cache_write_tokens") or 0
+
+def supports_cache_control(model_id: str) -> bool:
+    return model_id.startswith(CACHE_CONTROL_PREFIXES)
+
+def _cache_breakpoint(message: dict) -> dict:
+    """Точка кэша: всё до конца этого сообщения включительно — кэшируемый префикс"""
+    content = message["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = [*content[:-1], {**content[-1], "cache_control": {"type": "ephemeral"}}]
+    return {**message, "content": content}
+
+def build_messages(model_id: str, messages: list, attachment_url: str = None) -> list:
+    """
+    История чата в формате OpenAI (картинка — к последнему сообщению пользователя).
+    Для Anthropic/Gemini ставит точки кэша: на системный промпт и на конец прошлого хода —
+    следующий запрос чата читает весь этот префикс из кэша, а не обрабатывает заново.
+    """
     final_messages = []
     for msg in messages:
         content = msg["content"]
@@ -257,79 +322,106 @@ async def generate_ai_response_stream(model_id: str, messages: list, user_balanc
         else:
             final_messages.append({"role": role, "content": content})
 
+    if not supports_cache_control(model_id) or len(final_messages) < 2:
+        return final_messages
+
+    # Стабильный префикс — всё, кроме нового сообщения пользователя
+    breakpoints = []
+    if final_messages[0]["role"] == "system":
+        breakpoints.append(0)
+    prefix_end = len(final_messages) - 2
+    prefix_chars = sum(len(m["content"]) for m in messages[:prefix_end + 1] if isinstance(m["content"], str))
+    if prefix_end not in breakpoints and prefix_chars >= PROMPT_CACHE_MIN_CHARS:
+        breakpoints.append(prefix_end)
+    for i in breakpoints:
+        final_messages[i] = _cache_breakpoint(final_messages[i])
+    return final_messages
+
+def model_label(model_id: str) -> str:
+    """Метка модели для метрик: ID приходит от клиента, неизвестные схлопываем, чтобы не раздувать кардинальность"""
+    return model_id if model_id in MODEL_PRICING else "other"
+
+# ==============================================================================
+
+async def generate_ai_response_stream(model_id: str, messages: list, user_balance: float, temperature: float = 0.7, web_search: bool = False, attachment_url: str = None, usage_out: dict = None):
+    # usage_out — если передан, сюда пишутся токены из usage провайдера (учёт расходов, app/services/usage.py)
+    # Неизвестная модель считается бесплатной (estimate_cost)
+    if model_id not in MODEL_PRICING:
+        logger.warning(f"Model ID {model_id} not found in pricing config.")
+    
+    # Подготовка сообщений (Vision, точки кэша промпта)
+    final_messages = build_messages(model_id, messages, attachment_url)
+
     # Параметры OpenRouter
     extra_body = {}
     if web_search:
         extra_body["plugins"] = [{"id": "web_search"}] 
 
     logger.debug(f"generate_ai_response_stream start model={model_id} timeout={DEFAULT_AI_TIMEOUT}")
+    label = model_label(model_id)
+    started = time.perf_counter()
+    full_response = ""
     try:
-        stream = await client.chat.completions.create(
+        stream = await services.get("openrouter").chat.completions.create(
             model=model_id,
             messages=final_messages,
             temperature=temperature,
             stream=True,
+            # Последний чанк — usage с реальными токенами (в т.ч. прочитанными из кэша)
+            stream_options={"include_usage": True},
             extra_body=extra_body
         )
 
-        full_response = ""
-        input_tokens_approx = sum(len(m['content']) for m in messages) / 4 
+        first_chunk = True
+        usage = None
         
-        async for chunk in stream:
-            content = getattr(chunk.choices[0].delta, 'content', None)
-            if content:
-                full_response += content
-                yield content, 0.0
+        # async with: при отмене/закрытии генератора HTTP-ответ закрывается сразу,
+        # провайдер прекращает генерацию, соединение возвращается в пул
+        async with stream:
+            async for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                content = getattr(chunk.choices[0].delta, 'content', None)
+                if content:
+                    if first_chunk:
+                        metrics.UPSTREAM_TTFT.labels(label).observe(time.perf_counter() - started)
+                        first_chunk = False
+                    full_response += content
+                    yield content, 0.0
 
         # Финальный подсчет стоимости (Цены в РУБЛЯХ за 1000 токенов)
-        output_tokens = len(full_response) / 4
-        total_cost = (input_tokens_approx / 1_000 * pricing['input']) + \
-                     (output_tokens / 1_000 * pricing['output'])
+        if usage is not None and usage.prompt_tokens:
+            cached, written = cache_tokens(usage)
+            metrics.UPSTREAM_PROMPT_TOKENS.labels(label, "read").inc(cached)
+            metrics.UPSTREAM_PROMPT_TOKENS.labels(label, "write").inc(written)
+            metrics.UPSTREAM_PROMPT_TOKENS.labels(label, "miss").inc(max(usage.prompt_tokens - cached - written, 0))
+            total_cost = usage_cost(model_id, usage)
+            if usage_out is not None:
+                usage_out.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens or 0,
+                                 cached_tokens=cached)
+        else:
+            total_cost = estimate_cost(model_id, messages, full_response)
         
         yield "", total_cost
 
     except httpx.ReadTimeout as e:
         logger.error(f"AI Generation Timeout (read): {e}")
+        metrics.UPSTREAM_ERRORS.labels(label, "read_timeout").inc()
         yield "Error: request timed out (read)", 0.0
     except httpx.ConnectTimeout as e:
         logger.error(f"AI Generation Timeout (connect): {e}")
+        metrics.UPSTREAM_ERRORS.labels(label, "connect_timeout").inc()
         yield "Error: request timed out (connect)", 0.0
     except httpx.TimeoutException as e:
         logger.error(f"AI Generation Timeout: {e}")
+        metrics.UPSTREAM_ERRORS.labels(label, "timeout").inc()
         yield "Error: request timed out", 0.0
     except Exception as e:
         logger.exception(f"AI Generation Error: {e}")
+        metrics.UPSTREAM_ERRORS.labels(label, type(e).__name__).inc()
         yield f"Error: {str(e)}", 0.0
-
-
-async def generate_ai_response_media(model_id: str, messages: list, user_balance: float, attachment_url: str = None):
-    """
-    Генерация для медиа-моделей через Fal.ai.
-    """
-    prompt = messages[-1]['content']
-    pricing = MODEL_PRICING.get(model_id, {"input": 0, "output": 0})
-    cost = pricing['output']
-
-    if user_balance < cost:
-        raise Exception("Недостаточно средств")
-
-    try:
-        # Здесь должна быть реальная интеграция с API генерации картинок
-        # (вставь сюда код вызова Fal.ai из своего бэкапа, если он был)
-        
-        # Эмуляция (задержка для реализма)
-        await asyncio.sleep(2)
-        return f"![Generated Image](https://via.placeholder.com/1024x1024?text=Gen+{model_id.split('/')[-1]}) (Генерация {model_id})", cost
-
-    except httpx.ReadTimeout as e:
-        logger.error(f"Media Gen Timeout (read): {e}")
-        raise Exception("request timed out (read)")
-    except httpx.ConnectTimeout as e:
-        logger.error(f"Media Gen Timeout (connect): {e}")
-        raise Exception("request timed out (connect)")
-    except httpx.TimeoutException as e:
-        logger.error(f"Media Gen Timeout: {e}")
-        raise Exception("request timed out")
-    except Exception as e:
-        logger.exception(f"Media Gen Error: {e}")
-        raise
\ No newline at end of file
+    finally:
+        # Включая оборванные стримы: провайдер берёт плату за то, что успел сгенерировать
+        metrics.UPSTREAM_OUTPUT_TOKENS.labels(label).inc(len(full_response) / 4)
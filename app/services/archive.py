@@ -0,0 +1,198 @@
+"""
+Холодный архив чатов.
+
+Чаты, не менявшиеся CHAT_ARCHIVE_AFTER_DAYS дней, выгружаются в S3 одним сжатым blob на чат
+(JSON сообщений, zstd), а их строки удаляются из messages — горячая таблица остаётся маленькой.
+При открытии чата ensure_hydrated() возвращает сообщения в базу с прежними id и переиндексирует их.
+Пока чат в архиве, поиск находит его только по названию.
+
+Фоновый цикл run_archiver() запускается из lifespan приложения; разовый прогон:
+    DB_URL=postgresql://... python -m app.services.archive --limit 1000
+"""
+import os
+import json
+import uuid
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import Chat, Message
+from app.services import s3, search
+from app.services.partitions import chat_messages, chat_messages_filter
+from app.codec import CODEC_ZSTD, compress, decompress, encode_content
+
+logger = logging.getLogger(__name__)
+
+# 0 — архивация выключена
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "180"))
+CHAT_ARCHIVE_INTERVAL = float(os.getenv("CHAT_ARCHIVE_INTERVAL", "3600"))
+CHAT_ARCHIVE_BATCH = int(os.getenv("CHAT_ARCHIVE_BATCH", "200"))
+ARCHIVE_PREFIX = "chat-archive/"
+
+
+# === ФОРМАТ BLOB ===
+
+def serialize(messages: list) -> bytes:
+    payload = json.dumps([{
+        "id": m.id,
+        "role": m.role,
+        "content": m.content,
+        "image_url": m.image_url,
+        "attachment_url": m.attachment_url,
+        "created_at": m.created_at.isoformat() if m.created_at else None,
+    } for m in messages], ensure_ascii=False).encode("utf-8")
+    return CODEC_ZSTD + compress(payload)
+
+
+def deserialize(blob: bytes) -> list:
+    codec, payload = blob[:1], blob[1:]
+    if codec != CODEC_ZSTD:
+        raise ValueError(f"Unknown archive codec: {codec!r}")
+    return json.loads(decompress(payload))
+
+
+def load_messages(key: str) -> list:
+    return deserialize(s3.get_object_bytes(key))
+
+
+def delete_blobs(keys):
+    for key in keys:
+        if key:
+            s3.delete_object(key)
+
+
+# === АРХИВАЦИЯ ===
+
+def archive_chat(db: Session, chat_id: int, cutoff: datetime) -> bool:
+    # Блокируем строку чата: новое сообщение (continue_chat обновляет updated_at) дождётся конца архивации
+    chat = db.query(Chat).filter(
+        Chat.id == chat_id, Chat.archived_at.is_(None), Chat.updated_at < cutoff
+    ).with_for_update().first()
+    if not chat:
+        db.rollback()
+        return False
+
+    messages = chat_messages(db, chat).all()
+    key = f"{ARCHIVE_PREFIX}{uuid.uuid4()}.json.zst"
+    if not s3.put_object_bytes(key, serialize(messages), "application/zstd"):
+        db.rollback()
+        return False
+
+    try:
+        chat.archived_at = datetime.utcnow()
+        chat.archive_key = key
+        db.execute(delete(Message).where(*chat_messages_filter(chat)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        s3.delete_object(key)
+        raise
+    logger.info(f"Archived chat {chat.id}: {len(messages)} messages -> {key}")
+    return True
+
+
+def archive_cold_chats(limit: int = CHAT_ARCHIVE_BATCH) -> int:
+    """Один проход: до limit самых старых чатов. Закреплённые и временные не трогаем."""
+    cutoff = datetime.utcnow() - timedelta(days=CHAT_ARCHIVE_AFTER_DAYS)
+    db = SessionLocal()
+    try:
+        chat_ids = db.execute(
+            select(Chat.id)
+            .where(Chat.archived_at.is_(None), Chat.updated_at < cutoff,
+                   Chat.is_pinned.isnot(True), Chat.expires_at.is_(None))
+            .order_by(Chat.updated_at)
+            .limit(limit)
+        ).scalars().all()
+        db.rollback()
+
+        archived = 0
+        for chat_id in chat_ids:
+            try:
+                archived += archive_chat(db, chat_id, cutoff)
+            except Exception as e:
+                logger.error(f"Archive error for chat {chat_id}: {e}")
+        return archived
+    finally:
+        db.close()
+
+
+# === РАЗАРХИВАЦИЯ ===
+
+def ensure_hydrated(db: Session, chat: Chat):
+    """Возвращает сообщения архивного чата в базу; без архива — ничего не делает"""
+    if not chat.archived_at:
+        return
+    key = chat.archive_key
+    messages = load_messages(key)
+
+    # Условный UPDATE: из двух одновременных открытий сообщения вставит только одно
+    claimed = db.execute(
+        update(Chat).where(Chat.id == chat.id, Chat.archive_key == key)
+        .values(archived_at=None, archive_key=None)
+    ).rowcount
+    if not claimed:
+        db.rollback()
+        db.refresh(chat)
+        return
+
+    rows = []
+    for m in messages:
+        content, compressed = encode_content(m["content"])
+        rows.append({
+            "id": m["id"], "chat_id": chat.id, "role": m["role"],
+            "content": content, "content_compressed": compressed,
+            "image_url": m.get("image_url"), "attachment_url": m.get("attachment_url"),
+            # Старые архивы без времени — время чата (партиция и инвариант created_at >= chats.created_at)
+            "created_at": datetime.fromisoformat(m["created_at"]) if m.get("created_at") else chat.created_at or datetime.utcnow(),
+        })
+    if rows:
+        db.execute(insert(Message.__table__), rows)
+    search.index_chats_bulk(db.connection(), [chat.id])
+    db.commit()
+    db.expire(chat)
+
+    s3.delete_object(key)
+    logger.info(f"Rehydrated chat {chat.id}: {len(rows)} messages")
+
+
+# === ФОНОВЫЙ ЦИКЛ ===
+
+async def run_archiver():
+    if CHAT_ARCHIVE_AFTER_DAYS <= 0 or not s3.is_configured():
+        logger.info("Chat archiver disabled")
+        return
+    if not s3.is_private_configured():
+        logger.warning("Chat archiver disabled: set S3_PRIVATE_BUCKET_NAME to a private bucket other than S3_BUCKET_NAME")
+        return
+    logger.info(f"Chat archiver started: chats idle > {CHAT_ARCHIVE_AFTER_DAYS}d, every {CHAT_ARCHIVE_INTERVAL:.0f}s")
+    while True:
+        try:
+            # boto3 и запросы синхронные — уводим из event loop
+            archived = await asyncio.to_thread(archive_cold_chats)
+            if archived:
+                logger.info(f"Archived {archived} cold chats")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Archiver error: {e}")
+        await asyncio.sleep(CHAT_ARCHIVE_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка холодных чатов в S3")
+    parser.add_argument("--limit", type=int, default=CHAT_ARCHIVE_BATCH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not s3.is_private_configured():
+        raise SystemExit("S3_PRIVATE_BUCKET_NAME must be set to a private bucket other than S3_BUCKET_NAME")
+    print(f"Archived {archive_cold_chats(args.limit)} chats")
+
+
+if __name__ == "__main__":
+    main()
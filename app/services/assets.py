@@ -0,0 +1,175 @@
+"""
+Статика с отпечатками содержимого и предсжатыми вариантами.
+
+build() раскладывает app/static в STATIC_BUILD_DIR: каждый файл под исходным именем и под
+именем с хэшем содержимого (js/app.3f2a1b9c.js), плюс .br/.gz для текстовых форматов.
+Шаблоны ссылаются через static_url('js/app.js') — в HTML попадает имя с хэшем, которое
+отдаётся с Cache-Control: immutable на год: новая версия файла = новое имя, браузер
+не перепроверяет старое. Исходные имена (на них могут ссылаться CSS и внешние страницы)
+отдаются с no-cache — только перепроверка по ETag.
+
+Сборка идёт в образе (Dockerfile: python -m app.services.assets) и повторяется на старте
+воркера: неизменившиеся файлы не пережимаются, так что это только чтение и хэширование.
+"""
+import os
+import gzip
+import json
+import filecmp
+import hashlib
+import logging
+import mimetypes
+from stat import S_ISREG
+
+import anyio
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+STATIC_BUILD_DIR = os.getenv("STATIC_BUILD_DIR", os.path.join(BASE_DIR, "static_build"))
+STATIC_URL_PREFIX = "/static"
+MANIFEST_NAME = "manifest.json"
+
+# Что имеет смысл сжимать (картинки/шрифты уже сжаты своими форматами)
+COMPRESSIBLE = (".js", ".css", ".svg", ".json", ".html", ".txt", ".map")
+# Варианты в порядке предпочтения при согласовании Accept-Encoding
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# исходный путь -> путь с хэшем, относительно STATIC_DIR
+_manifest = {}
+_hashed = set()
+
+
+# === СБОРКА ===
+
+def fingerprint(rel_path: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    stem, ext = os.path.splitext(rel_path)
+    return f"{stem}.{digest}{ext}"
+
+
+def _write(path: str, data: bytes):
+    """Атомарно: соседний воркер может собирать одновременно и не должен увидеть половину файла"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _compressed_variants(data: bytes) -> dict:
+    import brotli  # только при сборке изменившихся файлов
+    return {
+        ".br": brotli.compress(data, quality=11),
+        ".gz": gzip.compress(data, compresslevel=9, mtime=0),
+    }
+
+
+def build(source_dir: str = STATIC_DIR, build_dir: str = STATIC_BUILD_DIR) -> dict:
+    """Собирает статику; возвращает манифест {исходный путь: путь с хэшем}"""
+    manifest = {}
+    for root, _, files in os.walk(source_dir):
+        for name in sorted(files):
+            src = os.path.join(root, name)
+            rel_path = os.path.relpath(src, source_dir).replace(os.sep, "/")
+            with open(src, "rb") as f:
+                data = f.read()
+            hashed = fingerprint(rel_path, data)
+            manifest[rel_path] = hashed
+
+            hashed_path = os.path.join(build_dir, hashed)
+            if not os.path.exists(hashed_path):
+                variants = {"": data}
+                if name.endswith(COMPRESSIBLE):
+                    variants.update({suffix: body for suffix, body in _compressed_variants(data).items()
+                                     if len(body) < len(data)})
+                for suffix, body in variants.items():
+                    _write(hashed_path + suffix, body)
+
+            # Под исходным именем — копия текущей версии (там могла остаться прошлая)
+            plain_path = os.path.join(build_dir, rel_path)
+            for suffix in ("", ".br", ".gz"):
+                built, plain = hashed_path + suffix, plain_path + suffix
+                if not os.path.exists(built):
+                    if os.path.exists(plain):
+                        os.remove(plain)
+                elif not (os.path.exists(plain) and filecmp.cmp(built, plain, shallow=False)):
+                    with open(built, "rb") as f:
+                        _write(plain, f.read())
+
+    _write(os.path.join(build_dir, MANIFEST_NAME), json.dumps(manifest, indent=2).encode())
+    return manifest
+
+
+def load(build_dir: str = STATIC_BUILD_DIR):
+    """Собирает статику и подхватывает манифест для static_url(); вызывается при старте"""
+    global _manifest, _hashed
+    try:
+        manifest = build(STATIC_DIR, build_dir)
+    except OSError as e:
+        # Нет прав на запись (read-only образ) — берём манифест, собранный при сборке образа
+        logger.warning(f"Static build skipped: {e}")
+        try:
+            with open(os.path.join(build_dir, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+    _manifest = manifest
+    _hashed = set(manifest.values())
+    logger.info(f"Static assets: {len(manifest)} files fingerprinted")
+
+
+def static_url(path: str) -> str:
+    """URL ассета для шаблонов: с хэшем, если файл собран, иначе исходный"""
+    path = path.lstrip("/")
+    return f"{STATIC_URL_PREFIX}/{_manifest.get(path, path)}"
+
+
+# === ОТДАЧА ===
+
+class AssetFiles(StaticFiles):
+    """StaticFiles над STATIC_BUILD_DIR: предсжатые варианты по Accept-Encoding и долгий кэш для имён с хэшем"""
+
+    async def get_response(self, path: str, scope):
+        response = await self._encoded_response(path, scope)
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            rel_path = path.replace(os.sep, "/")
+            response.headers["cache-control"] = IMMUTABLE_CACHE if rel_path in _hashed else REVALIDATE_CACHE
+            if rel_path.endswith(COMPRESSIBLE):
+                response.headers["vary"] = "Accept-Encoding"
+        return response
+
+    async def _encoded_response(self, path: str, scope):
+        if scope["method"] not in ("GET", "HEAD") or not path.endswith(COMPRESSIBLE):
+            return None
+        request_headers = Headers(scope=scope)
+        accepted = {e.split(";")[0].strip() for e in request_headers.get("accept-encoding", "").split(",")}
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result is None or not S_ISREG(stat_result.st_mode):
+                continue
+            media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            response = FileResponse(full_path, stat_result=stat_result, media_type=media_type,
+                                    headers={"content-encoding": encoding})
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+        return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    result = build()
+    print(f"Built {len(result)} static files into {STATIC_BUILD_DIR}")
@@ -0,0 +1,69 @@
+"""
+Досжатие уже лежащих в базе сообщений (кодек — app/codec.py):
+    DB_URL=postgresql://... python -m app.services.compression --batch-size 5000
+"""
+import logging
+import argparse
+
+from sqlalchemy import bindparam, func, select, update
+
+from app.codec import MESSAGE_COMPRESS_THRESHOLD, encode_content
+from app.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+def compact_messages(conn, chat_ids: list = None, batch_size: int = 5000, commit: bool = False) -> int:
+    """
+    Досжимает длинные несжатые сообщения (всех или указанных чатов) пачками.
+    conn — Core Connection; с commit=True коммитит каждую пачку, иначе коммит на вызывающей стороне.
+    """
+    table = Message.__table__
+    stmt = (
+        select(table.c.id, table.c.content)
+        .where(table.c.content.isnot(None), func.length(table.c.content) * 4 >= MESSAGE_COMPRESS_THRESHOLD)
+        .order_by(table.c.id)
+        .limit(batch_size)
+    )
+    if chat_ids is not None:
+        if not chat_ids:
+            return 0
+        stmt = stmt.where(table.c.chat_id.in_(chat_ids))
+    update_stmt = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(content=bindparam("b_content"), content_compressed=bindparam("b_blob"))
+    )
+
+    total, last_id = 0, 0
+    while True:
+        rows = conn.execute(stmt.where(table.c.id > last_id)).all()
+        if not rows:
+            return total
+        last_id = rows[-1].id
+        params = []
+        for row in rows:
+            content, blob = encode_content(row.content)
+            if blob is not None:
+                params.append({"b_id": row.id, "b_content": content, "b_blob": blob})
+        if params:
+            conn.execute(update_stmt, params)
+            total += len(params)
+        if commit:
+            conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Досжатие длинных сообщений")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    from app.database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    with engine.connect() as conn:
+        print(f"Compressed {compact_messages(conn, batch_size=args.batch_size, commit=True)} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Экспорт всех чатов пользователя с постоянным расходом памяти.
+
+Чаты и сообщения читаются одним упорядоченным запросом через серверный курсор (yield_per),
+ответ отдаётся генератором: NDJSON (строка на чат/сообщение) или zip с Markdown-файлом на чат.
+Генераторы синхронные — StreamingResponse крутит их в тредпуле и не блокирует event loop.
+"""
+import re
+import json
+import zipfile
+import logging
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import Chat, Message
+from app.services import archive
+from app.codec import decode_content
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = ("ndjson", "zip")
+
+_UNSAFE_FILENAME_RE = re.compile(r"[^\w\- ]+", re.UNICODE)
+
+
+def _iso(value: datetime):
+    return value.isoformat() if value else None
+
+
+def iter_rows(user_id: str):
+    """
+    Поток (chat, message) в порядке чатов; для чата без сообщений message = None.
+    Своя сессия: запросная к моменту чтения тела ответа уже закрыта.
+    Сообщения архивных чатов читаются из S3 по одному чату за раз.
+    """
+    stmt = (
+        select(
+            Chat.id, Chat.title, Chat.model, Chat.is_pinned, Chat.created_at, Chat.updated_at, Chat.archive_key,
+            Message.id.label("message_id"), Message.role, Message._content.label("content"), Message.content_compressed,
+            Message.image_url, Message.attachment_url,
+        )
+        .outerjoin(Message, Message.chat_id == Chat.id)
+        .where(Chat.user_casdoor_id == user_id)
+        .order_by(Chat.id, Message.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    db = SessionLocal()
+    try:
+        for row in db.execute(stmt):
+            if row.archive_key and row.message_id is None:
+                for message in archive.load_messages(row.archive_key):
+                    yield ExportRow(row, message)
+            else:
+                yield ExportRow(row)
+    finally:
+        db.close()
+
+
+class ExportRow:
+    """Строка чат+сообщение; сообщение — из БД (с разжатием) или из архивного blob"""
+    __slots__ = ("id", "title", "model", "is_pinned", "created_at", "updated_at",
+                 "message_id", "role", "content", "image_url", "attachment_url")
+
+    def __init__(self, row, archived: dict = None):
+        self.id, self.title, self.model, self.is_pinned = row.id, row.title, row.model, row.is_pinned
+        self.created_at, self.updated_at = row.created_at, row.updated_at
+        if archived is not None:
+            self.message_id = archived["id"]
+            self.role, self.content = archived["role"], archived["content"]
+            self.image_url, self.attachment_url = archived.get("image_url"), archived.get("attachment_url")
+        else:
+            self.message_id, self.role = row.message_id, row.role
+            self.content = decode_content(row.content, row.content_compressed) if row.message_id is not None else None
+            self.image_url, self.attachment_url = row.image_url, row.attachment_url
+
+
+def _chat_dict(row) -> dict:
+    return {
+        "type": "chat",
+        "id": row.id,
+        "title": row.title,
+        "model": row.model,
+        "is_pinned": row.is_pinned,
+        "created_at": _iso(row.created_at),
+        "updated_at": _iso(row.updated_at),
+    }
+
+
+def _message_dict(row) -> dict:
+    return {
+        "type": "message",
+        "id": row.message_id,
+        "chat_id": row.id,
+        "role": row.role,
+        "content": row.content,
+        "image_url": row.image_url,
+        "attachment_url": row.attachment_url,
+    }
+
+
+# === NDJSON ===
+
+def ndjson_stream(user_id: str):
+    """Строка {"type": "chat"} перед сообщениями этого чата, затем строки {"type": "message"}"""
+    current_chat = None
+    for row in iter_rows(user_id):
+        if row.id != current_chat:
+            current_chat = row.id
+            yield json.dumps(_chat_dict(row), ensure_ascii=False) + "\n"
+        if row.message_id is not None:
+            yield json.dumps(_message_dict(row), ensure_ascii=False) + "\n"
+
+
+# === ZIP С MARKDOWN ===
+
+class _ChunkWriter:
+    """Несикаемый файл для zipfile: копит записанные байты, генератор забирает их через drain()"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def chat_filename(chat_id: int, title: str) -> str:
+    safe = _UNSAFE_FILENAME_RE.sub("", title or "").strip()[:60] or "chat"
+    return f"{chat_id:06d} {safe}.md"
+
+
+def _markdown_header(row) -> str:
+    lines = [f"# {row.title or 'Без названия'}", ""]
+    lines.append(f"- Модель: {row.model}")
+    lines.append(f"- Создан: {_iso(row.created_at)}")
+    lines.append(f"- Обновлён: {_iso(row.updated_at)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _markdown_message(row) -> str:
+    role = "Пользователь" if row.role == "user" else "Ассистент"
+    parts = [f"## {role}", "", row.content or ""]
+    if row.image_url:
+        parts.append(f"\n![image]({row.image_url})")
+    if row.attachment_url:
+        parts.append(f"\n[Вложение]({row.attachment_url})")
+    return "\n".join(parts) + "\n\n"
+
+
+def zip_stream(user_id: str):
+    """Zip без сиков: zipfile пишет data descriptor после каждого файла, архив уходит кусками"""
+    out = _ChunkWriter()
+    with zipfile.ZipFile(out, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        entry = None
+        current_chat = None
+        for row in iter_rows(user_id):
+            if row.id != current_chat:
+                if entry:
+                    entry.close()
+                current_chat = row.id
+                info = zipfile.ZipInfo(chat_filename(row.id, row.title), date_time=(row.created_at or datetime.utcnow()).timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                entry = zf.open(info, mode="w", force_zip64=True)
+                entry.write(_markdown_header(row).encode("utf-8"))
+            if row.message_id is not None:
+                entry.write(_markdown_message(row).encode("utf-8"))
+            data = out.drain()
+            if data:
+                yield data
+        if entry:
+            entry.close()
+    yield out.drain()
@@ -0,0 +1,115 @@
+"""
+Сжатие HTTP-ответов (brotli/gzip) по Accept-Encoding.
+
+Сжимаются только ответы, тело которых целиком пришло одним сообщением (JSONResponse,
+HTML-шаблоны): история чата, каталог моделей, страницы. Потоковые ответы — SSE с токенами,
+NDJSON/ZIP-экспорт, статусы медиа-задач — проходят как есть: заголовки text/event-stream
+уходят сразу, без ожидания первого куска, и ничего не буферизуется. Уже сжатое
+(предсжатая статика с Content-Encoding) и мелкое (< COMPRESSION_MIN_SIZE) не трогаем.
+
+Коэффициент сжатия — http_compression_bytes_total{encoding, stage="in"|"out"}.
+"""
+import os
+import gzip
+
+import anyio
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.services import metrics
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Уровни под динамические ответы: быстрые, с большей частью выигрыша максимальных
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+# Большие тела жмём в тредпуле, чтобы не задерживать соседние стримы воркера
+COMPRESSION_THREAD_SIZE = int(os.getenv("COMPRESSION_THREAD_SIZE", str(64 * 1024)))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "application/javascript", "text/css")
+STREAMING_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+def choose_encoding(accept_encoding: str):
+    """br, если клиент его принимает, иначе gzip; q=0 — явный отказ"""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name.lower())
+    for encoding in ("br", "gzip"):
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """ASGI-middleware: сжимает целиковые JSON/HTML-ответы, потоковые пропускает без буферизации"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                return await send(message)
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip()
+                if (content_type in STREAMING_TYPES or content_type not in COMPRESSIBLE_TYPES
+                        or "content-encoding" in headers):
+                    passthrough = True
+                    return await send(message)
+                # Ждём тело: по нему видно, целиковый это ответ или поток
+                start = message
+                return
+
+            if message["type"] != "http.response.body" or start is None:
+                return await send(message)
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < COMPRESSION_MIN_SIZE:
+                # Поток (StreamingResponse) или мелочь — отдаём как есть
+                passthrough = True
+                await send(start)
+                return await send(message)
+
+            if len(body) >= COMPRESSION_THREAD_SIZE:
+                compressed = await anyio.to_thread.run_sync(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            metrics.HTTP_COMPRESSION_BYTES.labels(encoding, "in").inc(len(body))
+            metrics.HTTP_COMPRESSION_BYTES.labels(encoding, "out").inc(len(compressed))
+
+            headers = MutableHeaders(raw=list(start["headers"]))
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            passthrough = True
+            await send({**start, "headers": headers.raw})
+            await send({**message, "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
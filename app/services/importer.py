@@ -0,0 +1,297 @@
+"""
+Импорт архивов переписки из ChatGPT (conversations.json / zip экспорта) и Claude.
+
+Файл разбирается потоково: верхний JSON-массив читается кусками и раскодируется по одному
+диалогу (JSONDecoder.raw_decode), поэтому в памяти одновременно только текущая пачка.
+Пачка пишется одной транзакцией: чаты — executemany с RETURNING id, сообщения — COPY на Postgres
+и executemany на остальных базах, затем пакетная индексация для поиска.
+
+CLI:
+    DB_URL=postgresql://... python -m app.services.importer --user email_123 conversations.json
+"""
+import io
+import json
+import logging
+import zipfile
+import argparse
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from app.database import engine
+from app.models import Chat, Message
+from app.services import search
+from app.codec import encode_content
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_CONVERSATIONS = 500
+IMPORT_CHUNK_MESSAGES = 20_000
+READ_SIZE = 1 << 16
+TITLE_MAX_LENGTH = 255
+
+DEFAULT_MODELS = {
+    "chatgpt": "openai/gpt-4o",
+    "claude": "anthropic/claude-sonnet-4.5",
+}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+# === ПОТОКОВЫЙ РАЗБОР JSON ===
+
+def iter_json_array(fp, read_size: int = READ_SIZE):
+    """Элементы JSON-массива верхнего уровня из текстового потока, по одному"""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill(size):
+        nonlocal buf, pos, eof
+        data = fp.read(size)
+        if not data:
+            eof = True
+        buf = buf[pos:] + data
+        pos = 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill(read_size)
+
+    skip(" \t\r\n\ufeff")
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ImportFormatError("Expected a JSON array of conversations")
+    pos += 1
+
+    while True:
+        skip(" \t\r\n,")
+        if pos >= len(buf):
+            raise ImportFormatError("Unexpected end of file")
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ImportFormatError("Malformed JSON")
+            # Элемент не влез в буфер: дочитываем столько же, сколько уже есть, — разбор амортизированно линейный
+            fill(max(read_size, len(buf) - pos))
+            continue
+        pos = end
+        yield item
+
+
+def open_archive(fp):
+    """Бинарный поток → текстовый поток с массивом диалогов (zip экспорта ChatGPT разворачивается)"""
+    head = fp.read(4)
+    fp.seek(0)
+    if head.startswith(b"PK"):
+        archive = zipfile.ZipFile(fp)
+        names = [n for n in archive.namelist() if n.rsplit("/", 1)[-1] == "conversations.json"]
+        if not names:
+            raise ImportFormatError("conversations.json not found in archive")
+        return io.TextIOWrapper(archive.open(names[0]), encoding="utf-8")
+    return io.TextIOWrapper(fp, encoding="utf-8")
+
+
+# === ФОРМАТЫ ===
+
+def _from_timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _chatgpt_text(message: dict) -> str:
+    content = message.get("content") or {}
+    if "parts" in content:
+        return "\n".join(p for p in content["parts"] if isinstance(p, str)).strip()
+    return (content.get("text") or "").strip()
+
+
+def parse_chatgpt(conv: dict) -> dict:
+    """Дерево mapping → активная ветка (от current_node к корню), только user/assistant"""
+    mapping = conv.get("mapping") or {}
+    node_id = conv.get("current_node")
+    branch = []
+    seen = set()
+    while node_id and node_id in mapping and node_id not in seen:
+        seen.add(node_id)
+        branch.append(mapping[node_id])
+        node_id = mapping[node_id].get("parent")
+    if not branch:
+        # Нет current_node — берём все узлы по времени
+        branch = sorted(mapping.values(), key=lambda n: ((n.get("message") or {}).get("create_time") or 0), reverse=True)
+
+    messages = []
+    for node in reversed(branch):
+        message = node.get("message") or {}
+        role = (message.get("author") or {}).get("role")
+        if role not in ("user", "assistant"):
+            continue
+        if (message.get("metadata") or {}).get("is_visually_hidden_from_conversation"):
+            continue
+        text = _chatgpt_text(message)
+        if text:
+            messages.append((role, text, _from_timestamp(message.get("create_time"))))
+
+    return {
+        "title": conv.get("title"),
+        "model": DEFAULT_MODELS["chatgpt"],
+        "created_at": _from_timestamp(conv.get("create_time")),
+        "updated_at": _from_timestamp(conv.get("update_time")),
+        "messages": messages,
+    }
+
+
+def _claude_text(message: dict) -> str:
+    blocks = message.get("content")
+    if isinstance(blocks, list):
+        text = "\n".join(b.get("text") or "" for b in blocks if isinstance(b, dict) and b.get("type") == "text")
+        if text.strip():
+            return text.strip()
+    return (message.get("text") or "").strip()
+
+
+def parse_claude(conv: dict) -> dict:
+    messages = []
+    for message in conv.get("chat_messages") or []:
+        role = {"human": "user", "assistant": "assistant"}.get(message.get("sender"))
+        text = _claude_text(message)
+        if role and text:
+            messages.append((role, text, _from_timestamp(message.get("created_at"))))
+    return {
+        "title": conv.get("name"),
+        "model": DEFAULT_MODELS["claude"],
+        "created_at": _from_timestamp(conv.get("created_at")),
+        "updated_at": _from_timestamp(conv.get("updated_at")),
+        "messages": messages,
+    }
+
+
+def parse_conversation(conv) -> dict:
+    if isinstance(conv, dict):
+        if "mapping" in conv:
+            return parse_chatgpt(conv)
+        if "chat_messages" in conv:
+            return parse_claude(conv)
+    return None
+
+
+# === ЗАПИСЬ ПАЧКАМИ ===
+
+COPY_COLUMNS = ("chat_id", "role", "content", "content_compressed", "created_at")
+
+
+def _copy_escape(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        # bytea в hex-формате; обратный слеш в текстовом COPY удваивается
+        return "\\\\x" + value.hex()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_messages(conn, rows: list):
+    """COPY для Postgres: на порядок быстрее executemany"""
+    buf = io.StringIO()
+    for r in rows:
+        buf.write("\t".join(_copy_escape(r[k]) for k in COPY_COLUMNS))
+        buf.write("\n")
+    buf.seek(0)
+    raw = conn.connection.dbapi_connection
+    with raw.cursor() as cursor:
+        cursor.copy_expert(f"COPY messages ({', '.join(COPY_COLUMNS)}) FROM STDIN", buf)
+
+
+def write_chunk(user_id: str, conversations: list) -> int:
+    """Одна транзакция на пачку: чаты → сообщения → поисковый индекс. Возвращает число сообщений."""
+    now = datetime.utcnow()
+    chat_rows = [{
+        "user_casdoor_id": user_id,
+        "title": (c["title"] or "Импортированный чат")[:TITLE_MAX_LENGTH],
+        "model": c["model"],
+        "is_pinned": False,
+        "created_at": c["created_at"] or now,
+        "updated_at": c["updated_at"] or c["created_at"] or now,
+    } for c in conversations]
+
+    with engine.begin() as conn:
+        chat_ids = conn.execute(
+            insert(Chat.__table__).returning(Chat.__table__.c.id, sort_by_parameter_order=True), chat_rows
+        ).scalars().all()
+        message_rows = []
+        for chat_id, c, chat_row in zip(chat_ids, conversations, chat_rows):
+            chat_created = chat_row["created_at"]
+            for role, text, created_at in c["messages"]:
+                content, compressed = encode_content(text)
+                message_rows.append({
+                    "chat_id": chat_id, "role": role, "content": content, "content_compressed": compressed,
+                    # Не раньше чата — на этом держится отсечение партиций (app/services/partitions.py)
+                    "created_at": max(created_at, chat_created) if created_at else chat_created,
+                })
+        if message_rows:
+            if conn.dialect.name == "postgresql":
+                _copy_messages(conn, message_rows)
+            else:
+                conn.execute(insert(Message.__table__), message_rows)
+        search.index_chats_bulk(conn, chat_ids)
+    return len(message_rows)
+
+
+def import_conversations(user_id: str, fp) -> dict:
+    """fp — бинарный поток с JSON-массивом или zip экспорта ChatGPT"""
+    stats = {"chats": 0, "messages": 0, "skipped": 0}
+    chunk, chunk_messages = [], 0
+
+    def flush():
+        nonlocal chunk, chunk_messages
+        if chunk:
+            stats["messages"] += write_chunk(user_id, chunk)
+            stats["chats"] += len(chunk)
+        chunk, chunk_messages = [], 0
+
+    for conv in iter_json_array(open_archive(fp)):
+        parsed = parse_conversation(conv)
+        if not parsed or not parsed["messages"]:
+            stats["skipped"] += 1
+            continue
+        chunk.append(parsed)
+        chunk_messages += len(parsed["messages"])
+        if len(chunk) >= IMPORT_CHUNK_CONVERSATIONS or chunk_messages >= IMPORT_CHUNK_MESSAGES:
+            flush()
+    flush()
+
+    logger.info(f"Import for {user_id}: {stats}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт архивов ChatGPT/Claude")
+    parser.add_argument("path", help="conversations.json или zip экспорта")
+    parser.add_argument("--user", required=True, help="casdoor_id владельца чатов")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.path, "rb") as fp:
+        print(import_conversations(args.user, fp))
+
+
+if __name__ == "__main__":
+    main()
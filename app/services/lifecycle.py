@@ -0,0 +1,66 @@
+"""
+Плавная остановка процесса (деплой, масштабирование).
+
+По SIGTERM процесс переходит в режим draining (/readyz отвечает 503 — это видит healthcheck
+compose, не Caddy) и сразу передаёт сигнал uvicorn. uvicorn закрывает listener: новые
+подключения к уходящему контейнеру отклоняются, и Caddy повторяет их на другом контейнере
+(lb_try_duration в Caddyfile). Открытые соединения uvicorn ждёт — активные SSE-стримы
+дописываются до конца (не дольше --timeout-graceful-shutdown), после чего оставшиеся задачи
+отменяются, а sse_wrapper сохраняет частичный ответ и списание.
+"""
+import signal
+import logging
+
+logger = logging.getLogger(__name__)
+
+HANDLED_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+_draining = False
+_active_streams = 0
+
+
+def is_draining() -> bool:
+    return _draining
+
+
+def active_streams() -> int:
+    return _active_streams
+
+
+def stream_started():
+    global _active_streams
+    _active_streams += 1
+
+
+def stream_finished():
+    global _active_streams
+    _active_streams -= 1
+
+
+def begin_drain():
+    global _draining
+    if not _draining:
+        _draining = True
+        logger.info(f"Draining: readiness is off, {_active_streams} active stream(s)")
+
+
+def install_signal_handlers():
+    """
+    Оборачивает обработчики сигналов uvicorn (они ставятся до lifespan startup):
+    сигнал включает draining и сразу передаётся uvicorn (повторный uvicorn обрабатывает сам).
+    Вне uvicorn (TestClient, скрипты) обработчиков нет — ничего не делаем.
+    """
+    for sig in HANDLED_SIGNALS:
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            begin_drain()
+            previous(signum, frame)
+
+        try:
+            signal.signal(sig, handler)
+        except ValueError:
+            # Не главный поток (TestClient) — сигналы не наши
+            return
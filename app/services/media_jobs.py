@@ -0,0 +1,373 @@
+"""
+Фоновые задачи генерации медиа через очередь fal.ai.
+
+Запрос не держит воркер: задача пишется в generation_jobs, отправляется в очередь fal
+(с учётом лимита одновременных задач на модель), статус обновляет поллер и/или вебхук fal,
+результат перекладывается в наш S3 и сохраняется сообщением ассистента в чат.
+"""
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import GenerationJob, Chat, Message, UserWallet
+from app.services.ai_generation import MODEL_PRICING
+from app.services.s3 import upload_url_to_s3
+from app.services import search, share_snapshots, usage
+
+logger = logging.getLogger(__name__)
+
+MEDIA_MODEL_PREFIX = "fal-ai/"
+MEDIA_POLL_INTERVAL = float(os.getenv("MEDIA_POLL_INTERVAL", "3"))
+# Задача, зависшая в submitting/finalizing дольше этого времени, возвращается поллеру
+MEDIA_STALE_TIMEOUT = timedelta(minutes=10)
+# Вебхук fal включается, только если задан секрет (он же защищает эндпоинт)
+MEDIA_WEBHOOK_SECRET = os.getenv("MEDIA_WEBHOOK_SECRET")
+SITE_URL = os.getenv("SITE_URL", "http://localhost:8081")
+
+# Лимиты одновременных задач: MEDIA_CONCURRENCY_LIMITS="fal-ai/kling-video/v1.5/pro=1,fal-ai/flux-realism=4"
+MEDIA_CONCURRENCY_DEFAULT = int(os.getenv("MEDIA_CONCURRENCY_DEFAULT", "2"))
+MEDIA_CONCURRENCY_LIMITS = {}
+for item in filter(None, os.getenv("MEDIA_CONCURRENCY_LIMITS", "").split(",")):
+    model_id, _, limit = item.partition("=")
+    MEDIA_CONCURRENCY_LIMITS[model_id.strip()] = int(limit)
+
+ACTIVE_STATUSES = ("submitting", "submitted", "running", "finalizing")
+FINAL_STATUSES = ("completed", "failed")
+
+# Будит поллер сразу после постановки задачи, не дожидаясь интервала
+_wakeup = asyncio.Event()
+_worker_loop = None
+
+
+def notify_worker():
+    """Потокобезопасно будит поллер (create_job зовут и из sync-обработчиков в threadpool)"""
+    if _worker_loop is not None:
+        _worker_loop.call_soon_threadsafe(_wakeup.set)
+
+
+def is_media_model(model_id: str) -> bool:
+    return bool(model_id) and model_id.startswith(MEDIA_MODEL_PREFIX)
+
+
+def concurrency_limit(model_id: str) -> int:
+    return MEDIA_CONCURRENCY_LIMITS.get(model_id, MEDIA_CONCURRENCY_DEFAULT)
+
+
+def job_to_dict(job: GenerationJob) -> dict:
+    return {
+        "id": job.id,
+        "chat_id": job.chat_id,
+        "model": job.model,
+        "status": job.status,
+        "progress": job.progress,
+        "result_url": job.result_url,
+        "result_kind": job.result_kind,
+        "error": job.error,
+        "cost": job.cost,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def build_arguments(job: GenerationJob) -> dict:
+    """Аргументы для fal: промпт + исходная картинка для image-to-video / img2img"""
+    arguments = {"prompt": job.prompt}
+    if job.attachment_url:
+        arguments["image_url"] = job.attachment_url
+    return arguments
+
+
+def extract_result(result: dict):
+    """Достаёт (url, kind) из ответа fal: images[] / image / video / audio_file"""
+    if not isinstance(result, dict):
+        return None, None
+    images = result.get("images")
+    if images:
+        return images[0].get("url"), "image"
+    for key, kind in (("image", "image"), ("video", "video"), ("audio_file", "audio"), ("audio", "audio")):
+        value = result.get(key)
+        if isinstance(value, dict) and value.get("url"):
+            return value["url"], kind
+    return None, None
+
+
+def render_content(url: str, kind: str, model_id: str) -> str:
+    name = model_id.split("/", 1)[-1]
+    if kind == "image":
+        return f"![Generated Image]({url})"
+    if kind == "video":
+        return f"[Видео ({name})]({url})"
+    return f"[Аудио ({name})]({url})"
+
+
+# === ПОСТАНОВКА ЗАДАЧИ ===
+
+def create_job(db: Session, user: UserWallet, model_id: str, prompt: str, chat_id: int = None, attachment_url: str = None) -> GenerationJob:
+    """Создаёт задачу в статусе queued. Стоимость фиксируется сразу, списание — по готовности."""
+    cost = MODEL_PRICING.get(model_id, {"output": 0})["output"]
+    if user.balance < cost:
+        raise ValueError("Недостаточно средств")
+
+    job = GenerationJob(
+        user_casdoor_id=user.casdoor_id,
+        chat_id=chat_id,
+        model=model_id,
+        prompt=prompt,
+        attachment_url=attachment_url,
+        status="queued",
+        cost=cost,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    notify_worker()
+    return job
+
+
+async def submit_job(db: Session, job: GenerationJob):
+    import fal_client  # ~0.1с импорта — только когда есть задачи
+    webhook_url = None
+    if MEDIA_WEBHOOK_SECRET:
+        webhook_url = f"{SITE_URL}/api/media/webhook?token={MEDIA_WEBHOOK_SECRET}"
+    try:
+        handle = await fal_client.submit_async(job.model, arguments=build_arguments(job), webhook_url=webhook_url)
+        job.fal_request_id = handle.request_id
+        job.status = "submitted"
+        logger.info(f"Media job {job.id} submitted to fal: {job.model} request={handle.request_id}")
+    except Exception as e:
+        logger.error(f"Media job {job.id} submit error: {e}")
+        job.status = "failed"
+        job.error = str(e)
+        job.finished_at = datetime.utcnow()
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+async def dispatch_queued(db: Session):
+    """Отправляет queued-задачи в fal, пока у модели есть свободные слоты"""
+    active = dict(
+        db.query(GenerationJob.model, func.count(GenerationJob.id))
+        .filter(GenerationJob.status.in_(ACTIVE_STATUSES))
+        .group_by(GenerationJob.model).all()
+    )
+    queued = db.query(GenerationJob).filter(GenerationJob.status == "queued").order_by(GenerationJob.id).all()
+    for job in queued:
+        if active.get(job.model, 0) >= concurrency_limit(job.model):
+            continue
+        # Несколько процессов поллят одну таблицу — слот занимает тот, чей UPDATE прошёл
+        if not claim_status(db, job.id, ("queued",), "submitting"):
+            continue
+        active[job.model] = active.get(job.model, 0) + 1
+        db.refresh(job)
+        await submit_job(db, job)
+
+
+# === ЗАВЕРШЕНИЕ ===
+
+def claim_status(db: Session, job_id: int, from_statuses: tuple, to_status: str) -> bool:
+    """Атомарный переход статуса: True, только если именно этот вызов его выполнил"""
+    result = db.execute(
+        update(GenerationJob)
+        .where(GenerationJob.id == job_id, GenerationJob.status.in_(from_statuses))
+        .values(status=to_status, updated_at=datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def claim_for_finalize(db: Session, job_id: int) -> bool:
+    """Поллер и вебхук не завершат задачу дважды"""
+    return claim_status(db, job_id, ("submitted", "running"), "finalizing")
+
+
+def fail_job(db: Session, job: GenerationJob, error: str):
+    job.status = "failed"
+    job.error = error
+    job.finished_at = job.updated_at = datetime.utcnow()
+    db.commit()
+    logger.error(f"Media job {job.id} failed: {error}")
+
+
+async def finalize_job(db: Session, job: GenerationJob, result: dict):
+    """Результат fal → S3 → сообщение в чат + списание. Вызывается только после claim_for_finalize."""
+    fal_url, kind = extract_result(result)
+    if not fal_url:
+        return fail_job(db, job, f"Unexpected fal result: {json.dumps(result)[:500]}")
+
+    # Ссылки fal временные — перекладываем в свой бакет
+    s3_url = await upload_url_to_s3(fal_url)
+    if not s3_url:
+        return fail_job(db, job, "S3 upload failed")
+
+    try:
+        if job.chat_id and db.query(Chat.id).filter(Chat.id == job.chat_id).first():
+            msg = Message(
+                chat_id=job.chat_id,
+                role="assistant",
+                content=render_content(s3_url, kind, job.model),
+                image_url=s3_url if kind == "image" else None,
+                attachment_url=s3_url if kind != "image" else None,
+            )
+            db.add(msg)
+            search.index_message(db, msg)
+
+        wallet = db.query(UserWallet).filter(UserWallet.casdoor_id == job.user_casdoor_id).with_for_update().first()
+        if wallet and job.cost:
+            wallet.balance = max(0, wallet.balance - job.cost)
+            logger.info(f"Balance updated: user={job.user_casdoor_id}, -{job.cost:.4f}₽, new={wallet.balance:.2f}₽")
+
+        job.status = "completed"
+        job.result_url = s3_url
+        job.result_kind = kind
+        job.finished_at = job.updated_at = datetime.utcnow()
+        # Учёт в той же транзакции, что и списание; время — от постановки задачи до готовности
+        duration_ms = int((job.finished_at - job.created_at).total_seconds() * 1000) if job.created_at else 0
+        usage.record(db, job.user_casdoor_id, job.chat_id, model_id=job.model, status="completed",
+                     cost=job.cost or 0.0, duration_ms=duration_ms)
+        shared = bool(job.chat_id) and share_snapshots.touch(db, job.chat_id)
+        db.commit()
+        logger.info(f"Media job {job.id} completed: {s3_url}")
+        if shared:
+            share_snapshots.schedule(job.chat_id)
+    except Exception as e:
+        db.rollback()
+        fail_job(db, job, f"Finalize error: {e}")
+
+
+async def poll_job(db: Session, job: GenerationJob):
+    import fal_client
+    try:
+        status = await fal_client.status_async(job.model, job.fal_request_id, with_logs=True)
+    except Exception as e:
+        logger.warning(f"Media job {job.id} status error: {e}")
+        return
+
+    if isinstance(status, fal_client.Completed):
+        if not claim_for_finalize(db, job.id):
+            return
+        db.refresh(job)
+        try:
+            result = await fal_client.result_async(job.model, job.fal_request_id)
+        except Exception as e:
+            return fail_job(db, job, f"fal error: {e}")
+        return await finalize_job(db, job, result)
+
+    values = {"updated_at": datetime.utcnow()}
+    if isinstance(status, fal_client.Queued):
+        values["progress"] = f"В очереди: {status.position}"
+    elif isinstance(status, fal_client.InProgress):
+        logs = [log.get("message", "") for log in (status.logs or []) if isinstance(log, dict)]
+        values["status"] = "running"
+        values["progress"] = logs[-1] if logs else "Генерация..."
+    # Условный UPDATE: вебхук мог уже завершить задачу, пока ждали ответ fal
+    db.execute(
+        update(GenerationJob)
+        .where(GenerationJob.id == job.id, GenerationJob.status.in_(("submitted", "running")))
+        .values(**values)
+    )
+    db.commit()
+
+
+async def handle_webhook(payload: dict):
+    """Вебхук fal: {"request_id", "status": "OK"|"ERROR", "payload", "error"}"""
+    request_id = payload.get("request_id")
+    db = SessionLocal()
+    try:
+        job = db.query(GenerationJob).filter(GenerationJob.fal_request_id == request_id).first()
+        if not job or job.status in FINAL_STATUSES:
+            return
+        if payload.get("status") != "OK":
+            if claim_for_finalize(db, job.id):
+                db.refresh(job)
+                fail_job(db, job, str(payload.get("error") or payload.get("payload_error") or "fal error"))
+            return
+        if claim_for_finalize(db, job.id):
+            db.refresh(job)
+            await finalize_job(db, job, payload.get("payload") or {})
+    finally:
+        db.close()
+
+
+# === ПОЛЛЕР ===
+
+async def poll_once():
+    db = SessionLocal()
+    try:
+        # Вернуть задачи, оборвавшиеся на переходном статусе (рестарт процесса и т.п.)
+        stale_before = datetime.utcnow() - MEDIA_STALE_TIMEOUT
+        for stuck, back_to in (("submitting", "queued"), ("finalizing", "running")):
+            db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.status == stuck, GenerationJob.updated_at < stale_before)
+                .values(status=back_to)
+            )
+        db.commit()
+
+        await dispatch_queued(db)
+
+        jobs = db.query(GenerationJob).filter(GenerationJob.status.in_(("submitted", "running"))).all()
+        for job in jobs:
+            await poll_job(db, job)
+    finally:
+        db.close()
+
+
+async def run_worker():
+    """Бесконечный цикл поллера; запускается из lifespan приложения"""
+    global _worker_loop
+    _worker_loop = asyncio.get_running_loop()
+    logger.info(f"Media worker started, poll interval {MEDIA_POLL_INTERVAL}s")
+    while True:
+        try:
+            await poll_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Media worker error: {e}", exc_info=True)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=MEDIA_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+# === ПРОГРЕСС ДЛЯ КЛИЕНТА (SSE) ===
+
+async def job_events(job_id: int, poll_interval: float = 1.0):
+    """
+    SSE-стрим статуса задачи. Держит только соединение (опрашивает БД), не воркер.
+    Формат совместим с чатом: готовый результат приходит фреймом {"content": ...}.
+    """
+    last = None
+    while True:
+        db = SessionLocal()
+        try:
+            job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+            snapshot = job_to_dict(job) if job else None
+        finally:
+            db.close()
+
+        if snapshot is None:
+            return
+
+        state = (snapshot["status"], snapshot["progress"])
+        if state != last:
+            last = state
+            yield f"data: {json.dumps({'job': snapshot}, ensure_ascii=False)}\n\n"
+
+        if snapshot["status"] == "completed":
+            content = render_content(snapshot["result_url"], snapshot["result_kind"] or "image", snapshot["model"])
+            yield f"data: {json.dumps({'content': content}, ensure_ascii=False)}\n\n"
+            return
+        if snapshot["status"] == "failed":
+            content = f"Ошибка генерации: {snapshot['error']}"
+            yield f"data: {json.dumps({'content': content}, ensure_ascii=False)}\n\n"
+            return
+
+        await asyncio.sleep(poll_interval)
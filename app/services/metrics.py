@@ -0,0 +1,140 @@
+"""
+Prometheus-метрики сервиса: HTTP-маршруты, стриминг ответов AI и пул соединений БД.
+
+При нескольких воркерах uvicorn задайте PROMETHEUS_MULTIPROC_DIR (пустой каталог на старте):
+метрики процессов пишутся в файлы и суммируются при скрейпе любого воркера.
+"""
+import os
+import time
+import logging
+
+from prometheus_client import (
+    Counter, Gauge, Histogram, REGISTRY, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Бакеты под стриминг: TTFT обычно 0.3–5с, полный ответ — до нескольких минут
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 13, 20, 30)
+STREAM_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 90, 120, 180, 300, 600)
+TPS_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+# === HTTP ===
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Время от получения запроса до отправки заголовков ответа",
+    ["method", "route", "status"],
+)
+
+HTTP_COMPRESSION_BYTES = Counter(
+    "http_compression_bytes_total",
+    "Байты тел ответов до (in) и после (out) сжатия — out/in даёт коэффициент сжатия",
+    ["encoding", "stage"],
+)
+
+# === СТРИМИНГ (то, что видит клиент, — sse_wrapper) ===
+STREAMS_ACTIVE = Gauge("ai_streams_active", "Активные SSE-стримы", ["model"], multiprocess_mode="livesum")
+STREAMS_TOTAL = Counter("ai_streams_total", "Завершённые SSE-стримы", ["model", "status"])
+STREAM_TTFT = Histogram("ai_stream_ttft_seconds", "Время до первого SSE-фрейма клиенту", ["model"], buckets=TTFT_BUCKETS)
+STREAM_DURATION = Histogram("ai_stream_duration_seconds", "Полная длительность SSE-стрима", ["model"], buckets=STREAM_BUCKETS)
+STREAM_TOKENS_PER_SECOND = Histogram("ai_stream_tokens_per_second", "Скорость генерации (≈токены/с)", ["model"], buckets=TPS_BUCKETS)
+STREAMS_DRAINED = Counter("ai_streams_drained_total", "Стримы, заставшие остановку процесса", ["outcome"])
+STREAMS_CANCELLED = Counter("ai_streams_cancelled_total", "Генерации, прерванные до конца ответа", ["reason"])
+
+# === UPSTREAM (OpenRouter — generate_ai_response_stream) ===
+UPSTREAM_TTFT = Histogram("ai_upstream_ttft_seconds", "Время до первого чанка от провайдера", ["model"], buckets=TTFT_BUCKETS)
+UPSTREAM_OUTPUT_TOKENS = Counter("ai_upstream_output_tokens_total", "Сгенерированные токены (≈ символы/4)", ["model"])
+UPSTREAM_PROMPT_TOKENS = Counter("ai_upstream_prompt_tokens_total", "Входные токены по usage провайдера", ["model", "cache"])
+UPSTREAM_ERRORS = Counter("ai_upstream_errors_total", "Ошибки запросов к провайдеру", ["model", "kind"])
+
+# === ПЛАТЕЖИ (inbox уведомлений YooKassa) ===
+PAYMENT_EVENTS = Counter("payment_events_total", "Уведомления YooKassa по исходу", ["event", "outcome"])
+
+# === РАСШАРЕННЫЕ ЧАТЫ (статические снимки в S3) ===
+SHARE_SNAPSHOTS = Counter("share_snapshots_total", "Публикации и удаления снимков расшаренных чатов", ["outcome"])
+SHARE_VIEWS = Counter("share_views_total", "Открытия /share/{token}: редирект на снимок или рендер приложением", ["served"])
+
+
+class DBPoolCollector:
+    """Снимает состояние пулов SQLAlchemy в момент скрейпа."""
+
+    def __init__(self):
+        self.engines = {}
+
+    def add_engine(self, name, engine):
+        self.engines[name] = engine
+
+    def collect(self):
+        size = GaugeMetricFamily("db_pool_size", "Размер пула соединений", labels=["engine"])
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Соединения, выданные сессиям", labels=["engine"])
+        checked_in = GaugeMetricFamily("db_pool_checked_in", "Свободные соединения в пуле", labels=["engine"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Соединения сверх pool_size", labels=["engine"])
+
+        for name, engine in self.engines.items():
+            pool = engine.pool
+            # NullPool / StaticPool не ведут счётчиков
+            if not hasattr(pool, "checkedout"):
+                continue
+            size.add_metric([name], pool.size())
+            checked_out.add_metric([name], pool.checkedout())
+            checked_in.add_metric([name], pool.checkedin())
+            overflow.add_metric([name], pool.overflow())
+
+        yield from (size, checked_out, checked_in, overflow)
+
+
+db_pool_collector = DBPoolCollector()
+REGISTRY.register(db_pool_collector)
+
+
+def render_latest():
+    """Тело ответа для /metrics и его Content-Type"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Пул БД — только у воркера, ответившего на скрейп
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(db_pool_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Убирает live-гейджи завершившегося воркера из общего каталога"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: гистограмма латентности по шаблону маршрута (/chats/{chat_id}, а не /chats/42).
+    Для стримов меряется время до заголовков — длительность самих стримов пишет sse_wrapper.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        observed = False
+
+        def observe(status):
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.labels(scope["method"], path, str(status)).observe(time.perf_counter() - start)
+
+        async def send_wrapper(message):
+            nonlocal observed
+            if message["type"] == "http.response.start" and not observed:
+                observed = True
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not observed:
+                observe(500)
@@ -0,0 +1,147 @@
+"""
+Партиционирование messages по времени (Postgres).
+
+Таблица messages в Postgres — RANGE по created_at с месячными партициями messages_pYYYYMM
+и DEFAULT-партицией (см. миграцию d9b3f6a2c871). Здесь:
+  - фильтры, по которым планировщик отсекает партиции в запросах одного чата
+    (сообщение не старше своего чата: messages.created_at >= chats.created_at);
+  - обслуживание: заранее создаёт партиции на MESSAGES_PARTITIONS_AHEAD месяцев вперёд
+    и удаляет опустевшие старые (после архивации холодных чатов в S3) — DROP вместо DELETE.
+
+На SQLite и непартиционированной таблице обслуживание ничего не делает, фильтры безвредны.
+Разовый прогон:
+    DB_URL=postgresql://... python -m app.services.partitions
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.models import Chat, Message
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_PARTITIONS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", "3"))
+# Пустые партиции старше этого числа месяцев удаляются (0 — не удалять)
+MESSAGES_DROP_EMPTY_AFTER_MONTHS = int(os.getenv("MESSAGES_DROP_EMPTY_AFTER_MONTHS", "2"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "86400"))
+
+PARTITION_PREFIX = "messages_p"
+# Произвольная константа для pg_advisory_xact_lock: обслуживание из нескольких воркеров не пересекается
+_ADVISORY_LOCK_ID = 350_035
+
+
+# === ЗАПРОСЫ С ОТСЕЧЕНИЕМ ПАРТИЦИЙ ===
+
+def chat_messages_filter(chat: Chat) -> list:
+    conditions = [Message.chat_id == chat.id]
+    if chat.created_at:
+        conditions.append(Message.created_at >= chat.created_at)
+    return conditions
+
+
+def chat_messages(db: Session, chat: Chat):
+    """Сообщения чата по порядку; вместо chat.messages, который сканирует все партиции"""
+    return db.query(Message).filter(*chat_messages_filter(chat)).order_by(Message.id)
+
+
+# === ОБСЛУЖИВАНИЕ ===
+
+def month_start(value: datetime, shift: int = 0) -> datetime:
+    index = value.year * 12 + value.month - 1 + shift
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PARTITION_PREFIX}{start:%Y%m}"
+
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'messages' AND c.relnamespace = current_schema()::regnamespace"
+    )).scalar())
+
+
+def create_partition(conn, start: datetime) -> bool:
+    name = partition_name(start)
+    exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+    if exists:
+        return False
+    end = month_start(start, 1)
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF messages "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+    logger.info(f"Created partition {name}")
+    return True
+
+
+def list_partitions(conn) -> list:
+    return conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'messages'::regclass AND c.relname LIKE :prefix ORDER BY c.relname"
+    ), {"prefix": PARTITION_PREFIX.replace("_", "\\_") + "%"}).scalars().all()
+
+
+def drop_empty_partitions(conn, now: datetime) -> list:
+    if MESSAGES_DROP_EMPTY_AFTER_MONTHS <= 0:
+        return []
+    oldest_kept = partition_name(month_start(now, -MESSAGES_DROP_EMPTY_AFTER_MONTHS))
+    dropped = []
+    for name in list_partitions(conn):
+        if name >= oldest_kept:
+            break
+        if conn.execute(text(f"SELECT 1 FROM {name} LIMIT 1")).first():
+            continue
+        # DETACH + DROP: данные не трогаются построчно, нет мёртвых кортежей и вакуума
+        conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        conn.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+        logger.info(f"Dropped empty partition {name}")
+    return dropped
+
+
+def maintain_partitions(now: datetime = None) -> dict:
+    now = now or datetime.utcnow()
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return {"partitioned": False}
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+        created = [partition_name(month_start(now, i)) for i in range(MESSAGES_PARTITIONS_AHEAD + 1)
+                   if create_partition(conn, month_start(now, i))]
+        dropped = drop_empty_partitions(conn, now)
+    return {"partitioned": True, "created": created, "dropped": dropped}
+
+
+async def run_partition_maintenance():
+    """Фоновый цикл из lifespan; на SQLite сразу завершается"""
+    if engine.dialect.name != "postgresql":
+        return
+    while True:
+        try:
+            result = await asyncio.to_thread(maintain_partitions)
+            if not result["partitioned"]:
+                return
+            if result["created"] or result["dropped"]:
+                logger.info(f"Partition maintenance: {result}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Partition maintenance error: {e}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    print(maintain_partitions())
+
+
+if __name__ == "__main__":
+    main()
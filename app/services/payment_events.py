@@ -0,0 +1,305 @@
+"""
+Входящие уведомления YooKassa (inbox).
+
+Вебхук только записывает событие в payment_events и сразу отвечает 200: ключ
+"<event>:<id платежа>" уникален, повторные доставки отбрасываются на INSERT ... ON CONFLICT
+DO NOTHING. Вебхук не аутентифицирован, поэтому события не из HANDLED_EVENTS не сохраняются
+вовсе, а payment.succeeded перед начислением подтверждается запросом платежа в API YooKassa
+(поддельное уведомление не зачислит pending-платёж). Неподтверждённое событие удаляется из
+inbox, чтобы его ключ не заблокировал настоящий вебхук и сверку; окончательно игнорируется
+только payment.succeeded для отменённого платежа. Применяет события воркер: строку события берёт с FOR UPDATE SKIP LOCKED,
+платёж и кошелёк — с FOR UPDATE, так что дубли и параллельные воркеры не начислят дважды,
+а списания за генерации не затрут пополнение. Синхронизация баланса с Casdoor — после
+коммита, вне транзакции и вне ответа YooKassa.
+
+Потерянные вебхуки догоняет сверка: платежи, висящие в pending дольше
+PAYMENT_RECONCILE_AFTER, сверяются со списком платежей YooKassa по статусу, и найденные
+попадают в тот же inbox (тот же event_key — вебхук и сверка не задвоят начисление).
+"""
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.database import SessionLocal
+from app.models import PaymentEvent, Payment, UserWallet
+from app.services import metrics, yookassa_api
+from app.services.casdoor import update_casdoor_balance
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_EVENTS_POLL_INTERVAL = float(os.getenv("PAYMENT_EVENTS_POLL_INTERVAL", "5"))
+PAYMENT_EVENTS_BATCH = int(os.getenv("PAYMENT_EVENTS_BATCH", "50"))
+# Уведомление может обогнать коммит платежа в create_payment — ждём несколько попыток
+PAYMENT_EVENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_EVENT_MAX_ATTEMPTS", "5"))
+
+# Сверка pending-платежей с YooKassa
+PAYMENT_RECONCILE_INTERVAL = float(os.getenv("PAYMENT_RECONCILE_INTERVAL", "300"))
+PAYMENT_RECONCILE_AFTER = timedelta(seconds=float(os.getenv("PAYMENT_RECONCILE_AFTER", "600")))
+# Старше — не сверяем: неоплаченные платежи YooKassa к этому времени давно отменены
+PAYMENT_RECONCILE_MAX_AGE = timedelta(days=float(os.getenv("PAYMENT_RECONCILE_MAX_AGE_DAYS", "3")))
+
+HANDLED_EVENTS = ("payment.succeeded", "payment.canceled")
+# Статус платежа в API -> событие, которое прислал бы вебхук
+RECONCILE_STATUSES = {"succeeded": "payment.succeeded", "canceled": "payment.canceled"}
+
+_wakeup = asyncio.Event()
+_worker_loop = None
+
+
+class PaymentEventError(ValueError):
+    """Некорректное уведомление (нет типа события или id платежа, неизвестный тип)"""
+
+
+def event_label(event_type: str) -> str:
+    """Метка для метрик: тип события приходит в неаутентифицированном вебхуке — набор ограничен"""
+    return event_type if event_type in HANDLED_EVENTS else "other"
+
+
+def notify_worker():
+    if _worker_loop is not None:
+        _worker_loop.call_soon_threadsafe(_wakeup.set)
+
+
+# === ЗАПИСЬ (вебхук) ===
+
+def _insert_ignore(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(PaymentEvent)
+    if dialect == "sqlite":
+        return sqlite.insert(PaymentEvent)
+    raise RuntimeError(f"Unsupported dialect for payment inbox: {dialect}")
+
+
+def record_event(db: Session, payload: dict) -> bool:
+    """Сохраняет уведомление; False — такое уже было (повторная доставка)"""
+    event_type = payload.get("event")
+    payment_id = (payload.get("object") or {}).get("id")
+    if not event_type or not payment_id:
+        raise PaymentEventError("Missing event type or payment id")
+    if event_type not in HANDLED_EVENTS:
+        metrics.PAYMENT_EVENTS.labels(event_label(event_type), "ignored").inc()
+        raise PaymentEventError(f"Unhandled event type: {str(event_type)[:64]}")
+
+    stmt = _insert_ignore(db).values(
+        event_key=f"{event_type}:{payment_id}",
+        event_type=event_type,
+        payment_id=payment_id,
+        payload=json.dumps(payload, ensure_ascii=False),
+    ).on_conflict_do_nothing(index_elements=["event_key"])
+    inserted = db.execute(stmt).rowcount
+    db.commit()
+
+    metrics.PAYMENT_EVENTS.labels(event_label(event_type), "received" if inserted else "duplicate").inc()
+    if inserted:
+        notify_worker()
+    return bool(inserted)
+
+
+# === ПРИМЕНЕНИЕ (воркер) ===
+
+def apply_event(db: Session, event: PaymentEvent, confirmed_status: str = None):
+    """
+    Меняет платёж/кошелёк по событию; возвращает (user_id, баланс) для Casdoor или None.
+    confirmed_status — статус платежа по API YooKassa (None — проверить не удалось).
+    """
+    event.attempts = (event.attempts or 0) + 1
+    if event.event_type not in HANDLED_EVENTS:
+        event.status = "ignored"
+        return None
+
+    payment = db.query(Payment).filter_by(yookassa_payment_id=event.payment_id).with_for_update().first()
+    if not payment:
+        event.error = "Payment not found"
+        if event.attempts >= PAYMENT_EVENT_MAX_ATTEMPTS:
+            event.status = "failed"
+        return None
+
+    sync = None
+    if event.event_type == "payment.succeeded" and payment.status != "succeeded":
+        if confirmed_status is None:
+            # API недоступен — попробуем ещё раз; после PAYMENT_EVENT_MAX_ATTEMPTS освобождаем ключ
+            event.error = "Payment status not confirmed by YooKassa API"
+            if event.attempts >= PAYMENT_EVENT_MAX_ATTEMPTS:
+                db.delete(event)
+            return None
+        if confirmed_status == "canceled":
+            # Платёж отменён — уведомление поддельное, денег не начисляем
+            event.status = "ignored"
+            event.error = f"YooKassa API reports status {confirmed_status}"
+            logger.warning(f"Unconfirmed payment.succeeded for {event.payment_id}: API status {confirmed_status}")
+            return None
+        if confirmed_status != "succeeded":
+            # Платёж ещё не завершён (или уведомление поддельное): удаляем строку, чтобы ключ
+            # "payment.succeeded:<id>" не заблокировал настоящий вебхук и сверку
+            logger.warning(f"Unconfirmed payment.succeeded for {event.payment_id}: API status {confirmed_status}, dropped")
+            db.delete(event)
+            return None
+        payment.status = "succeeded"
+        wallet = db.query(UserWallet).filter_by(casdoor_id=payment.user_id).with_for_update().first()
+        if wallet:
+            wallet.balance += payment.amount
+            sync = (payment.user_id, wallet.balance)
+            logger.info(f"Balance updated: user={payment.user_id}, +{payment.amount}₽")
+    elif event.event_type == "payment.canceled" and payment.status == "pending":
+        payment.status = "canceled"
+
+    event.status = "processed"
+    event.error = None
+    return sync
+
+
+def process_event(event_id: int, confirmed_status: str = None):
+    """Одно событие — одна транзакция; занятое другим воркером пропускается"""
+    db = SessionLocal()
+    try:
+        event = db.query(PaymentEvent).filter(
+            PaymentEvent.id == event_id, PaymentEvent.status == "pending"
+        ).with_for_update(skip_locked=True).first()
+        if not event:
+            return None
+        sync = apply_event(db, event, confirmed_status)
+        if event in db.deleted:
+            metrics.PAYMENT_EVENTS.labels(event_label(event.event_type), "unconfirmed").inc()
+        elif event.status != "pending":
+            event.processed_at = datetime.utcnow()
+            metrics.PAYMENT_EVENTS.labels(event_label(event.event_type), event.status).inc()
+        db.commit()
+        return sync
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Payment event {event_id} error: {e}", exc_info=True)
+        db.execute(
+            update(PaymentEvent).where(PaymentEvent.id == event_id).values(
+                attempts=PaymentEvent.attempts + 1,
+                error=str(e),
+            )
+        )
+        db.execute(
+            update(PaymentEvent).where(
+                PaymentEvent.id == event_id, PaymentEvent.attempts >= PAYMENT_EVENT_MAX_ATTEMPTS
+            ).values(status="failed", processed_at=datetime.utcnow())
+        )
+        db.commit()
+        return None
+    finally:
+        db.close()
+
+
+def pending_events() -> list:
+    db = SessionLocal()
+    try:
+        return db.query(PaymentEvent.id, PaymentEvent.event_type, PaymentEvent.payment_id)\
+            .filter(PaymentEvent.status == "pending")\
+            .order_by(PaymentEvent.id).limit(PAYMENT_EVENTS_BATCH).all()
+    finally:
+        db.close()
+
+
+async def confirmed_status(payment_id: str):
+    """Статус платежа по API YooKassa; None — проверить не удалось"""
+    if not yookassa_api.is_configured():
+        return None
+    try:
+        return (await yookassa_api.get_payment(payment_id)).get("status")
+    except Exception as e:
+        logger.warning(f"YooKassa status check for {payment_id} failed: {e}")
+        return None
+
+
+async def process_pending() -> int:
+    processed = 0
+    for event_id, event_type, payment_id in await asyncio.to_thread(pending_events):
+        # Начисление — только по статусу из API, не по телу уведомления
+        status = await confirmed_status(payment_id) if event_type == "payment.succeeded" else None
+        sync = await asyncio.to_thread(process_event, event_id, status)
+        processed += 1
+        if sync:
+            await update_casdoor_balance(*sync)
+    return processed
+
+
+async def run_worker():
+    """Цикл применения событий; запускается из lifespan приложения"""
+    global _worker_loop
+    _worker_loop = asyncio.get_running_loop()
+    logger.info(f"Payment events worker started, poll interval {PAYMENT_EVENTS_POLL_INTERVAL}s")
+    while True:
+        try:
+            await process_pending()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Payment events worker error: {e}", exc_info=True)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=PAYMENT_EVENTS_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+# === СВЕРКА (потерянные вебхуки) ===
+
+def stale_pending_payments(now: datetime) -> dict:
+    """{yookassa_payment_id: created_at} для платежей, по которым так и не пришло уведомление"""
+    db = SessionLocal()
+    try:
+        rows = db.query(Payment.yookassa_payment_id, Payment.created_at).filter(
+            Payment.status == "pending",
+            Payment.created_at <= now - PAYMENT_RECONCILE_AFTER,
+            Payment.created_at >= now - PAYMENT_RECONCILE_MAX_AGE,
+        ).all()
+        return {row.yookassa_payment_id: row.created_at for row in rows}
+    finally:
+        db.close()
+
+
+def record_reconciled(payload: dict) -> bool:
+    db = SessionLocal()
+    try:
+        return record_event(db, payload)
+    finally:
+        db.close()
+
+
+async def reconcile_pending(now: datetime = None) -> int:
+    """Находит в YooKassa итоговый статус зависших платежей; возвращает число новых событий"""
+    if not yookassa_api.is_configured():
+        return 0
+    now = now or datetime.utcnow()
+    pending = await asyncio.to_thread(stale_pending_payments, now)
+    if not pending:
+        return 0
+    # Платёж в YooKassa создаётся раньше нашей строки — берём окно с запасом
+    since = min(pending.values()) - timedelta(hours=1)
+
+    recorded = 0
+    for status, event_type in RECONCILE_STATUSES.items():
+        async for obj in yookassa_api.list_payments(status, since):
+            if obj.get("id") not in pending:
+                continue
+            if await asyncio.to_thread(record_reconciled, {"event": event_type, "object": obj}):
+                recorded += 1
+                logger.warning(f"Reconciled lost webhook: {event_type} {obj['id']}")
+    return recorded
+
+
+async def run_reconciler():
+    """Периодическая сверка; запускается из lifespan приложения"""
+    if not yookassa_api.is_configured():
+        logger.info("Payment reconciler disabled: YooKassa is not configured")
+        return
+    while True:
+        try:
+            await reconcile_pending()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Payment reconciler error: {e}", exc_info=True)
+        await asyncio.sleep(PAYMENT_RECONCILE_INTERVAL)
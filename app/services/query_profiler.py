@@ -0,0 +1,160 @@
+"""
+Профилировщик SQL-запросов: число запросов, время в БД и повторяющиеся запросы (N+1) на каждый HTTP-запрос.
+
+Включается переменной SQL_PROFILE=1 (отладка). В тестах — через query_budget():
+
+    with query_budget(5):
+        client.get("/chats/")
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SQL_PROFILE = os.getenv("SQL_PROFILE", "0") == "1"
+# Сколько раз одинаковый запрос должен повториться, чтобы считаться N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "3"))
+# Бюджет запросов на HTTP-запрос (0 — без ограничения), в режиме профилирования только предупреждение
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", "0"))
+
+_IN_LIST_RE = re.compile(r"\bIN\s*\((?:[^()]*)\)", re.IGNORECASE)
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    """Схлопывает пробелы и IN-списки, чтобы одинаковые по форме запросы совпадали"""
+    statement = _IN_LIST_RE.sub("IN (...)", statement)
+    return _SPACES_RE.sub(" ", statement).strip()
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, elapsed: float):
+        with self._lock:
+            self.count += 1
+            self.total_time += elapsed
+            self.statements[normalize_statement(statement)] += 1
+
+    def repeated(self, threshold: int = None):
+        """Запросы, выполненные не меньше threshold раз — кандидаты на N+1"""
+        threshold = threshold or N_PLUS_ONE_THRESHOLD
+        return [(stmt, n) for stmt, n in self.statements.most_common() if n >= threshold]
+
+    def summary(self) -> str:
+        return f"{self.count} queries, {self.total_time * 1000:.1f}ms"
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Маршрут выполнил больше запросов, чем разрешено бюджетом"""
+
+
+# Статистика текущего HTTP-запроса (ставит middleware)
+_request_stats: ContextVar = ContextVar("sql_request_stats", default=None)
+# Глобальные сборщики (query_budget/profile_queries) — видят запросы из любых потоков,
+# в т.ч. из потока TestClient
+_global_collectors = []
+_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    for collector in list(_global_collectors):
+        collector.record(statement, elapsed)
+
+
+def install():
+    """Подписывается на события всех движков SQLAlchemy (однократно)"""
+    global _installed
+    if _installed:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    _installed = True
+
+
+@contextmanager
+def profile_queries():
+    """Собирает статистику всех запросов внутри блока"""
+    install()
+    stats = QueryStats()
+    _global_collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        _global_collectors.remove(stats)
+
+
+@contextmanager
+def query_budget(max_queries: int):
+    """Падает с QueryBudgetExceeded, если внутри блока выполнено больше max_queries запросов"""
+    with profile_queries() as stats:
+        yield stats
+    if stats.count > max_queries:
+        details = "; ".join(f"{n}x {stmt[:120]}" for stmt, n in stats.statements.most_common(5))
+        raise QueryBudgetExceeded(f"Query budget exceeded: {stats.count} > {max_queries} ({details})")
+
+
+class QueryProfilerMiddleware:
+    """
+    ASGI-middleware: считает запросы в рамках HTTP-запроса, отдаёт X-DB-Query-Count / X-DB-Query-Time-Ms
+    и пишет в лог повторяющиеся запросы. Запросы после отправки заголовков (сохранение ответа в стриме)
+    в заголовки не попадают, но учитываются в логе.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        install()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-query-count", str(stats.count).encode()))
+                headers.append((b"x-db-query-time-ms", f"{stats.total_time * 1000:.1f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            self._report(scope, stats)
+
+    def _report(self, scope, stats: QueryStats):
+        path = f"{scope['method']} {scope['path']}"
+        logger.info(f"SQL profile {path}: {stats.summary()}")
+        for stmt, n in stats.repeated():
+            logger.warning(f"SQL profile {path}: possible N+1, {n}x {stmt[:200]}")
+        if SQL_QUERY_BUDGET and stats.count > SQL_QUERY_BUDGET:
+            logger.warning(f"SQL profile {path}: query budget exceeded ({stats.count} > {SQL_QUERY_BUDGET})")
@@ -0,0 +1,55 @@
+"""
+Реестр внешних клиентов: OpenRouter, S3, YooKassa.
+
+Тяжёлые SDK (openai, boto3, yookassa) импортируются, а клиенты создаются при первом
+обращении, а не при импорте app.main: воркер uvicorn поднимается быстрее, а скрипты и
+бенчмарки не платят за клиенты, которыми не пользуются. Сервисы регистрируют фабрики
+у себя в модуле, lifespan на остановке закрывает всё созданное (services.aclose()).
+"""
+import inspect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+    def __init__(self):
+        self._factories = {}
+        self._clients = {}
+        # Клиенты запрашиваются и из потоков (asyncio.to_thread, sync-хендлеры)
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory):
+        """factory() -> клиент или None (сервис не настроен); вызывается один раз"""
+        self._factories[name] = factory
+
+    def get(self, name: str):
+        if name in self._clients:
+            return self._clients[name]
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = self._factories[name]()
+                logger.debug(f"Service client created: {name}")
+            return self._clients[name]
+
+    def created(self) -> list:
+        return [name for name, client in self._clients.items() if client is not None]
+
+    async def aclose(self):
+        """Закрывает созданные клиенты; следующий get() создаст их заново"""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            close = getattr(client, "close", None)
+            if not callable(close):
+                continue
+            try:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning(f"Failed to close {name} client: {e}")
+
+
+services = ServiceRegistry()
@@ -0,0 +1,146 @@
+"""
+Чтение с реплик Postgres (DB_REPLICA_URLS).
+
+Обработчики только для чтения берут сессию через get_read_db: её SELECT уходят на реплику,
+всё остальное — в primary (RoutingSession в app/database.py). Реплика выбирается из тех,
+чьё отставание не больше DB_REPLICA_MAX_LAG секунд; отставание проверяется не чаще раза
+в DB_REPLICA_LAG_CHECK_INTERVAL на воркер. Нет здоровых реплик — читаем из primary.
+
+Read-your-writes: после запроса, который что-то закоммитил в primary, ReadYourWritesMiddleware
+ставит куку db_primary_until — пока она не истекла, чтения этого клиента идут в primary
+и он видит свои изменения, даже если реплика ещё не догнала.
+"""
+import os
+import time
+import logging
+import itertools
+import threading
+from contextvars import ContextVar
+
+from fastapi import Request
+from sqlalchemy import event, text
+
+from app.database import SessionLocal, engine, replica_engines
+
+logger = logging.getLogger(__name__)
+
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "2"))
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", "5"))
+# Дольше допустимого отставания — к концу окна реплика гарантированно догнала запись
+DB_STICKY_SECONDS = int(os.getenv("DB_STICKY_SECONDS", "10"))
+STICKY_COOKIE = "db_primary_until"
+
+# Отставание 0, если всё полученное уже применено (иначе простаивающий primary выглядел бы как лаг)
+_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+_round_robin = itertools.count()
+_lag_lock = threading.Lock()
+# engine -> (время проверки, отставание в секундах или None, если реплика недоступна)
+_lag_cache = {}
+
+
+def enabled() -> bool:
+    return bool(replica_engines)
+
+
+# === ОТСТАВАНИЕ ===
+
+def measure_lag(replica) -> float:
+    with replica.connect() as conn:
+        return float(conn.execute(_LAG_SQL).scalar() or 0)
+
+
+def replica_lag(replica):
+    """Отставание из кэша; None — реплика недоступна"""
+    now = time.monotonic()
+    checked_at, lag = _lag_cache.get(replica, (None, None))
+    if checked_at is not None and now - checked_at < DB_REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+    with _lag_lock:
+        checked_at, lag = _lag_cache.get(replica, (None, None))
+        if checked_at is None or now - checked_at >= DB_REPLICA_LAG_CHECK_INTERVAL:
+            try:
+                lag = measure_lag(replica)
+            except Exception as e:
+                logger.warning(f"Replica {replica.url.host} is unavailable: {e}")
+                lag = None
+            _lag_cache[replica] = (now, lag)
+        return lag
+
+
+def healthy_replicas() -> list:
+    return [r for r in replica_engines if (lag := replica_lag(r)) is not None and lag <= DB_REPLICA_MAX_LAG]
+
+
+def pick_replica(request: Request = None):
+    """Engine реплики для чтения или None (читать из primary)"""
+    if not replica_engines:
+        return None
+    if request is not None and is_sticky(request):
+        return None
+    candidates = healthy_replicas()
+    if not candidates:
+        return None
+    return candidates[next(_round_robin) % len(candidates)]
+
+
+# === СЕССИИ ===
+
+def get_read_db(request: Request):
+    """Как get_db, но SELECT идут на реплику (если она есть и не отстаёт)"""
+    db = SessionLocal()
+    db.info["replica"] = pick_replica(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# === READ-YOUR-WRITES ===
+
+def is_sticky(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+# Флаг «запрос что-то закоммитил в primary». Держим изменяемый dict: sync-обработчики
+# выполняются в тредпуле с копией контекста, и set() из них до middleware не дойдёт
+_request_writes: ContextVar = ContextVar("request_writes", default=None)
+
+
+@event.listens_for(engine, "commit")
+def _mark_write(conn):
+    writes = _request_writes.get()
+    if writes is not None:
+        writes["primary"] = True
+
+
+class ReadYourWritesMiddleware:
+    """ASGI-middleware: после записи в primary выставляет куку, прижимающую чтения к primary"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        writes = {}
+        token = _request_writes.set(writes)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and writes:
+                cookie = (f"{STICKY_COOKIE}={int(time.time()) + DB_STICKY_SECONDS}; "
+                          f"Max-Age={DB_STICKY_SECONDS}; Path=/; HttpOnly; SameSite=Lax")
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_writes.reset(token)
@@ -1,9 +1,10 @@
-import boto3
 import os
 import uuid
 import httpx
 import logging
 
+from app.services.registry import services
+
 logger = logging.getLogger(__name__)
 
 ACCESS_KEY = os.getenv("S3_ACCESS_KEY")
@@ -14,8 +15,13 @@ REGION_NAME = os.getenv("S3_REGION_NAME", "ru-1")
 # Читаем публичный домен из настроек
 S3_PUBLIC_DOMAIN = os.getenv("S3_PUBLIC_DOMAIN")
 
-def get_s3_client():
-    if not ACCESS_KEY or not SECRET_KEY: return None
+def is_configured() -> bool:
+    return bool(ACCESS_KEY and SECRET_KEY)
+
+def create_s3_client():
+    if not is_configured(): return None
+    # boto3 тяжёлый — импортируется при первой загрузке, не при старте приложения
+    import boto3
     return boto3.client(
         's3', 
         aws_access_key_id=ACCESS_KEY, 
@@ -24,6 +30,21 @@ def get_s3_client():
         region_name=REGION_NAME
     )
 
+services.register("s3", create_s3_client)
+
+def get_s3_client():
+    """Один клиент на процесс (boto3-клиенты потокобезопасны)"""
+    return services.get("s3")
+
+def public_url(key: str) -> str:
+    # === ГЛАВНОЕ ИСПРАВЛЕНИЕ ===
+    # Если есть публичный домен, используем его для ссылки
+    if S3_PUBLIC_DOMAIN:
+        clean_domain = S3_PUBLIC_DOMAIN.rstrip('/')
+        return f"{clean_domain}/{key}"
+    # Иначе старый вариант (который у тебя ломался)
+    return f"{ENDPOINT_URL}/{BUCKET_NAME}/{key}"
+
 async def upload_file_to_s3(file_bytes, filename: str, content_type: str) -> str:
     s3 = get_s3_client()
     if not s3: return None
@@ -50,14 +71,7 @@ async def upload_file_to_s3(file_bytes, filename: str, content_type: str) -> str
             **extra_args
         )
         
-        # === ГЛАВНОЕ ИСПРАВЛЕНИЕ ===
-        # Если есть публичный домен, используем его для ссылки
-        if S3_PUBLIC_DOMAIN:
-            clean_domain = S3_PUBLIC_DOMAIN.rstrip('/')
-            return f"{clean_domain}/{unique_filename}"
-        else:
-            # Иначе старый вариант (который у тебя ломался)
-            return f"{ENDPOINT_URL}/{BUCKET_NAME}/{unique_filename}"
+        return public_url(unique_filename)
 
     except Exception as e:
         logger.error(f"S3 Upload Error: {e}")
@@ -85,4 +99,66 @@ async def upload_url_to_s3(url: str) -> str:
         return await upload_file_to_s3(file_bytes, filename, ctype or "application/octet-stream")
     except Exception as e:
         logger.error(f"URL Upload Error: {e}")
-        return None
\ No newline at end of file
+        return None
+
+# === ПРИВАТНЫЕ ОБЪЕКТЫ (архив чатов и т.п.) ===
+# Синхронные: вызываются из фоновых задач/тредпула.
+# Только отдельный бакет: основной раздаётся через S3_PUBLIC_DOMAIN, и переписка
+# пользователей в нём стала бы публичной. Без S3_PRIVATE_BUCKET_NAME запись отключена.
+PRIVATE_BUCKET_NAME = os.getenv("S3_PRIVATE_BUCKET_NAME")
+
+def is_private_configured() -> bool:
+    return is_configured() and bool(PRIVATE_BUCKET_NAME) and PRIVATE_BUCKET_NAME != BUCKET_NAME
+
+def put_object_bytes(key: str, data: bytes, content_type: str = "application/octet-stream") -> bool:
+    if not is_private_configured():
+        logger.error(f"S3 Put refused ({key}): S3_PRIVATE_BUCKET_NAME is not set or equals the public bucket")
+        return False
+    s3 = get_s3_client()
+    if not s3: return False
+    try:
+        s3.put_object(Bucket=PRIVATE_BUCKET_NAME, Key=key, Body=data, ContentType=content_type)
+        return True
+    except Exception as e:
+        logger.error(f"S3 Put Error ({key}): {e}")
+        return False
+
+def get_object_bytes(key: str) -> bytes:
+    s3 = get_s3_client()
+    if not s3:
+        raise RuntimeError("S3 is not configured")
+    return s3.get_object(Bucket=PRIVATE_BUCKET_NAME, Key=key)["Body"].read()
+
+def delete_object(key: str) -> bool:
+    s3 = get_s3_client()
+    if not s3: return False
+    try:
+        s3.delete_object(Bucket=PRIVATE_BUCKET_NAME, Key=key)
+        return True
+    except Exception as e:
+        logger.error(f"S3 Delete Error ({key}): {e}")
+        return False
+
+# === ПУБЛИЧНЫЕ ОБЪЕКТЫ ПОД ФИКСИРОВАННЫМ КЛЮЧОМ (снимки расшаренных чатов) ===
+# Синхронные, как и приватные: перезаписываются на месте, ссылка на объект не меняется
+
+def put_public_object(key: str, data: bytes, content_type: str, cache_control: str = None) -> bool:
+    s3 = get_s3_client()
+    if not s3: return False
+    extra_args = {'CacheControl': cache_control} if cache_control else {}
+    try:
+        s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=data, ContentType=content_type, **extra_args)
+        return True
+    except Exception as e:
+        logger.error(f"S3 Public Put Error ({key}): {e}")
+        return False
+
+def delete_public_object(key: str) -> bool:
+    s3 = get_s3_client()
+    if not s3: return False
+    try:
+        s3.delete_object(Bucket=BUCKET_NAME, Key=key)
+        return True
+    except Exception as e:
+        logger.error(f"S3 Public Delete Error ({key}): {e}")
+        return False
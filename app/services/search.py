@@ -0,0 +1,194 @@
+"""
+Полнотекстовый поиск по чатам и сообщениям пользователя.
+
+Postgres: колонки tsvector (chats.search_vector, messages.search_vector) + GIN-индексы,
+заполняются при вставке через index_chat / index_message.
+SQLite (тесты, локальная разработка): FTS5-таблицы chats_fts / messages_fts с rowid = id строки
+(создаются вместе с таблицами — слушатели after_create в app/models.py).
+"""
+import os
+import re
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from app.models import Chat, Message
+from app.codec import decode_content
+
+SEARCH_TS_CONFIG = os.getenv("SEARCH_TS_CONFIG", "russian")
+MAX_PAGE_SIZE = 100
+# Совпадение в названии чата весит больше совпадения в сообщении
+TITLE_WEIGHT = 2.0
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def fts5_query(q: str) -> str:
+    """Пользовательский ввод → безопасный запрос FTS5: все слова (AND), префиксный поиск по последнему"""
+    words = _WORD_RE.findall(q)
+    if not words:
+        return ""
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+# === ИНДЕКСАЦИЯ ===
+
+def index_message(db: Session, message: Message):
+    """Вызывать после db.add(message) и до commit — индекс пишется в той же транзакции"""
+    dialect = _dialect(db)
+    if dialect == "postgresql":
+        message.search_vector = func.to_tsvector(SEARCH_TS_CONFIG, message.content or "")
+    elif dialect == "sqlite":
+        db.flush([message])
+        _fts_replace(db, "messages_fts", "content", message.id, message.content)
+
+
+def index_chat(db: Session, chat: Chat):
+    """Вызывать при создании и переименовании чата"""
+    dialect = _dialect(db)
+    if dialect == "postgresql":
+        chat.search_vector = func.to_tsvector(SEARCH_TS_CONFIG, chat.title or "")
+    elif dialect == "sqlite":
+        db.flush([chat])
+        _fts_replace(db, "chats_fts", "title", chat.id, chat.title)
+
+
+def _fts_replace(db: Session, table: str, column: str, rowid: int, value: str):
+    # SQLite может переиспользовать id удалённых строк — старую запись индекса убираем
+    db.execute(text(f"DELETE FROM {table} WHERE rowid = :id"), {"id": rowid})
+    db.execute(text(f"INSERT INTO {table} (rowid, {column}) VALUES (:id, :value)"), {"id": rowid, "value": value or ""})
+
+
+# === ПОИСК ===
+
+_PG_SEARCH = text(f"""
+    WITH q AS (SELECT websearch_to_tsquery(:cfg, :q) AS query),
+    hits AS (
+        SELECT c.id AS chat_id, NULL::integer AS message_id, c.title AS title, c.title AS body,
+               ts_rank(c.search_vector, q.query) * {TITLE_WEIGHT} AS rank, c.updated_at AS updated_at
+        FROM chats c, q
+        WHERE c.user_casdoor_id = :user_id AND c.search_vector @@ q.query
+        UNION ALL
+        SELECT m.chat_id, m.id, c.title, m.content,
+               ts_rank(m.search_vector, q.query), c.updated_at
+        FROM messages m JOIN chats c ON c.id = m.chat_id, q
+        WHERE c.user_casdoor_id = :user_id AND m.search_vector @@ q.query
+    ),
+    page AS (
+        SELECT * FROM hits ORDER BY rank DESC, updated_at DESC, message_id DESC NULLS FIRST
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT chat_id, message_id, title, rank, updated_at,
+           ts_headline(:cfg, body, q.query, 'StartSel=**, StopSel=**, MaxWords=30, MinWords=10, MaxFragments=1') AS snippet
+    FROM page, q
+    ORDER BY rank DESC, updated_at DESC, message_id DESC NULLS FIRST
+""")
+
+# bm25() в FTS5 отрицательный: чем меньше, тем релевантнее
+_SQLITE_SEARCH = text(f"""
+    SELECT * FROM (
+        SELECT c.id AS chat_id, NULL AS message_id, c.title AS title,
+               bm25(chats_fts) * {TITLE_WEIGHT} AS rank, c.updated_at AS updated_at,
+               snippet(chats_fts, 0, '**', '**', '…', 16) AS snippet
+        FROM chats_fts JOIN chats c ON c.id = chats_fts.rowid
+        WHERE chats_fts MATCH :q AND c.user_casdoor_id = :user_id
+        UNION ALL
+        SELECT m.chat_id, m.id, c.title,
+               bm25(messages_fts), c.updated_at,
+               snippet(messages_fts, 0, '**', '**', '…', 16)
+        FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid JOIN chats c ON c.id = m.chat_id
+        WHERE messages_fts MATCH :q AND c.user_casdoor_id = :user_id
+    )
+    ORDER BY rank ASC, updated_at DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+
+_PG_HEADLINE = text(
+    "SELECT ts_headline(CAST(:cfg AS regconfig), :body, websearch_to_tsquery(CAST(:cfg AS regconfig), :q), "
+    "'StartSel=**, StopSel=**, MaxWords=30, MinWords=10, MaxFragments=1')"
+)
+
+
+def _pg_compressed_headlines(db: Session, q: str, rows: list) -> list:
+    """Сжатые сообщения в SQL видны как NULL — сниппет для них строим по разжатому тексту (не больше страницы)"""
+    missing = [r["message_id"] for r in rows if r["message_id"] is not None and r["snippet"] is None]
+    if not missing:
+        return rows
+    blobs = dict(db.execute(
+        select(Message.id, Message.content_compressed).where(Message.id.in_(missing))
+    ).all())
+    for r in rows:
+        blob = blobs.get(r["message_id"])
+        if blob is not None:
+            r["snippet"] = db.execute(_PG_HEADLINE, {"cfg": SEARCH_TS_CONFIG, "q": q,
+                                                     "body": decode_content(None, blob)}).scalar()
+    return rows
+
+
+def search(db: Session, user_id: str, q: str, limit: int = 20, offset: int = 0) -> list:
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    dialect = _dialect(db)
+
+    if dialect == "postgresql":
+        rows = db.execute(_PG_SEARCH, {"cfg": SEARCH_TS_CONFIG, "q": q, "user_id": user_id,
+                                       "limit": limit, "offset": offset}).mappings().all()
+        rows = _pg_compressed_headlines(db, q, [dict(r) for r in rows])
+    elif dialect == "sqlite":
+        match = fts5_query(q)
+        if not match:
+            return []
+        rows = db.execute(_SQLITE_SEARCH, {"q": match, "user_id": user_id,
+                                           "limit": limit, "offset": offset}).mappings().all()
+    else:
+        raise RuntimeError(f"Unsupported dialect for full-text search: {dialect}")
+
+    return [{
+        "chat_id": r["chat_id"],
+        "message_id": r["message_id"],
+        "title": r["title"],
+        "snippet": r["snippet"],
+        "rank": abs(float(r["rank"])),
+    } for r in rows]
+
+
+def index_chats_bulk(conn, chat_ids: list):
+    """
+    Пакетная индексация уже вставленных чатов и всех их сообщений (импорт, разархивация).
+    conn — Core Connection в открытой транзакции. Несжатые тела индексируются SQL-ем целиком,
+    сжатые — разжимаются здесь и передаются параметром.
+    """
+    if not chat_ids:
+        return
+    dialect = conn.dialect.name
+    ids = [int(i) for i in chat_ids]
+    compressed = conn.execute(
+        select(Message.id, Message.content_compressed)
+        .where(Message.chat_id.in_(ids), Message.content_compressed.isnot(None))
+    ).all()
+    compressed = [{"id": row.id, "body": decode_content(None, row.content_compressed)} for row in compressed]
+
+    if dialect == "postgresql":
+        params = {"cfg": SEARCH_TS_CONFIG, "ids": ids}
+        conn.execute(text("UPDATE chats SET search_vector = to_tsvector(CAST(:cfg AS regconfig), coalesce(title, '')) "
+                          "WHERE id = ANY(:ids)"), params)
+        conn.execute(text("UPDATE messages SET search_vector = to_tsvector(CAST(:cfg AS regconfig), content) "
+                          "WHERE chat_id = ANY(:ids) AND content IS NOT NULL"), params)
+        if compressed:
+            conn.execute(text("UPDATE messages SET search_vector = to_tsvector(CAST(:cfg AS regconfig), :body) WHERE id = :id"),
+                         [{"cfg": SEARCH_TS_CONFIG, **row} for row in compressed])
+    elif dialect == "sqlite":
+        id_list = ",".join(str(i) for i in ids)
+        conn.execute(text(f"DELETE FROM chats_fts WHERE rowid IN ({id_list})"))
+        conn.execute(text(f"INSERT INTO chats_fts (rowid, title) SELECT id, coalesce(title, '') FROM chats WHERE id IN ({id_list})"))
+        conn.execute(text(f"DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM messages WHERE chat_id IN ({id_list}))"))
+        conn.execute(text(f"INSERT INTO messages_fts (rowid, content) SELECT id, content FROM messages "
+                          f"WHERE chat_id IN ({id_list}) AND content IS NOT NULL"))
+        if compressed:
+            conn.execute(text("INSERT INTO messages_fts (rowid, content) VALUES (:id, :body)"), compressed)
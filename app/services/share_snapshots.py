@@ -0,0 +1,260 @@
+"""
+Статические снимки расшаренных чатов в S3.
+
+Расшаренный чат рендерится в shared_chat.html один раз и кладётся в публичный бакет
+(share/<token>.html и share/<token>.json для встраивания). /share/{token} — только
+редирект на снимок: просмотры вирусной ссылки не рендерят шаблон и не читают сообщения.
+
+Актуальность — по версиям в строке чата: любое изменение расшаренного чата (сообщение,
+ответ модели, переименование) в той же транзакции увеличивает share_version (touch()),
+публикация записывает share_published_version — версию, которую она отрендерила.
+Пока они не совпадают, /share/{token} рендерит страницу сам, как раньше, а воркер
+(run_worker, из lifespan) перепубликует снимок. Изменения копятся SHARE_SNAPSHOT_DEBOUNCE
+секунд — стрим ответа не перезаливает снимок на каждый кусок. Расписание в памяти
+процесса, поэтому воркер ещё и периодически подбирает устаревшие снимки из базы
+(рестарт, изменение в другом процессе).
+
+Удаление чата (вручную, очисткой истории, по истечении срока) удаляет и снимок; если
+публикация шла параллельно с удалением, она сама убирает залитые объекты.
+Ассеты снимок берёт с сайта по исходным именам, не по именам с хэшем: снимок
+переживает деплой, после которого старых хэшированных файлов уже нет.
+"""
+import os
+import json
+import asyncio
+import logging
+
+from sqlalchemy import update, select, func, or_
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import Chat
+from app.services import archive, metrics, s3
+from app.services.assets import STATIC_URL_PREFIX
+from app.services.partitions import chat_messages
+
+logger = logging.getLogger(__name__)
+
+SHARE_SNAPSHOTS = os.getenv("SHARE_SNAPSHOTS", "true").lower() == "true"
+# Сайт, на который ведут ссылки и ассеты снимка (снимок открывается с домена S3)
+PUBLIC_SITE_URL = os.getenv("PUBLIC_SITE_URL", "https://lk.neirosetim.ru").rstrip("/")
+SHARE_PREFIX = "share/"
+# Объект перезаписывается на месте — долго кэшировать нельзя
+SHARE_SNAPSHOT_CACHE_CONTROL = os.getenv("SHARE_SNAPSHOT_CACHE_CONTROL", "public, max-age=60")
+SHARE_SNAPSHOT_DEBOUNCE = float(os.getenv("SHARE_SNAPSHOT_DEBOUNCE", "3"))
+SHARE_SNAPSHOT_SWEEP_INTERVAL = float(os.getenv("SHARE_SNAPSHOT_SWEEP_INTERVAL", "300"))
+SHARE_SNAPSHOT_BATCH = int(os.getenv("SHARE_SNAPSHOT_BATCH", "100"))
+
+_env = None  # Jinja-окружение приложения (templates.env в main.py)
+_pending = set()
+_wakeup = asyncio.Event()
+_worker_loop = None
+
+
+def init(env):
+    """Из main.py: снимки рендерятся тем же окружением шаблонов, что и страницы"""
+    global _env
+    _env = env
+
+
+def enabled() -> bool:
+    return SHARE_SNAPSHOTS and s3.is_configured()
+
+
+def html_key(token: str) -> str:
+    return f"{SHARE_PREFIX}{token}.html"
+
+
+def json_key(token: str) -> str:
+    return f"{SHARE_PREFIX}{token}.json"
+
+
+def snapshot_url(token: str) -> str:
+    return s3.public_url(html_key(token))
+
+
+def share_link(token: str) -> str:
+    return f"{PUBLIC_SITE_URL}/share/{token}"
+
+
+def is_fresh(chat: Chat) -> bool:
+    return chat.share_published_version is not None and chat.share_published_version == (chat.share_version or 0)
+
+
+class ArchiveUnavailable(RuntimeError):
+    """Blob архивного чата не прочитался из S3 — страницу сейчас не собрать"""
+
+
+# === СОДЕРЖИМОЕ ===
+
+def load_messages(db: Session, chat: Chat) -> list:
+    messages = []
+    if chat.archive_key:
+        # Публичный просмотр архивного чата читаем прямо из blob, не возвращая его в базу
+        try:
+            archived = archive.load_messages(chat.archive_key)
+        except Exception as e:
+            logger.error(f"Failed to load archive of shared chat {chat.id}: {e}")
+            raise ArchiveUnavailable(str(e)) from e
+        for m in archived:
+            messages.append({
+                "role": m["role"],
+                "content": m["content"],
+                "image_url": m.get("image_url"),
+                "attachment_url": m.get("attachment_url")
+            })
+    for m in chat_messages(db, chat):
+        messages.append({
+            "role": m.role,
+            "content": m.content,
+            "image_url": m.image_url,
+            "attachment_url": m.attachment_url
+        })
+    return messages
+
+
+def page_context(chat: Chat, messages: list) -> dict:
+    return {
+        "title": chat.title,
+        "date": chat.created_at.strftime("%d.%m.%Y"),
+        "messages": messages,
+        "model_name": chat.model,
+        "site_url": "",  # Страница на сайте — ссылки относительные
+    }
+
+
+def _snapshot_static_url(path: str) -> str:
+    return f"{PUBLIC_SITE_URL}{STATIC_URL_PREFIX}/{path.lstrip('/')}"
+
+
+def render(chat: Chat, messages: list) -> tuple:
+    """(HTML, JSON) снимка; ссылки и ассеты — абсолютные, на PUBLIC_SITE_URL"""
+    context = {**page_context(chat, messages), "site_url": PUBLIC_SITE_URL,
+               # Переменная контекста перекрывает глобальный static_url приложения
+               "static_url": _snapshot_static_url}
+    html = _env.get_template("shared_chat.html").render(context)
+    data = json.dumps({
+        "title": chat.title,
+        "model": chat.model,
+        "created_at": chat.created_at.isoformat() if chat.created_at else None,
+        "link": share_link(chat.share_token),
+        "messages": messages,
+    }, ensure_ascii=False)
+    return html.encode("utf-8"), data.encode("utf-8")
+
+
+# === ПУБЛИКАЦИЯ ===
+
+def touch(db: Session, chat_id: int) -> bool:
+    """В транзакции изменения: снимок расшаренного чата устарел. True — чат расшарен, нужен schedule()"""
+    result = db.execute(
+        update(Chat).where(Chat.id == chat_id, Chat.share_token.isnot(None))
+        .values(share_version=func.coalesce(Chat.share_version, 0) + 1)
+    )
+    return bool(result.rowcount)
+
+
+def schedule(chat_id: int):
+    """Поставить перепубликацию (после коммита); можно звать из тредпула"""
+    if _worker_loop is None or not enabled():
+        return
+    _worker_loop.call_soon_threadsafe(_enqueue, chat_id)
+
+
+def _enqueue(chat_id: int):
+    _pending.add(chat_id)
+    _wakeup.set()
+
+
+def publish(chat_id: int) -> bool:
+    """Рендерит и заливает снимок; отмечает опубликованной версию, которую отрендерил"""
+    db = SessionLocal()
+    try:
+        chat = db.get(Chat, chat_id)
+        if not chat or not chat.share_token:
+            return False
+        version = chat.share_version or 0
+        html, data = render(chat, load_messages(db, chat))
+        token = chat.share_token
+        uploaded = (s3.put_public_object(json_key(token), data, "application/json; charset=utf-8",
+                                         SHARE_SNAPSHOT_CACHE_CONTROL)
+                    and s3.put_public_object(html_key(token), html, "text/html; charset=utf-8",
+                                             SHARE_SNAPSHOT_CACHE_CONTROL))
+        if not uploaded:
+            metrics.SHARE_SNAPSHOTS.labels("failed").inc()
+            return False
+        # Чат мог измениться во время рендера — тогда версии не совпадут, и снимок перепубликуется
+        published = db.execute(
+            update(Chat).where(Chat.id == chat_id, Chat.share_token == token)
+            .values(share_published_version=version)
+        ).rowcount
+        db.commit()
+        if not published:
+            # Чат удалили (или сняли доступ), пока шёл рендер: delete() уже отработал —
+            # убираем только что залитые объекты сами, иначе удалённая переписка останется публичной
+            s3.delete_public_object(html_key(token))
+            s3.delete_public_object(json_key(token))
+            metrics.SHARE_SNAPSHOTS.labels("discarded").inc()
+            return False
+        metrics.SHARE_SNAPSHOTS.labels("published").inc()
+        return True
+    except Exception as e:
+        db.rollback()
+        metrics.SHARE_SNAPSHOTS.labels("failed").inc()
+        logger.error(f"Share snapshot for chat {chat_id} failed: {e}", exc_info=True)
+        return False
+    finally:
+        db.close()
+
+
+def delete(tokens: list):
+    """После удаления чатов: снимки больше не должны открываться"""
+    if not enabled():
+        return
+    for token in filter(None, tokens):
+        s3.delete_public_object(html_key(token))
+        s3.delete_public_object(json_key(token))
+        metrics.SHARE_SNAPSHOTS.labels("deleted").inc()
+
+
+def stale_chat_ids() -> list:
+    db = SessionLocal()
+    try:
+        return list(db.execute(
+            select(Chat.id).where(
+                Chat.share_token.isnot(None),
+                or_(Chat.share_published_version.is_(None),
+                    Chat.share_published_version != func.coalesce(Chat.share_version, 0)),
+            ).limit(SHARE_SNAPSHOT_BATCH)
+        ).scalars())
+    finally:
+        db.close()
+
+
+async def run_worker():
+    """Цикл публикации снимков; запускается из lifespan приложения"""
+    global _worker_loop
+    _worker_loop = asyncio.get_running_loop()
+    if not enabled():
+        return
+    logger.info(f"Share snapshot worker started, debounce {SHARE_SNAPSHOT_DEBOUNCE}s")
+    sweep = True
+    while True:
+        try:
+            if sweep:
+                _pending.update(await asyncio.to_thread(stale_chat_ids))
+            else:
+                # Ответ модели ещё может дописываться — ждём, пока изменения осядут
+                await asyncio.sleep(SHARE_SNAPSHOT_DEBOUNCE)
+            _wakeup.clear()
+            while _pending:
+                await asyncio.to_thread(publish, _pending.pop())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Share snapshot worker error: {e}", exc_info=True)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=SHARE_SNAPSHOT_SWEEP_INTERVAL)
+            sweep = False
+        except asyncio.TimeoutError:
+            sweep = True
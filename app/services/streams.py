@@ -0,0 +1,179 @@
+"""
+Возобновляемые стримы ответов (SSE с Last-Event-ID).
+
+Генерация отвязана от HTTP-соединения: ответ модели читает фоновая задача-производитель
+и складывает куски в кольцевой буфер с номерами событий. SSE-ответ — лишь подписчик
+буфера: если мобильный клиент отвалился посреди ответа, он переподключается к
+GET /chats/streams/{stream_id} с заголовком Last-Event-ID и получает пропущенные куски,
+а дальше — живой поток. Повторно спрашивать модель (и платить второй раз) не нужно.
+
+Ушедший клиент не должен держать генерацию: когда отключается последний подписчик,
+производитель отменяется (upstream-стрим закрывается, частичный ответ сохраняется и
+оплачивается по факту). Сразу — если клиент не заявил о переподключении; с заголовком
+X-Stream-Resume на POST — через STREAM_RESUME_WINDOW секунд, если никто не вернулся.
+
+Буфер живёт в памяти воркера: пока идёт генерация и ещё STREAM_RESUME_GRACE секунд после.
+Воркеры uvicorn слушают один сокет, направить переподключение в процесс-владелец нельзя:
+при WEB_CONCURRENCY > 1 оно может попасть в другой воркер и получить 404, а владелец так и
+не увидит подписчика. Поэтому в многопроцессном режиме стримы с X-Stream-Resume при
+отключении не отменяются — ответ дописывается и сохраняется целиком, клиент после 404
+перечитывает историю чата. Стримы без X-Stream-Resume отменяются сразу в любом режиме.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from collections import deque
+from contextlib import aclosing
+
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних событий хранить для повтора (кусок ответа ≈ несколько токенов)
+STREAM_BUFFER_EVENTS = int(os.getenv("STREAM_BUFFER_EVENTS", "4096"))
+# Сколько держать буфер после завершения генерации
+STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", "60"))
+# Сколько ждать переподключения клиента, заявившего X-Stream-Resume, до отмены генерации
+STREAM_RESUME_WINDOW = float(os.getenv("STREAM_RESUME_WINDOW", "15"))
+# Воркеров uvicorn (docker-compose передаёт то же значение, что и в --workers)
+STREAM_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# На остановке процесса: сколько ждать генерации без подключённых клиентов, потом отмена
+STREAM_SHUTDOWN_TIMEOUT = float(os.getenv("STREAM_SHUTDOWN_TIMEOUT", "5"))
+
+_buffers = {}
+_producers = set()
+
+
+class StreamBuffer:
+    def __init__(self, chat_id: int, user_casdoor_id: str, resume_window: float = 0):
+        self.id = uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.user_casdoor_id = user_casdoor_id
+        self.events = deque(maxlen=STREAM_BUFFER_EVENTS)  # (event_id, data)
+        self.last_id = 0
+        self.status = None  # None — идёт; completed / cancelled / failed
+        self.resume_window = resume_window  # 0 — отменять сразу после отключения клиента
+        self.subscribers = 0
+        self.producer = None
+        self._changed = asyncio.Event()
+        self._detached = None  # отложенная отмена, пока ждём переподключения
+
+    @property
+    def finished(self) -> bool:
+        return self.status is not None
+
+    def _notify(self):
+        # Будим всех текущих подписчиков; следующие ждут уже новое событие
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, data: dict) -> int:
+        self.last_id += 1
+        self.events.append((self.last_id, data))
+        self._notify()
+        return self.last_id
+
+    def finish(self, status: str):
+        self.status = status
+        self._notify()
+        asyncio.get_running_loop().call_later(STREAM_RESUME_GRACE, _buffers.pop, self.id, None)
+
+    def cancel(self, reason: str):
+        """Прерывает генерацию; stream_reply сохранит и спишет уже полученное"""
+        if self.producer is not None and not self.producer.done():
+            metrics.STREAMS_CANCELLED.labels(reason).inc()
+            self.producer.cancel()
+
+    def _attach(self):
+        self.subscribers += 1
+        if self._detached is not None:
+            self._detached.cancel()
+            self._detached = None
+
+    def _detach(self):
+        self.subscribers -= 1
+        if self.subscribers or self.finished:
+            return
+        if self.resume_window > 0:
+            if STREAM_WORKERS > 1:
+                # Переподключение может уйти в другой воркер — сюда не вернётся никто, дописываем ответ
+                return
+            self._detached = asyncio.get_running_loop().call_later(self.resume_window, self.cancel, "disconnect")
+        else:
+            self.cancel("disconnect")
+
+    async def follow(self, after: int = 0):
+        """
+        События с номером > after: сначала из буфера, потом по мере поступления.
+        (None, None) — часть событий уже вытеснена из кольца, клиенту нужно перечитать чат.
+        Закрытие генератора (клиент отключился) без других подписчиков отменяет генерацию.
+        """
+        self._attach()
+        try:
+            while True:
+                waiter = self._changed
+                if self.events and after < self.events[0][0] - 1:
+                    yield None, None
+                    after = self.events[0][0] - 1
+                for event_id, data in list(self.events):
+                    if event_id > after:
+                        yield event_id, data
+                        after = event_id
+                if self.finished and after >= self.last_id:
+                    return
+                await waiter.wait()
+        finally:
+            self._detach()
+
+
+async def _produce(buffer: StreamBuffer, source):
+    status = "completed"
+    try:
+        async with aclosing(source) as chunks:
+            async for content in chunks:
+                # Кусок текста или уже готовое событие (compare — с меткой модели)
+                buffer.publish(content if isinstance(content, dict) else {"content": content})
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except Exception as e:
+        status = "failed"
+        logger.error(f"Stream {buffer.id} (chat {buffer.chat_id}) failed: {e}", exc_info=True)
+    finally:
+        buffer.finish(status)
+
+
+def start(chat_id: int, user_casdoor_id: str, source, resumable: bool = False) -> StreamBuffer:
+    """
+    Запускает производителя над async-генератором кусков текста (chats.stream_reply)
+    или dict-событий (chats.compare_reply).
+    resumable — клиент умеет переподключаться: отключение отменяет генерацию не сразу.
+    """
+    buffer = StreamBuffer(chat_id, user_casdoor_id, STREAM_RESUME_WINDOW if resumable else 0)
+    _buffers[buffer.id] = buffer
+    task = asyncio.create_task(_produce(buffer, source))
+    buffer.producer = task
+    _producers.add(task)
+    task.add_done_callback(_producers.discard)
+    return buffer
+
+
+def get(stream_id: str, user_casdoor_id: str):
+    buffer = _buffers.get(stream_id)
+    if buffer is None or buffer.user_casdoor_id != user_casdoor_id:
+        return None
+    return buffer
+
+
+async def shutdown():
+    """Из lifespan: даём генерациям дописаться, оставшиеся отменяем (частичный ответ сохранится)"""
+    if not _producers:
+        return
+    logger.info(f"Waiting for {len(_producers)} detached stream(s)")
+    _, pending = await asyncio.wait(set(_producers), timeout=STREAM_SHUTDOWN_TIMEOUT)
+    for task in pending:
+        metrics.STREAMS_CANCELLED.labels("shutdown").inc()
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
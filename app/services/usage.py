@@ -0,0 +1,87 @@
+"""
+Учёт расходов: запись на каждую генерацию и дневные суммы.
+
+record() вызывается в транзакции сохранения ответа (chats.save_assistant_reply, для медиа —
+media_jobs.finalize_job): строка
+usage_records (модель, токены, стоимость, время) и upsert в usage_daily по ключу
+(пользователь, день, модель) — INSERT ... ON CONFLICT DO UPDATE прибавляет к счётчикам,
+так что параллельные генерации не теряют инкременты, а ответ, списание и учёт
+коммитятся вместе. История расходов читается только из usage_daily: O(дней × моделей),
+а не O(сообщений).
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import UsageRecord, UsageDaily
+
+# Максимальный период истории, который отдаёт API
+USAGE_MAX_DAYS = int(os.getenv("USAGE_MAX_DAYS", "366"))
+
+ROLLUP_COUNTERS = ("prompt_tokens", "completion_tokens", "cached_tokens", "cost", "duration_ms")
+
+
+def estimate_tokens(text: str) -> int:
+    """Приблизительно, как в ai_generation.estimate_cost: ~4 символа на токен"""
+    return len(text) // 4
+
+
+def _upsert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(UsageDaily)
+    if dialect == "sqlite":
+        return sqlite.insert(UsageDaily)
+    raise RuntimeError(f"Unsupported dialect for usage rollups: {dialect}")
+
+
+def record(db: Session, user_casdoor_id: str, chat_id: int, model_id: str, status: str, cost: float,
+           prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0, estimated: bool = False,
+           duration_ms: int = 0, ttft_ms: int = None):
+    """Добавляет запись и прибавляет её к дневной сумме; коммит — за вызывающим"""
+    now = datetime.utcnow()
+    entry = UsageRecord(
+        user_casdoor_id=user_casdoor_id, chat_id=chat_id, model=model_id, status=status,
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens,
+        estimated=estimated, cost=cost, duration_ms=duration_ms, ttft_ms=ttft_ms, created_at=now,
+    )
+    db.add(entry)
+
+    values = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+              "cached_tokens": cached_tokens, "cost": cost, "duration_ms": duration_ms}
+    stmt = _upsert(db).values(user_casdoor_id=user_casdoor_id, day=now.date(), model=model_id, requests=1, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_casdoor_id", "day", "model"],
+        set_={"requests": UsageDaily.requests + 1,
+              **{name: getattr(UsageDaily, name) + stmt.excluded[name] for name in ROLLUP_COUNTERS}},
+    )
+    db.execute(stmt)
+    return entry
+
+
+def daily(db: Session, user_casdoor_id: str, days: int = 30) -> dict:
+    """Расходы по дням и моделям за последние days дней (включая сегодня) и итог по моделям"""
+    days = max(1, min(days, USAGE_MAX_DAYS))
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = db.execute(
+        select(UsageDaily.day, UsageDaily.model, UsageDaily.requests, UsageDaily.prompt_tokens,
+               UsageDaily.completion_tokens, UsageDaily.cached_tokens, UsageDaily.cost)
+        .where(UsageDaily.user_casdoor_id == user_casdoor_id, UsageDaily.day >= since)
+        .order_by(UsageDaily.day, UsageDaily.model)
+    ).mappings().all()
+
+    totals = {}
+    for row in rows:
+        total = totals.setdefault(row["model"], {"model": row["model"], "requests": 0, "prompt_tokens": 0,
+                                                  "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0})
+        for name in ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "cost"):
+            total[name] += row[name] or 0
+    return {
+        "since": since,
+        "days": [dict(row) for row in rows],
+        "models": sorted(totals.values(), key=lambda t: t["cost"], reverse=True),
+        "total_cost": sum(t["cost"] for t in totals.values()),
+    }
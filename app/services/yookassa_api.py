@@ -0,0 +1,87 @@
+"""
+Асинхронный клиент API YooKassa (v3) поверх общего httpx.AsyncClient.
+
+Синхронный SDK yookassa блокировал event loop на время HTTPS-запроса (а с ним и все
+SSE-стримы воркера). Здесь один пул соединений на процесс (реестр сервисов, закрывается
+в lifespan), Basic-auth магазина и Idempotence-Key на создание платежа.
+"""
+import os
+import uuid
+import logging
+from datetime import datetime
+
+import httpx
+
+from app.services.registry import services
+
+logger = logging.getLogger(__name__)
+
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
+YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
+YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
+YOOKASSA_TIMEOUT = float(os.getenv("YOOKASSA_TIMEOUT", "15"))
+YOOKASSA_MAX_CONNECTIONS = int(os.getenv("YOOKASSA_MAX_CONNECTIONS", "10"))
+# Максимум на страницу в GET /payments
+LIST_PAGE_SIZE = 100
+
+
+class YooKassaError(Exception):
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def is_configured() -> bool:
+    return bool(YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY)
+
+
+def create_http_client():
+    return httpx.AsyncClient(
+        base_url=YOOKASSA_API_URL,
+        auth=(YOOKASSA_SHOP_ID or "", YOOKASSA_SECRET_KEY or ""),
+        timeout=httpx.Timeout(YOOKASSA_TIMEOUT, connect=5.0),
+        limits=httpx.Limits(max_connections=YOOKASSA_MAX_CONNECTIONS, max_keepalive_connections=YOOKASSA_MAX_CONNECTIONS),
+    )
+
+
+services.register("yookassa", create_http_client)
+
+
+async def _request(method: str, path: str, **kwargs) -> dict:
+    if not is_configured():
+        raise YooKassaError("YooKassa is not configured")
+    resp = await services.get("yookassa").request(method, path, **kwargs)
+    if resp.status_code >= 400:
+        try:
+            description = resp.json().get("description") or resp.text
+        except ValueError:
+            description = resp.text
+        raise YooKassaError(f"YooKassa {method} {path}: {resp.status_code} {description}", resp.status_code)
+    return resp.json()
+
+
+async def create_payment(payload: dict, idempotence_key: str = None) -> dict:
+    """POST /payments; повтор с тем же ключом вернёт тот же платёж, а не создаст второй"""
+    headers = {"Idempotence-Key": idempotence_key or str(uuid.uuid4())}
+    return await _request("POST", "/payments", json=payload, headers=headers)
+
+
+async def get_payment(payment_id: str) -> dict:
+    return await _request("GET", f"/payments/{payment_id}")
+
+
+async def list_payments(status: str, created_gte: datetime):
+    """Все платежи магазина в статусе status, созданные не раньше created_gte (UTC); постранично"""
+    params = {
+        "status": status,
+        "created_at.gte": created_gte.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "limit": LIST_PAGE_SIZE,
+    }
+    while True:
+        page = await _request("GET", "/payments", params=params)
+        for item in page.get("items", []):
+            yield item
+        cursor = page.get("next_cursor")
+        if not cursor:
+            return
+        params = {**params, "cursor": cursor}
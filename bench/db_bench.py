@@ -0,0 +1,216 @@
+"""
+Микро-бенчмарки БД для чатовых эндпоинтов на данных из bench/seed_data.py.
+
+Вызывает обработчики напрямую (без HTTP) и замеряет get_chats, get_chat_history, clear_history,
+shared_chat_page и очистку просроченных чатов. Разрушающие сценарии выполняются внутри внешней
+транзакции с откатом (commit в обработчике закрывает только SAVEPOINT), так что данные не меняются.
+Для каждого SQL-запроса сценария снимается план (EXPLAIN QUERY PLAN / EXPLAIN ANALYZE).
+Результат обработчика сериализуется так же, как это сделал бы FastAPI (render), — замер
+включает кодирование ответа в JSON, а не только запросы.
+
+Запуск:
+    DB_URL=sqlite:///./bench.db python -m bench.db_bench --iterations 20 --output db_bench.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from fastapi import BackgroundTasks  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import Response  # noqa: E402
+from sqlalchemy import event, func, select  # noqa: E402
+from sqlalchemy.exc import NoResultFound  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+from app.database import engine  # noqa: E402
+from app.models import UserSession, Chat, Message  # noqa: E402
+from app.routers import chats as chats_router  # noqa: E402
+import app.main as main_module  # noqa: E402
+
+from bench.load_test import git_revision, percentile  # noqa: E402
+
+
+def fake_request(session_id: str) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(b"cookie", f"session_id={session_id}".encode())],
+        "query_string": b"",
+    })
+
+
+class StatementCapture:
+    """Запоминает SQL первого прогона сценария — для EXPLAIN"""
+
+    def __init__(self):
+        self.statements = []
+        self.active = False
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active and not executemany:
+            self.statements.append((statement, parameters))
+
+
+capture = StatementCapture()
+event.listen(engine, "before_cursor_execute", capture)
+
+if engine.dialect.name == "sqlite":
+    # pysqlite сам управляет транзакциями и ломает SAVEPOINT — рецепт из документации SQLAlchemy
+    @event.listens_for(engine, "connect")
+    def _sqlite_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _sqlite_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    engine.dispose()
+
+
+def explain(conn, statement: str, parameters):
+    dialect = conn.dialect.name
+    is_select = statement.lstrip().upper().startswith("SELECT")
+    if dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    elif dialect == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if is_select else "EXPLAIN "
+    else:
+        prefix = "EXPLAIN "
+    rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+    return [" | ".join(str(col) for col in row) for row in rows]
+
+
+def render(result) -> int:
+    """Тело ответа, как его отдаст FastAPI без response_model; возвращает размер в байтах"""
+    if isinstance(result, Response):
+        return len(result.body) if hasattr(result, "body") else 0
+    if result is None:
+        return 0
+    response_class = main_module.app.router.default_response_class
+    response_class = getattr(response_class, "value", response_class)  # DefaultPlaceholder
+    return len(response_class(jsonable_encoder(result)).body)
+
+
+def run_scenario(name: str, fn, iterations: int, destructive: bool) -> dict:
+    """fn(db) выполняет сценарий; каждая итерация откатывается, так что разрушающие сценарии повторяемы"""
+    timings = []
+    plans = []
+    for i in range(iterations + 1):
+        with engine.connect() as conn:
+            outer = conn.begin()
+            db = Session(bind=conn, join_transaction_mode="create_savepoint")
+            capture.active = i == 0
+            capture.statements = []
+            started = time.perf_counter()
+            try:
+                size = render(fn(db))
+                elapsed = time.perf_counter() - started
+            finally:
+                capture.active = False
+                db.close()
+            if i == 0:
+                # Прогрев + планы (до отката — в той же транзакции)
+                for statement, parameters in capture.statements:
+                    try:
+                        plans.append({"sql": statement, "plan": explain(conn, statement, parameters)})
+                    except Exception as e:
+                        plans.append({"sql": statement, "error": str(e)})
+            else:
+                timings.append(elapsed)
+            outer.rollback()
+
+    return {
+        "name": name,
+        "iterations": iterations,
+        "destructive": destructive,
+        "min_ms": round(min(timings) * 1000, 3),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+        "queries": len(plans),
+        "response_bytes": size,
+        "plans": plans,
+    }
+
+
+def pick_targets(db: Session) -> dict:
+    """Пользователь с максимумом чатов, его самый длинный чат и любой расшаренный чат"""
+    heavy_user, _ = db.execute(
+        select(Chat.user_casdoor_id, func.count(Chat.id)).group_by(Chat.user_casdoor_id)
+        .order_by(func.count(Chat.id).desc()).limit(1)
+    ).one()
+    session_id = db.execute(select(UserSession.session_id).filter_by(token=heavy_user).limit(1)).scalar()
+    longest_chat = db.execute(
+        select(Message.chat_id).join(Chat, Chat.id == Message.chat_id)
+        .filter(Chat.user_casdoor_id == heavy_user)
+        .group_by(Message.chat_id).order_by(func.count(Message.id).desc()).limit(1)
+    ).scalar()
+    share_token = db.execute(select(Chat.share_token).filter(Chat.share_token.isnot(None)).limit(1)).scalar()
+    return {"user": heavy_user, "session_id": session_id, "chat_id": longest_chat, "share_token": share_token}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микро-бенчмарки запросов чатов")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--output", help="куда сохранить JSON-отчёт")
+    args = parser.parse_args()
+
+    with Session(engine) as db:
+        try:
+            targets = pick_targets(db)
+        except NoResultFound:
+            raise SystemExit("No seeded data — run bench.seed_data first")
+    request = fake_request(targets["session_id"])
+    print(f"Targets: {targets}")
+
+    scenarios = [
+        ("get_chats", lambda db: chats_router.get_chats(request, BackgroundTasks(), db), False),
+        ("get_chat_history", lambda db: chats_router.get_chat_history(targets["chat_id"], request, db), False),
+        ("clear_history_24h", lambda db: chats_router.clear_history("last_24h", request, db), True),
+        ("clear_history_all", lambda db: chats_router.clear_history("all", request, db), True),
+        ("cleanup_expired_chats", lambda db: chats_router.cleanup_expired_chats(db), True),
+    ]
+    if targets["share_token"]:
+        scenarios.append((
+            "shared_chat_page",
+            lambda db: main_module.shared_chat_page(targets["share_token"], request, db),
+            False,
+        ))
+
+    results = []
+    for name, fn, destructive in scenarios:
+        try:
+            result = run_scenario(name, fn, args.iterations, destructive)
+        except Exception as e:
+            results.append({"name": name, "error": f"{type(e).__name__}: {e}"})
+            print(f"{name:24s} FAILED: {type(e).__name__}: {e}")
+            continue
+        results.append(result)
+        print(f"{name:24s} p50={result['p50_ms']:>10.3f}ms p95={result['p95_ms']:>10.3f}ms queries={result['queries']}")
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "dialect": engine.dialect.name,
+            "targets": targets,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Заглушка OpenRouter для бенчмарков: отвечает на POST /api/v1/chat/completions стримом
+в формате OpenAI (chat.completion.chunk) с настраиваемой задержкой, скоростью и ошибками.
+
+Запуск:
+    FAKE_TTFT=0.3 FAKE_TOKENS_PER_SEC=50 uvicorn bench.fake_openrouter:app --port 9100
+
+Настройки (ENV):
+    FAKE_TTFT            задержка до первого токена, с (по умолчанию 0.2)
+    FAKE_TOKENS_PER_SEC  скорость выдачи токенов (по умолчанию 100)
+    FAKE_TOKENS          число токенов в ответе (по умолчанию 200)
+    FAKE_ERROR_RATE      доля запросов, отвечающих 500 (по умолчанию 0)
+    FAKE_ABORT_RATE      доля стримов, обрываемых на середине (по умолчанию 0)
+
+С stream_options.include_usage последним чанком идёт usage; префикс до последней точки
+cache_control считается прочитанным из кэша (как у прогретого кэша Anthropic).
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+TTFT = float(os.getenv("FAKE_TTFT", "0.2"))
+TOKENS_PER_SEC = float(os.getenv("FAKE_TOKENS_PER_SEC", "100"))
+TOKENS = int(os.getenv("FAKE_TOKENS", "200"))
+ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+ABORT_RATE = float(os.getenv("FAKE_ABORT_RATE", "0"))
+
+WORDS = ["Привет", "это", "тестовый", "ответ", "модели", "для", "нагрузочного", "прогона", "и", "замеров"]
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _usage(messages: list, tokens: int) -> dict:
+    """prompt_tokens ≈ символы/4; cached — до последнего блока с cache_control"""
+    prompt_chars = cached_chars = 0
+    for message in messages:
+        content = message.get("content")
+        blocks = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for block in blocks:
+            prompt_chars += len(block.get("text") or "")
+            if "cache_control" in block:
+                cached_chars = prompt_chars
+    return {
+        "prompt_tokens": prompt_chars // 4,
+        "completion_tokens": tokens,
+        "total_tokens": prompt_chars // 4 + tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_chars // 4},
+    }
+
+
+async def stream_completion(model: str, tokens: int, abort: bool, usage: dict = None):
+    completion_id = f"gen-{uuid.uuid4().hex}"
+    interval = 1 / TOKENS_PER_SEC if TOKENS_PER_SEC > 0 else 0
+    abort_at = tokens // 2 if abort else None
+
+    await asyncio.sleep(TTFT)
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+    for i in range(tokens):
+        if abort_at is not None and i == abort_at:
+            raise RuntimeError("fake upstream abort")
+        yield _chunk(completion_id, model, {"content": WORDS[i % len(WORDS)] + " "})
+        if interval:
+            await asyncio.sleep(interval)
+    yield _chunk(completion_id, model, {}, finish_reason="stop")
+    if usage:
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                   "model": model, "choices": [], "usage": usage}
+        yield f"data: {json.dumps(payload)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake/model")
+
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        return JSONResponse({"error": {"message": "fake upstream error", "code": 500}}, status_code=500)
+
+    if not body.get("stream"):
+        text = " ".join(WORDS[i % len(WORDS)] for i in range(TOKENS))
+        await asyncio.sleep(TTFT + TOKENS / TOKENS_PER_SEC)
+        return JSONResponse({
+            "id": f"gen-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        })
+
+    abort = bool(ABORT_RATE and random.random() < ABORT_RATE)
+    usage = _usage(body.get("messages", []), TOKENS) if (body.get("stream_options") or {}).get("include_usage") else None
+    return StreamingResponse(stream_completion(model, TOKENS, abort, usage), media_type="text/event-stream")
+
+
+app = Starlette(routes=[Route("/api/v1/chat/completions", chat_completions, methods=["POST"])])
@@ -0,0 +1,336 @@
+"""
+Нагрузочный прогон стриминга чатов против локальной заглушки OpenRouter.
+
+Поднимает bench/fake_openrouter.py и приложение (uvicorn) на временной SQLite-базе,
+гоняет N параллельных диалогов (/chats/new + /chats/{id}/message) и считает:
+  - TTFT клиента и добавку сервера к TTFT (относительно прямого стрима из заглушки),
+  - фреймы/с на стрим и суммарно,
+  - CPU и память процесса приложения в пересчёте на стрим.
+
+Запуск (из корня репозитория):
+    python -m bench.load_test --concurrency 20 --conversations 40 --turns 2 --output bench_output.json
+    python -m bench.load_test --compare bench_output.json   # сравнить с прошлым прогоном
+    python -m bench.load_test --abort-rate 0.2              # обрывы стрима у провайдера
+
+Нужен psutil (bench/requirements.txt).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+import httpx
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SESSION_ID = "bench-session"
+USER_ID = "bench_user"
+
+
+# === ИНФРАСТРУКТУРА ===
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def prepare_database(db_url: str):
+    """Создаёт схему и тестового пользователя с сессией"""
+    os.environ["DB_URL"] = db_url
+    sys.path.insert(0, ROOT)
+    from app.database import Base, engine, SessionLocal
+    from app.models import UserWallet, UserSession
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        db.add(UserWallet(casdoor_id=USER_ID, email="bench@local", name="bench", balance=1e9))
+        db.add(UserSession(session_id=SESSION_ID, token=USER_ID))
+        db.commit()
+    finally:
+        db.close()
+
+
+def start_server(app_path: str, port: int, env: dict, workers: int = 1) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", app_path, "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    return subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env})
+
+
+async def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start in {timeout}s")
+
+
+# === ЗАМЕРЫ ===
+
+async def read_stream(response: httpx.Response, started: float) -> dict:
+    ttft = None
+    frames = 0
+    async for line in response.aiter_lines():
+        if not line.startswith("data: ") or line == "data: [DONE]":
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - started
+        frames += 1
+    duration = time.perf_counter() - started
+    return {"ttft": ttft, "frames": frames, "duration": duration}
+
+
+async def baseline_stream(client: httpx.AsyncClient, stub_url: str) -> dict:
+    """Стрим напрямую из заглушки — отсюда берётся «чистый» TTFT без сервера"""
+    started = time.perf_counter()
+    payload = {"model": "openai/gpt-4o", "stream": True, "messages": [{"role": "user", "content": "ping"}]}
+    async with client.stream("POST", f"{stub_url}/api/v1/chat/completions", json=payload) as resp:
+        resp.raise_for_status()
+        return await read_stream(resp, started)
+
+
+async def app_conversation(client: httpx.AsyncClient, app_url: str, turns: int, results: list, errors: list):
+    chat_id = None
+    for turn in range(turns):
+        payload = {"message": f"Вопрос {turn}: расскажи что-нибудь", "model": "openai/gpt-4o"}
+        url = f"{app_url}/chats/new" if chat_id is None else f"{app_url}/chats/{chat_id}/message"
+        started = time.perf_counter()
+        try:
+            async with client.stream("POST", url, json=payload) as resp:
+                if resp.status_code != 200:
+                    errors.append(f"{resp.status_code} {url}")
+                    return
+                chat_id = chat_id or int(resp.headers["X-Chat-Id"])
+                results.append(await read_stream(resp, started))
+        except httpx.HTTPError as e:
+            errors.append(f"{type(e).__name__} {url}")
+            return
+
+
+async def run_phase(concurrency: int, jobs: list):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def guarded(job):
+        async with semaphore:
+            await job()
+
+    await asyncio.gather(*(guarded(job) for job in jobs))
+
+
+async def sample_memory(process: psutil.Process, samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            samples.append(sum(p.memory_info().rss for p in [process, *process.children(recursive=True)]))
+        except psutil.Error:
+            pass
+        await asyncio.sleep(0.05)
+
+
+def cpu_seconds(process: psutil.Process) -> float:
+    total = 0.0
+    for p in [process, *process.children(recursive=True)]:
+        try:
+            t = p.cpu_times()
+            total += t.user + t.system
+        except psutil.Error:
+            pass
+    return total
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def summarize(streams: list) -> dict:
+    ttfts = [s["ttft"] for s in streams if s["ttft"] is not None]
+    fps = [s["frames"] / s["duration"] for s in streams if s["duration"] > 0]
+    return {
+        "streams": len(streams),
+        "ttft_p50_ms": round(percentile(ttfts, 50) * 1000, 2) if ttfts else None,
+        "ttft_p95_ms": round(percentile(ttfts, 95) * 1000, 2) if ttfts else None,
+        "frames_per_sec_mean": round(statistics.mean(fps), 2) if fps else None,
+        "frames_total": sum(s["frames"] for s in streams),
+    }
+
+
+# === ОСНОВНОЙ СЦЕНАРИЙ ===
+
+async def run(args) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix="bench-")
+    db_url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    prepare_database(db_url)
+
+    stub_port, app_port = free_port(), free_port()
+    stub_url, app_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{app_port}"
+
+    stub_env = {
+        "FAKE_TTFT": str(args.ttft),
+        "FAKE_TOKENS_PER_SEC": str(args.tokens_per_sec),
+        "FAKE_TOKENS": str(args.tokens),
+        "FAKE_ERROR_RATE": str(args.error_rate),
+        "FAKE_ABORT_RATE": str(args.abort_rate),
+    }
+    app_env = {
+        "DB_URL": db_url,
+        "OPENROUTER_BASE_URL": f"{stub_url}/api/v1",
+        "OPENROUTER_API_KEY": "bench",
+    }
+    stub = start_server("bench.fake_openrouter:app", stub_port, stub_env)
+    server = start_server("app.main:app", app_port, app_env, workers=args.workers)
+    try:
+        await wait_ready(f"{stub_url}/")
+        await wait_ready(f"{app_url}/login")
+
+        limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+        timeout = httpx.Timeout(120.0)
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+            # 1. Базовая линия: напрямую в заглушку
+            baseline = []
+
+            async def baseline_job():
+                try:
+                    baseline.append(await baseline_stream(client, stub_url))
+                except httpx.HTTPError:
+                    pass
+
+            await run_phase(args.concurrency, [baseline_job for _ in range(args.concurrency)])
+
+            # 2. Через приложение
+            client.cookies.set("session_id", SESSION_ID)
+            process = psutil.Process(server.pid)
+            streams, errors, memory = [], [], []
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(sample_memory(process, memory, stop))
+            await asyncio.sleep(0.2)
+            rss_idle = min(memory) if memory else 0
+            cpu_before = cpu_seconds(process)
+            started = time.perf_counter()
+
+            jobs = [lambda: app_conversation(client, app_url, args.turns, streams, errors)
+                    for _ in range(args.conversations)]
+            await run_phase(args.concurrency, jobs)
+
+            wall = time.perf_counter() - started
+            cpu_used = cpu_seconds(process) - cpu_before
+            stop.set()
+            await sampler
+    finally:
+        for proc in (server, stub):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    base = summarize(baseline)
+    app_stats = summarize(streams)
+    overhead = {}
+    for key in ("ttft_p50_ms", "ttft_p95_ms"):
+        if base[key] is not None and app_stats[key] is not None:
+            overhead[key] = round(app_stats[key] - base[key], 2)
+
+    peak_rss = max(memory) if memory else 0
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "params": vars(args),
+        },
+        "baseline": base,
+        "app": app_stats,
+        "server_ttft_overhead": overhead,
+        "throughput_frames_per_sec": round(app_stats["frames_total"] / wall, 2) if wall else None,
+        "cpu_ms_per_stream": round(cpu_used * 1000 / len(streams), 2) if streams else None,
+        "rss_idle_mb": round(rss_idle / 2**20, 2),
+        "rss_peak_mb": round(peak_rss / 2**20, 2),
+        "rss_kb_per_concurrent_stream": round((peak_rss - rss_idle) / 1024 / args.concurrency, 2),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+    }
+
+
+COMPARE_KEYS = [
+    ("server_ttft_overhead", "ttft_p50_ms"),
+    ("server_ttft_overhead", "ttft_p95_ms"),
+    ("app", "frames_per_sec_mean"),
+    (None, "throughput_frames_per_sec"),
+    (None, "cpu_ms_per_stream"),
+    (None, "rss_kb_per_concurrent_stream"),
+]
+
+
+def lookup(report: dict, section, key):
+    return (report.get(section) or {}).get(key) if section else report.get(key)
+
+
+def print_report(report: dict, previous: dict = None):
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if not previous:
+        return
+    print(f"\nСравнение с {previous['meta']['revision']} -> {report['meta']['revision']}:")
+    for section, key in COMPARE_KEYS:
+        old, new = lookup(previous, section, key), lookup(report, section, key)
+        name = f"{section}.{key}" if section else key
+        if old is None or new is None:
+            print(f"  {name}: {old} -> {new}")
+            continue
+        delta = (new - old) / old * 100 if old else 0.0
+        print(f"  {name}: {old} -> {new} ({delta:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон SSE-стриминга чатов")
+    parser.add_argument("--concurrency", type=int, default=10, help="одновременных стримов")
+    parser.add_argument("--conversations", type=int, default=20, help="всего диалогов")
+    parser.add_argument("--turns", type=int, default=2, help="сообщений в диалоге (первое — /chats/new)")
+    parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn у приложения")
+    parser.add_argument("--ttft", type=float, default=0.2, help="задержка заглушки до первого токена, с")
+    parser.add_argument("--tokens-per-sec", type=float, default=100, help="скорость токенов заглушки")
+    parser.add_argument("--tokens", type=int, default=200, help="токенов в ответе")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ошибок заглушки")
+    parser.add_argument("--abort-rate", type=float, default=0.0,
+                        help="доля стримов заглушки, обрываемых на середине (частичный ответ и списание)")
+    parser.add_argument("--output", help="куда сохранить JSON-отчёт")
+    parser.add_argument("--compare", help="JSON-отчёт прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare and os.path.exists(args.compare):
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    report = asyncio.run(run(args))
+    print_report(report, previous)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Генератор синтетических данных для тюнинга индексов и запросов.
+
+Заполняет таблицы из app/models.py (wallets, sessions, chats, messages) пакетными вставками
+с правдоподобными распределениями: у немногих пользователей много чатов, длина чатов
+логнормальная, часть чатов закреплена / временная (в т.ч. уже просроченная) / расшарена.
+
+Запуск (DB_URL — целевая база; недостающие таблицы создаются):
+    DB_URL=sqlite:///./bench.db python -m bench.seed_data --scale small
+    DB_URL=postgresql://... python -m bench.seed_data --users 10000 --chats 1000000 --messages 50000000
+
+На Postgres сообщения заливаются через COPY, на остальных базах — executemany пачками.
+Пользователи получают ID вида bench_<n> и сессии bench-session-<n>.
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import insert, func, select, text  # noqa: E402
+
+from app.database import Base, engine  # noqa: E402
+from app.models import UserWallet, UserSession, Chat, Message  # noqa: E402
+
+SCALES = {
+    "tiny": (50, 1_000, 20_000),
+    "small": (500, 20_000, 500_000),
+    "medium": (2_000, 200_000, 5_000_000),
+    "large": (10_000, 1_000_000, 50_000_000),
+}
+
+PINNED_SHARE = 0.05
+TEMPORARY_SHARE = 0.03
+SHARED_SHARE = 0.02
+HISTORY_DAYS = 365
+
+WORDS = ("модель ответ запрос данные пример код функция таблица индекс запрос пользователь "
+         "чат сообщение история контекст токен стоимость баланс генерация изображение видео").split()
+
+
+def user_id(n: int) -> str:
+    return f"bench_{n}"
+
+
+def session_id(n: int) -> str:
+    return f"bench-session-{n}"
+
+
+def random_text(rng: random.Random, mean_words: int) -> str:
+    n = max(1, int(rng.lognormvariate(0, 0.9) * mean_words))
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def weighted_split(rng: random.Random, total: int, buckets: int, sigma: float) -> list:
+    """Раскладывает total по buckets с логнормальными весами (длинный хвост)"""
+    weights = [rng.lognormvariate(0, sigma) for _ in range(buckets)]
+    scale = total / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    for i in range(total - sum(counts)):
+        counts[i % buckets] += 1
+    return counts
+
+
+def next_id(conn, model) -> int:
+    return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def bulk_insert(conn, table, rows: list):
+    if rows:
+        conn.execute(insert(table), rows)
+
+
+def copy_messages(conn, rows: list):
+    """COPY для Postgres: на порядок быстрее executemany"""
+    buf = io.StringIO()
+    for r in rows:
+        values = [str(r["id"]), str(r["chat_id"]), r["role"], r["content"], r["created_at"].isoformat()]
+        buf.write("\t".join(v.replace("\\", "\\\\").replace("\t", " ").replace("\n", "\\n") for v in values))
+        buf.write("\n")
+    buf.seek(0)
+    raw = conn.connection.dbapi_connection
+    with raw.cursor() as cursor:
+        cursor.copy_expert("COPY messages (id, chat_id, role, content, created_at) FROM STDIN", buf)
+
+
+def reset_sequences(conn):
+    if conn.dialect.name != "postgresql":
+        return
+    for table in ("wallets", "chats", "messages"):
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))"
+        ))
+
+
+def seed(users: int, chats: int, messages: int, batch_size: int, seed_value: int):
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    use_copy = engine.dialect.name == "postgresql"
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        wallet_start = next_id(conn, UserWallet)
+        bulk_insert(conn, UserWallet.__table__, [
+            {"id": wallet_start + i, "casdoor_id": user_id(i), "email": f"bench{i}@example.com",
+             "name": f"Bench {i}", "balance": 1000.0}
+            for i in range(users)
+        ])
+        bulk_insert(conn, UserSession.__table__, [
+            {"session_id": session_id(i), "token": user_id(i)} for i in range(users)
+        ])
+        chat_start = next_id(conn, Chat)
+        message_start = next_id(conn, Message)
+
+    chats_per_user = weighted_split(rng, chats, users, sigma=1.2)
+    messages_per_chat = weighted_split(rng, messages, chats, sigma=0.8)
+
+    chat_id, message_id = chat_start, message_start
+    chat_rows, message_rows = [], []
+    chat_index = 0
+    started = time.perf_counter()
+
+    def flush():
+        with engine.begin() as conn:
+            bulk_insert(conn, Chat.__table__, chat_rows)
+            if use_copy:
+                copy_messages(conn, message_rows)
+            else:
+                bulk_insert(conn, Message.__table__, message_rows)
+        chat_rows.clear()
+        message_rows.clear()
+
+    for user_n, n_chats in enumerate(chats_per_user):
+        for _ in range(n_chats):
+            created = now - timedelta(seconds=rng.randint(0, HISTORY_DAYS * 86400))
+            updated = min(now, created + timedelta(seconds=int(rng.expovariate(1 / 3600))))
+            roll = rng.random()
+            expires_at = None
+            if roll < TEMPORARY_SHARE:
+                # Часть временных чатов уже просрочена — их подберёт очистка
+                expires_at = created + timedelta(hours=24)
+            chat_rows.append({
+                "id": chat_id,
+                "user_casdoor_id": user_id(user_n),
+                "title": random_text(rng, 4)[:40],
+                "model": rng.choice(("openai/gpt-4o", "anthropic/claude-sonnet-4.5", "google/gemini-2.5-flash")),
+                "is_pinned": rng.random() < PINNED_SHARE,
+                "share_token": f"bench-share-{chat_id}" if rng.random() < SHARED_SHARE else None,
+                "expires_at": expires_at,
+                "created_at": created,
+                "updated_at": updated,
+            })
+            n_messages = messages_per_chat[chat_index]
+            for k in range(n_messages):
+                role = "user" if k % 2 == 0 else "assistant"
+                message_rows.append({
+                    "id": message_id,
+                    "chat_id": chat_id,
+                    "role": role,
+                    "content": random_text(rng, 25 if role == "user" else 180),
+                    # Равномерно между созданием и последним обновлением чата (партиции по created_at)
+                    "created_at": created + (updated - created) * k / max(n_messages - 1, 1),
+                })
+                message_id += 1
+            chat_id += 1
+            chat_index += 1
+
+            if len(message_rows) >= batch_size or len(chat_rows) >= batch_size:
+                flush()
+                done = chat_index / max(chats, 1) * 100
+                print(f"\r{chat_index}/{chats} chats ({done:.1f}%), {message_id - message_start} messages, "
+                      f"{time.perf_counter() - started:.0f}s", end="", flush=True)
+    flush()
+
+    with engine.begin() as conn:
+        reset_sequences(conn)
+
+    elapsed = time.perf_counter() - started
+    print(f"\nSeeded {users} users, {chat_id - chat_start} chats, {message_id - message_start} messages in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетические данные для чатов")
+    parser.add_argument("--scale", choices=SCALES, help="готовый профиль объёма")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--chats", type=int)
+    parser.add_argument("--messages", type=int)
+    parser.add_argument("--batch-size", type=int, default=20_000, help="строк в пачке/транзакции")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    users, chats, messages = SCALES[args.scale or "tiny"]
+    seed(args.users or users, args.chats or chats, args.messages or messages, args.batch_size, args.seed)
+
+
+if __name__ == "__main__":
+    main()
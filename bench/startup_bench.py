@@ -0,0 +1,135 @@
+"""
+Бенчмарк холодного старта: импорт app.main и lifespan startup/shutdown.
+
+Каждая итерация — отдельный процесс python (как новый воркер uvicorn): замеряется время
+импорта, время входа в lifespan и какие тяжёлые SDK оказались загружены. Из одного прогона
+с -X importtime берутся самые дорогие модули. С --check бенчмарк падает, если тяжёлый SDK
+снова импортируется при старте (клиенты должны создаваться лениво, см. app/services/registry.py).
+
+Запуск:
+    python -m bench.startup_bench --iterations 10 --output startup_bench.json
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.load_test import git_revision, percentile  # noqa: E402
+
+# Не должны импортироваться при старте — только при первом обращении к сервису
+HEAVY_MODULES = ("openai", "boto3", "botocore", "yookassa", "fal_client")
+
+CHILD = """
+import json, sys, time, asyncio
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+async def lifespan():
+    async with app.main.app.router.lifespan_context(app.main.app):
+        entered = time.perf_counter()
+    return entered
+
+entered = asyncio.run(lifespan())
+stopped = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "lifespan_startup_ms": (entered - imported) * 1000,
+    "lifespan_total_ms": (stopped - imported) * 1000,
+    "heavy_loaded": [m for m in HEAVY if m in sys.modules],
+}))
+"""
+
+
+def child_env(db_url: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("OPENROUTER_API_KEY", "bench")
+    env["DB_URL"] = db_url
+    # Фоновые циклы не нужны: меряем только старт
+    env["CHAT_ARCHIVE_AFTER_DAYS"] = "0"
+    env["PYTHONPATH"] = ROOT
+    return env
+
+
+def run_once(env: dict) -> dict:
+    code = f"HEAVY = {HEAVY_MODULES!r}\n{CHILD}"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(env: dict, limit: int) -> list:
+    """Самые дорогие модули по cumulative-времени из -X importtime"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        rows.append({"module": name.rstrip(), "cumulative_ms": int(cumulative) / 1000})
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:limit]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "p50_ms": round(statistics.median(values), 1),
+        "p95_ms": round(percentile(values, 95), 1),
+        "min_ms": round(min(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время холодного старта приложения")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--db-url", help="по умолчанию — пустая SQLite во временном каталоге")
+    parser.add_argument("--top", type=int, default=15, help="сколько самых дорогих импортов показать")
+    parser.add_argument("--output", help="куда сохранить JSON-отчёт")
+    parser.add_argument("--check", action="store_true", help="ошибка, если тяжёлые SDK грузятся при старте")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = child_env(args.db_url or f"sqlite:///{tmp}/startup.db")
+        runs = [run_once(env) for _ in range(args.iterations)]
+        imports = top_imports(env, args.top)
+
+    results = {key: summarize([r[key] for r in runs]) for key in ("import_ms", "lifespan_startup_ms", "lifespan_total_ms")}
+    heavy_loaded = sorted({m for r in runs for m in r["heavy_loaded"]})
+
+    for key, stats in results.items():
+        print(f"{key:22s} p50={stats['p50_ms']:>8.1f}ms p95={stats['p95_ms']:>8.1f}ms min={stats['min_ms']:>8.1f}ms")
+    print(f"{'heavy SDKs at startup':22s} {', '.join(heavy_loaded) or 'none'}")
+    print("Top imports (cumulative):")
+    for row in imports:
+        print(f"  {row['cumulative_ms']:>8.1f}ms  {row['module']}")
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": sys.version.split()[0],
+            "iterations": args.iterations,
+        },
+        "results": results,
+        "heavy_loaded": heavy_loaded,
+        "top_imports": imports,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.check and heavy_loaded:
+        raise SystemExit(f"Heavy SDKs imported at startup: {', '.join(heavy_loaded)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# База для тестов — временный SQLite; задаём до импорта app.database
+_db_dir = tempfile.mkdtemp()
+os.environ.setdefault("DB_URL", f"sqlite:///{os.path.join(_db_dir, 'test.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app.database import Base, engine
+
+
+@pytest.fixture(autouse=True)
+def db_schema():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
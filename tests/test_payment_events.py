@@ -0,0 +1,70 @@
+from app.database import SessionLocal
+from app.models import Payment, PaymentEvent, UserWallet
+from app.services import payment_events
+
+
+def _setup_payment(payment_id="pay-1", amount=100.0):
+    db = SessionLocal()
+    try:
+        db.add(UserWallet(casdoor_id="user-1", balance=0.0))
+        db.add(Payment(yookassa_payment_id=payment_id, user_id="user-1", amount=amount, status="pending"))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _record(event_type, payment_id="pay-1") -> bool:
+    return payment_events.record_reconciled({"event": event_type, "object": {"id": payment_id}})
+
+
+def _event_id(event_type, payment_id="pay-1"):
+    db = SessionLocal()
+    try:
+        event = db.query(PaymentEvent).filter_by(event_key=f"{event_type}:{payment_id}").first()
+        return event.id if event else None
+    finally:
+        db.close()
+
+
+def _state(payment_id="pay-1"):
+    db = SessionLocal()
+    try:
+        payment = db.query(Payment).filter_by(yookassa_payment_id=payment_id).one()
+        wallet = db.query(UserWallet).filter_by(casdoor_id="user-1").one()
+        return payment.status, wallet.balance
+    finally:
+        db.close()
+
+
+def test_unconfirmed_succeeded_then_real_succeeded_credits_once():
+    _setup_payment()
+
+    # Уведомление пришло раньше, чем платёж завершился в YooKassa
+    assert _record("payment.succeeded")
+    assert payment_events.process_event(_event_id("payment.succeeded"), "pending") is None
+    assert _state() == ("pending", 0.0)
+    assert _event_id("payment.succeeded") is None
+
+    # Настоящий вебхук не отбрасывается как дубль и начисляет
+    assert _record("payment.succeeded")
+    assert payment_events.process_event(_event_id("payment.succeeded"), "succeeded") == ("user-1", 100.0)
+    assert _state() == ("succeeded", 100.0)
+
+    # Повторная доставка после начисления — дубль, баланс не меняется
+    assert not _record("payment.succeeded")
+    assert _state() == ("succeeded", 100.0)
+
+
+def test_succeeded_for_canceled_payment_is_ignored():
+    _setup_payment()
+
+    assert _record("payment.succeeded")
+    event_id = _event_id("payment.succeeded")
+    assert payment_events.process_event(event_id, "canceled") is None
+    assert _state() == ("pending", 0.0)
+
+    db = SessionLocal()
+    try:
+        assert db.get(PaymentEvent, event_id).status == "ignored"
+    finally:
+        db.close()